@@ -1,19 +1,38 @@
 #!/usr/bin/env python
+from pathlib import Path
+import logging
 import pyrinex as pr
 from pyrinex.plots import plotnav, plotobs
 
 if __name__ == '__main__':
     from argparse import ArgumentParser
     p = ArgumentParser(description='example of reading RINEX 2/3 Navigation/Observation file')
-    p.add_argument('rinexfn',help='path to RINEX 2 or RINEX 3 file')
-    p.add_argument('-o','--outfn',help='write data as NetCDF4 file')
+    p.add_argument('rinexfn',help='path to RINEX 2 or RINEX 3 file, or directories / glob patterns to convert many files',nargs='+')
+    p.add_argument('-o','--outfn',help='write data as NetCDF4 file (output directory for many files)')
     p.add_argument('-q','--quiet',help='do not generate plots or print unneeded text (for HPC/cloud)',action='store_true')
     p.add_argument('-use',help='select which GNSS systems to use (for now, GPS only)',nargs='+',default='G')
+    p.add_argument('-t','--tlim',help='read only epochs in this time range e.g. 2010-03-05T01:00 2010-03-05T02:00',nargs=2)
+    p.add_argument('-i','--interval',help='decimate to this interval [seconds]',type=float)
+    p.add_argument('-m','--meas',help='read only these observation types e.g. C1 P2 L1 L2',nargs='+')
+    p.add_argument('-c','--compact',help='LLI/SSI as uint8 in memory and NetCDF; "-c float32" also SNR/Doppler as float32',
+                   nargs='?',const=True,default=False,choices=[True,'float32'])
+    p.add_argument('-w','--workers',help='parse OBS file in this many processes (convert this many files at once for many files)',type=int)
+    p.add_argument('-f','--force',help='convert many files even if their NetCDF output is up to date',action='store_true')
+    p.add_argument('-s','--summary',help='write per-file timing and errors of converting many files to this CSV file')
     p = p.parse_args()
 
     verbose = not p.quiet
+# %% batch conversion
+    if len(p.rinexfn) > 1 or not Path(p.rinexfn[0]).expanduser().is_file():
+        logging.basicConfig(level=logging.WARNING if p.quiet else logging.INFO)
+        res = pr.convert_many(p.rinexfn, p.outfn, p.workers, p.force, p.summary, p.use, p.tlim, p.interval, p.meas,
+                              compact=p.compact)
+        for r in res:
+            print('{status:8s} {seconds:8.2f} s  {file}  {error}'.format(**r))
+        raise SystemExit(any(r['status'] == 'error' for r in res))
 
-    obs,nav = pr.readrinex(p.rinexfn, p.outfn, p.use, verbose)
+    obs,nav = pr.readrinex(p.rinexfn[0], p.outfn, p.use, verbose, p.tlim, p.interval, p.meas, p.workers,
+                           compact=p.compact)
 # %% plots
     if verbose:
         from matplotlib.pyplot import show
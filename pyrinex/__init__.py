@@ -1,28 +1,39 @@
 from pathlib import Path
-import logging
 import xarray
-from time import time
-import numpy as np
-from typing import Union
+from typing import Union, Iterator
 #
-from .rinex2 import _rinexnav2, _scan2
-from .rinex3 import _rinexnav3, _scan3
-
-COMPLVL = 1  # for NetCDF compression. too high slows down with little space savings.
-
-def readrinex(rinexfn:Path, outfn:Path=None, use:Union[str,list,tuple]=None, verbose:bool=True) -> xarray.Dataset:
+from .rinex2 import _rinexnav2, _scan2, _iter2
+from .rinex3 import _rinexnav3, _scan3, _iter3
+from .index import obsindex, load_index, epochrange
+from .parallel import rinexobs_parallel
+from .batch import convert_many, rinextype
+from .compress import opener, compression
+from .hatanaka import crxversion, CRX
+from .cache import cachedir, cachekey, load, store
+from .accumulate import compactobs
+from .netcdf import writeobs, readnc, COMPLVL
+from .zarrstore import writezarr, readzarr
+from .follow import follow_obs
+from .header import rinexheader, RinexHeader
+from .mfrinex import open_mfrinex
+
+def readrinex(rinexfn:Path, outfn:Path=None, use:Union[str,list,tuple]=None, verbose:bool=True,
+              tlim:tuple=None, interval:float=None, meas:Union[str,list,tuple]=None,
+              workers:int=None, cache_dir:Path=None, compact:Union[bool,str]=False,
+              format:str=None) -> xarray.Dataset:
     nav = None
     obs = None
     rinexfn = Path(rinexfn).expanduser()
 
-    fnl = rinexfn.name.lower()
-    if fnl.endswith('n') or fnl.endswith('n.rnx'):
-        nav = rinexnav(rinexfn, outfn)
-    elif fnl.endswith('o') or fnl.endswith('o.rnx'):
-        obs = rinexobs(rinexfn, outfn, use=use, verbose=verbose)
-    elif rinexfn.suffix.endswith('.nc'):
-        nav = rinexnav(rinexfn)
-        obs = rinexobs(rinexfn)
+    ftype = rinextype(rinexfn)
+    if ftype == 'nav':
+        nav = rinexnav(rinexfn, outfn, cache_dir=cache_dir)
+    elif ftype == 'obs':
+        obs = rinexobs(rinexfn, outfn, use=use, verbose=verbose, tlim=tlim, interval=interval, meas=meas, workers=workers,
+                       cache_dir=cache_dir, compact=compact, format=format)
+    elif ftype == 'nc':
+        nav = rinexnav(rinexfn, use=use, tlim=tlim)
+        obs = rinexobs(rinexfn, use=use, tlim=tlim, meas=meas)
     else:
         raise ValueError("I dont know what type of file you're trying to read: {}".format(rinexfn))
 
@@ -32,93 +43,203 @@ def readrinex(rinexfn:Path, outfn:Path=None, use:Union[str,list,tuple]=None, ver
 def getRinexVersion(fn:Path) -> float:
     fn = Path(fn).expanduser()
 
-    with fn.open('r') as f:
+    with opener(fn) as f:
         """verify RINEX version"""
-        line = f.readline()
+        line = f.readline().decode('ascii','replace')
+        if CRX in line[60:]:  # Hatanaka compressed: RINEX header follows the 2 CRINEX lines
+            f.readline()
+            line = f.readline().decode('ascii','replace')
         return float(line[:9])
 
 #%% Navigation file
-def rinexnav(fn:Path, ofn:Path=None, group:str='NAV') -> xarray.Dataset:
+def rinexnav(fn:Path, ofn:Path=None, group:str='NAV', cache_dir:Path=None,
+             use:Union[str,list,tuple]=None, tlim:tuple=None) -> xarray.Dataset:
+    """
+    cache_dir: keep the parsed data in this directory, default environment variable PYRINEX_CACHE (see pyrinex.cache)
+    use: systems to read e.g. 'E' or ['G','R'] of a RINEX 3 or NetCDF file, default all.
+         A RINEX 3 file of several systems, e.g. mixed *_MN.rnx, is one Dataset of all their records.
+    tlim: for NetCDF fn, read only these times (see rinexobs())
+    """
 
     fn = Path(fn).expanduser()
     if fn.suffix=='.nc':
-        try:
-            return xarray.open_dataset(fn, group=group)
-        except OSError:
-            logging.error('Group {} not found in {}'.format(group,fn))
-            return
+        return readnc(fn, group, use, tlim=tlim)
 
-    ver = getRinexVersion(fn)
-    if int(ver) == 2:
-        nav =  _rinexnav2(fn)
-    elif int(ver) == 3:
-        nav = _rinexnav3(fn)
-    else:
-        raise ValueError('unknown RINEX verion {}  {}'.format(ver,fn))
+    cache = cachedir(cache_dir)
+    nav = None
+    if cache:
+        key = cachekey(fn, 'nav', use=use)
+        nav = load(cache, key)
+
+    if nav is None:
+        ver = getRinexVersion(fn)
+        if int(ver) == 2:
+            nav =  _rinexnav2(fn)
+        elif int(ver) == 3:
+            nav = _rinexnav3(fn, use)
+        else:
+            raise ValueError('unknown RINEX verion {}  {}'.format(ver,fn))
+
+        if cache:
+            store(cache, key, nav)
 
     if ofn:
         ofn = Path(ofn).expanduser()
         print('saving NAV data to',ofn)
-        wmode='a' if ofn.is_file() else 'w'
-        nav.to_netcdf(ofn, group=group, mode=wmode)
+        if ofn.suffix == '.zarr':
+            nav.to_zarr(ofn, group=group, mode='w')
+        else:
+            wmode='a' if ofn.is_file() else 'w'
+            nav.to_netcdf(ofn, group=group, mode=wmode)
 
     return nav
 
 # %% Observation File
 def rinexobs(fn:Path, ofn:Path=None, use:Union[str,list,tuple]=None,
-             group:str='OBS',verbose:bool=False) -> xarray.Dataset:
+             group:str='OBS',verbose:bool=False, tlim:tuple=None, interval:float=None,
+             meas:Union[str,list,tuple]=None, workers:int=None, cache_dir:Path=None,
+             compact:Union[bool,str]=False, format:str=None) -> xarray.Dataset:
     """
     Program overviw:
     1) scan the whole file for the header and other information using scan(lines)
     2) each epoch is read
 
+    tlim: (start, stop) times of epochs to read, inclusive.
+          The epoch index (see obsindex(), used from its sidecar file if present)
+          lets the read seek directly to the first epoch in tlim.
+    interval: [seconds] decimate to epochs on this grid from the start of the day, e.g. 30.
+          Epochs outside tlim or off the grid are skipped without parsing their satellite lines.
+    meas: observation types to read e.g. ['C1','P2','L1','L2'] or ['C1C','C2W','L1C','L2W'],
+          with their LLI/SSI. An entry also selects the types it is a prefix of, e.g. 'L1' -> 'L1C'.
+          Other observation types are not decoded.
+    workers: parse the file in this many processes, each taking a range of epochs (Python >= 3.8).
+          Compressed files are parsed in one process.
+    cache_dir: keep the parsed data in this directory, and read it from there while fn and the options are the same.
+          Default is environment variable PYRINEX_CACHE, no cache if neither is set (see pyrinex.cache).
+    compact: True: LLI/SSI as uint8, 255 where missing (_FillValue in NetCDF output).
+          'float32': also SNR and Doppler as float32. Phase and range are always float64.
+
+    format: of ofn, 'netcdf' or 'zarr', default from the ofn suffix (.zarr for Zarr).
+          Zarr output is appended a chunk of epochs at a time as the file is parsed (see iter_obs()),
+          and the returned data is lazily read from the store. workers and cache_dir don't apply to it.
+
+    fn may be a NetCDF file written by rinexobs(), opened lazily so that use, meas and tlim
+    read only the chunks they select. The systems of a RINEX 3 file are groups OBS/G, OBS/R, ... of ofn.
+    A .zarr store is opened the same way.
+
+    fn may be compressed (.gz .Z .bz2 .xz .zip), it's decompressed as it's read.
+    Hatanaka compressed (Compact RINEX .YYd .crx) files are decoded directly, also when compressed.
+
     rinexobs() returns the data in an xarray.Dataset
     """
 
     fn = Path(fn).expanduser()
     if fn.suffix=='.nc':
-        try:
-            return xarray.open_dataset(fn, group=group)
-        except OSError:
-            logging.error('Group {} not found in {}'.format(group,fn))
-            return
+        return readnc(fn, group, use, meas, tlim)
+    elif fn.suffix=='.zarr':
+        return readzarr(fn, group, use, meas, tlim)
+
+    if ofn and (format or ('zarr' if Path(ofn).suffix == '.zarr' else 'netcdf')) == 'zarr':
+        ofn = Path(ofn).expanduser()
+        print('saving OBS data to',ofn)
+        writezarr(iter_obs(fn, use=use, meas=meas, tlim=tlim, interval=interval, verbose=verbose, compact=compact),
+                  ofn, group, compact)
+        return readzarr(ofn, group)
+
+    cache = cachedir(cache_dir)
+    obs = None
+    if cache:
+        key = cachekey(fn, 'obs', use=use, tlim=tlim, interval=interval, meas=meas, compact=compact)
+        obs = load(cache, key)
+
+    if obs is None:
+        obs = _rinexobs(fn, use, verbose, tlim, interval, meas, workers)
+        if compact:
+            obs = _compact(obs, compact)
+        if cache:
+            store(cache, key, obs)
+
+
+    if ofn:
+        ofn = Path(ofn).expanduser()
+        print('saving OBS data to',ofn)
+        writeobs(obs, ofn, group, compact)
+
+    return obs
+
+
+def _compact(obs:Union[xarray.Dataset,dict], compact:Union[bool,str]) -> Union[xarray.Dataset,dict]:
+    if isinstance(obs,dict):
+        return {k:compactobs(v, compact == 'float32') for k,v in obs.items()}
 
+    return compactobs(obs, compact == 'float32')
 
 
-    tic = time()
+def _rinexobs(fn:Path, use:Union[str,list,tuple], verbose:bool, tlim:tuple, interval:float,
+              meas:Union[str,list,tuple], workers:int) -> xarray.Dataset:
+    """parse OBS file fn, see rinexobs()"""
+    ver = getRinexVersion(fn)
+
+    if workers and workers > 1 and int(ver) in (2,3) and _seekable(fn):
+        obs = rinexobs_parallel(fn, ver, workers, use, tlim, interval, meas)
+        if isinstance(obs,dict) and len(obs) == 1:
+            obs = next(iter(obs.values()))
+    elif int(ver) == 2:
+        offsets = _offsets(fn, tlim)
+        obs = _scan2(fn, use, verbose, offsets, tlim, interval, meas)
+    elif int(ver) == 3:
+        offsets = _offsets(fn, tlim)
+        obs = _scan3(fn, use, verbose, offsets, tlim, interval, meas)  # one pass over the file for all systems
+        if len(obs) == 1:
+            obs = next(iter(obs.values()))
+    else:
+        raise ValueError('unknown RINEX verion {}  {}'.format(ver,fn))
+
+    return obs
+
+
+def iter_obs(fn:Path, chunk_epochs:int=3600, use:Union[str,list,tuple]=None,
+             meas:Union[str,list,tuple]=None, tlim:tuple=None, interval:float=None,
+             verbose:bool=False, compact:Union[bool,str]=False) -> Iterator[xarray.Dataset]:
+    """
+    iterate over a RINEX 2/3 OBS file, chunk_epochs epochs at a time
+
+    Uses the same reader as rinexobs(), with the same options.
+    Each chunk is an xarray.Dataset (dict of Datasets for several RINEX 3 systems)
+    carrying the header metadata, so peak memory is proportional to chunk_epochs, not the file size.
+    """
+    fn = Path(fn).expanduser()
+    offsets = _offsets(fn, tlim)
+
     ver = getRinexVersion(fn)
     if int(ver) == 2:
-        obs = _scan2(fn, use, verbose)
+        for obs in _iter2(fn, use, verbose, offsets, tlim, interval, meas, chunk_epochs):
+            yield _compact(obs, compact) if compact else obs
     elif int(ver) == 3:
-        if use is None or isinstance(use,str):
-            obs = _scan3(fn, use, verbose)
-        elif isinstance(use,(tuple,list,np.ndarray)):
-            if len(use) == 1:
-                obs = _scan3(fn, use[0], verbose)
-            else:
-                obs = {}
-                for u in use:
-                    obs[u] = _scan3(fn, u, verbose)
+        for obs in _iter3(fn, use, verbose, offsets, tlim, interval, meas, chunk_epochs):
+            if len(obs) == 1:
+                obs = next(iter(obs.values()))
+            yield _compact(obs, compact) if compact else obs
     else:
         raise ValueError('unknown RINEX verion {}  {}'.format(ver,fn))
-        print("finished in {:.2f} seconds".format(time()-tic))
 
 
-    if ofn:
-        ofn = Path(ofn).expanduser()
-        print('saving OBS data to',ofn)
-        wmode='a' if ofn.is_file() else 'w'
+def _offsets(fn:Path, tlim:tuple) -> tuple:
+    """
+    byte range of the epochs in tlim from the epoch index, None to read the whole file
 
+    compressed files can't seek, they're read from the start and the epochs outside tlim skipped.
+    """
+    if tlim is None or not _seekable(fn):
+        return
 
-        if isinstance(obs,xarray.Dataset):
-            enc = {k:{'zlib':True,'complevel':COMPLVL,'fletcher32':True} for k in obs.data_vars}
-            obs.to_netcdf(ofn, group=group, mode=wmode,encoding=enc)
-        elif isinstance(obs,dict):
-            for k,v in obs.items():
-                enc = {k:{'zlib':True,'complevel':COMPLVL,'fletcher32':True} for k in v.data_vars}
-                name = k+'-'+ofn.name
-                obs[k].to_netcdf(ofn.parent/name,group=group,mode=wmode,encoding=enc)
+    idx = load_index(fn)
+    if idx is None:
+        idx = obsindex(fn)
 
-    return obs
+    return epochrange(idx, tlim)
 
 
+def _seekable(fn:Path) -> bool:
+    """epochs can be read from any epoch boundary: not compressed, and not Hatanaka compressed"""
+    return not compression(fn) and not crxversion(fn)
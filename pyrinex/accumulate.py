@@ -0,0 +1,131 @@
+"""
+Epoch accumulation for OBS readers.
+
+Appending epochs to an xarray.Dataset with xarray.concat copies the whole
+Dataset for every epoch, which is quadratic in the number of epochs.
+Instead, each epoch's (sv x variable) values are appended to flat, growable
+NumPy buffers alongside their time and SV index, and the (time x sv) Dataset
+is built just once at the end.
+"""
+import numpy as np
+import xarray
+from typing import Sequence
+
+
+class ObsAccumulator:
+    """
+    collect epochs of (sv x variable) values, then build a (time x sv) Dataset
+
+    names: data variable name for each column of the values passed to add()
+
+    SV ordering matches what successive xarray.concat(join='outer') gave:
+    the SV order of the file is kept if every epoch has the same SV list,
+    otherwise the SVs are sorted.
+    """
+
+    def __init__(self, names:Sequence[str], nalloc:int=4096):
+        self.names = list(names)
+        self.times = []
+        self.svs = {}  # SV -> column, running union in order of first appearance
+        self._first = None
+        self.resort = False
+
+        self._n = 0
+        self._tidx = np.empty(nalloc, dtype=np.int64)
+        self._sidx = np.empty(nalloc, dtype=np.int64)
+        self._vals = np.empty((nalloc, len(self.names)))
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def _grow(self, n:int):
+        """amortized doubling keeps total copying linear in the number of epochs"""
+        N = self._tidx.size
+        if n <= N:
+            return
+
+        N = max(n, 2*N)
+        self._tidx = np.resize(self._tidx, N)
+        self._sidx = np.resize(self._sidx, N)
+        vals = np.empty((N, self._vals.shape[1]))
+        vals[:self._n] = self._vals[:self._n]
+        self._vals = vals
+
+    def add(self, time, sv:Sequence[str], vals:np.ndarray):
+        """
+        append one epoch
+
+        time: epoch time
+        sv: satellites of this epoch
+        vals: (len(sv), len(names)) values, one row per satellite
+        """
+        t = len(self.times)
+        self.times.append(time)
+
+        sv = list(sv)
+        if sv:
+            if not self._first:
+                self._first = sv
+            elif not self.resort and sv != self._first:
+                self.resort = True
+
+        n = len(sv)
+        i = self._n
+        self._grow(i + n)
+
+        self._tidx[i:i+n] = t
+        self._sidx[i:i+n] = [self.svs.setdefault(s, len(self.svs)) for s in sv]
+        self._vals[i:i+n] = vals
+        self._n += n
+
+    def to_dataset(self, attrs:dict=None) -> xarray.Dataset:
+        """build the (time x sv) Dataset from everything accumulated so far"""
+        sv = sorted(self.svs) if self.resort else list(self.svs)
+        # map accumulation column to output column
+        col = np.empty(len(sv), dtype=np.int64)
+        col[[self.svs[s] for s in sv]] = np.arange(len(sv))
+
+        t = self._tidx[:self._n]
+        j = col[self._sidx[:self._n]]
+
+        dsf = {}
+        for i, k in enumerate(self.names):
+            d = np.full((len(self.times), len(sv)), np.nan)
+            d[t, j] = self._vals[:self._n, i]
+            dsf[k] = (('time', 'sv'), d)
+
+        return xarray.Dataset(dsf,
+                              coords={'time': self.times, 'sv': np.array(sv, dtype=str)},
+                              attrs=attrs)
+
+
+FILL = 255  # missing LLI/SSI of compact datasets
+
+
+def isflag(name:str) -> bool:
+    """LLI or SSI variable e.g. L1lli, C1Cssi"""
+    return name.endswith('lli') or name.endswith('ssi')
+
+
+def isfloat32(name:str) -> bool:
+    """SNR or Doppler variable e.g. S1, D1C, that float32 holds to their RINEX precision"""
+    return name[:1] in ('S','D') and not isflag(name)
+
+
+def compactobs(obs:xarray.Dataset, float32:bool=False) -> xarray.Dataset:
+    """
+    LLI/SSI variables of obs as uint8 with FILL where missing, and with float32=True SNR/Doppler as float32
+
+    phase and range stay float64, which their 14 significant digits need.
+    """
+    for k in list(obs.data_vars):
+        d = obs[k].values
+        if isflag(k) and d.dtype != np.uint8:
+            c = np.full(d.shape, FILL, dtype=np.uint8)
+            ok = np.isfinite(d)
+            c[ok] = d[ok]
+            obs[k] = (obs[k].dims, c)
+        elif float32 and isfloat32(k):
+            obs[k] = obs[k].astype(np.float32)
+
+    return obs
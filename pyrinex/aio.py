@@ -0,0 +1,171 @@
+"""
+asyncio reading of RINEX 2/3 OBS text streamed over a socket, without spooling it to disk.
+
+The header is read line by line from an asyncio.StreamReader, then each epoch is gathered
+until all its lines have arrived. Complete epochs are parsed in batches with the usual reader.
+Each stream is a coroutine, so the streams of many stations are read concurrently in one event loop.
+
+The streams are asynchronous iterators (ObsStream) rather than asynchronous generators,
+so this works from Python 3.5.2 on. It's imported as pyrinex.aio.
+"""
+import asyncio
+import io
+import logging
+from math import ceil
+import xarray
+from typing import Union
+#
+from .rinex2 import _header2, _epochs2, _nlines2
+from .rinex3 import _getObsTypes, _epochs3, _nlines3
+
+
+class ObsStream:
+    """
+    asynchronous iterator over batches of the epochs of an OBS stream, until the end of the stream
+
+    A batch (Dataset, or dict of Datasets for several RINEX 3 systems) is returned once it has chunk_epochs epochs,
+    or when no further epoch is complete within flush seconds (None: wait for chunk_epochs).
+    An epoch cut off by the end of the stream is dropped.
+
+    reader: asyncio.StreamReader, or None to connect to address (host, port) on the first iteration
+    name: the 'filename' attribute of the data
+    use, meas, interval: as rinexobs()
+    """
+
+    def __init__(self, reader:asyncio.StreamReader=None, use:Union[str,list,tuple]=None,
+                 meas:Union[str,list,tuple]=None, interval:float=None, chunk_epochs:int=60,
+                 flush:float=1., name:str='stream', verbose:bool=False, address:tuple=None):
+        self.reader = reader
+        self.writer = None
+        self.address = address
+        self.use = use
+        self.meas = meas
+        self.interval = interval
+        self.chunk_epochs = chunk_epochs
+        self.flush = flush
+        self.name = name
+        self.verbose = verbose
+
+        self.header = None
+        self.epochs = []  # complete epochs not yet parsed
+        self.lines = []  # epoch being received
+        self.batches = []  # parsed, not yet returned
+        self.done = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Union[xarray.Dataset,dict]:
+        while not self.batches:
+            if self.done:
+                await self.aclose()
+                raise StopAsyncIteration
+            if self.reader is None:
+                self.reader, self.writer = await asyncio.open_connection(*self.address)
+            if self.header is None:
+                await self._readheader()
+            else:
+                await self._readepochs()
+
+        return self.batches.pop(0)
+
+    async def aclose(self):
+        """close the connection opened to address"""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    async def _readheader(self):
+        buf = []
+        while True:
+            l = await self.reader.readline()
+            if not l:
+                logging.error('{} ended before END OF HEADER'.format(self.name))
+                self.done = True
+                return
+            buf.append(l)
+            if b'END OF HEADER' in l:
+                break
+
+        h = io.BytesIO(b''.join(buf))
+        self.ver = float(buf[0][:9])
+        if int(self.ver) == 2:
+            header = _header2(h)
+            self.fields = None
+            self.Nl_sv = int(ceil(header['Nobs']/5))
+        elif int(self.ver) == 3:
+            self.fields, header, _ = _getObsTypes(h, self.use)
+            self.Nl_sv = None
+        else:
+            raise ValueError('unknown RINEX verion {}  {}'.format(self.ver,self.name))
+        header['filename'] = self.name
+        self.header = header
+
+    async def _readepochs(self):
+        """read lines until a batch is due or the stream ends"""
+        while not self.batches:
+            try:
+                if self.epochs and self.flush is not None:
+                    l = await asyncio.wait_for(self.reader.readline(), self.flush)
+                else:
+                    l = await self.reader.readline()
+            except asyncio.TimeoutError:  # a partly received line stays in the reader's buffer
+                self._parse()
+                continue
+
+            if not l:
+                self._parse()
+                if self.lines:
+                    logging.warning('{} ended within an epoch, which was dropped'.format(self.name))
+                self.done = True
+                return
+            if not self.lines and not l.strip():
+                continue
+
+            self.lines.append(l)
+            N = _nlines2(self.lines[0], self.Nl_sv) if int(self.ver) == 2 else _nlines3(self.lines[0])
+            if len(self.lines) == N:
+                self.epochs.append(b''.join(self.lines))
+                self.lines = []
+
+            if len(self.epochs) >= self.chunk_epochs:
+                self._parse()
+
+    def _parse(self):
+        """parse the complete epochs into batches"""
+        self.batches += _parse(self.epochs, self.header, self.fields, self.use, self.meas, self.interval,
+                               self.verbose)
+        self.epochs = []
+
+
+def aiter_obs(reader:asyncio.StreamReader, **kwargs) -> ObsStream:
+    """
+    batches of the epochs of the OBS stream from reader, until the end of the stream: async for obs in aiter_obs(reader)
+
+    options as ObsStream: use, meas, interval, chunk_epochs, flush, name, verbose
+    """
+    return ObsStream(reader, **kwargs)
+
+
+def connect_obs(host:str, port:int, **kwargs) -> ObsStream:
+    """batches of the epochs of the OBS stream served at host:port, options as aiter_obs()"""
+    kwargs.setdefault('name', '{}:{}'.format(host, port))
+    return ObsStream(None, address=(host, port), **kwargs)
+
+
+def _parse(epochs:list, header:dict, fields:dict, use, meas, interval, verbose:bool) -> list:
+    """Datasets of the complete epochs, leaving out those with no epochs left after decimation"""
+    if not epochs:
+        return []
+
+    f = io.BytesIO(b''.join(epochs))
+    if fields is None:
+        data = list(_epochs2(f, header, use, meas, None, interval, None, None, verbose))
+    else:
+        data = []
+        for obs in _epochs3(f, fields, header, meas, None, interval, None, None, verbose):
+            if len(obs) == 1:
+                obs = next(iter(obs.values()))
+            data.append(obs)
+
+    return [d for d in data if any(ds.time.size for ds in ([d] if isinstance(d, xarray.Dataset) else d.values()))]
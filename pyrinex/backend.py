@@ -0,0 +1,214 @@
+"""
+xarray backend for RINEX 2/3 OBS files: xarray.open_dataset(fn, engine='rinex')
+
+Opening a file reads its header and builds the epoch index (see pyrinex.index), which gives the time coordinate.
+The sv coordinate comes from the satellite IDs of the epochs, read through mmap without decoding observations.
+Each variable is a lazily indexed array: indexing it parses just the byte range of the epochs
+it selects, decoding only that observation type.
+
+A RINEX 3 Dataset is one system, use='G' etc., default the first system of the header.
+Compressed and Hatanaka compressed files can't seek, they're read whole when opened.
+"""
+from pathlib import Path
+import mmap
+import numpy as np
+import xarray
+from xarray.backends import BackendEntrypoint, BackendArray
+from xarray.core import indexing
+from typing import Union
+#
+from .index import obsindex, load_index, _epochlines, _rows
+from .batch import rinextype
+from .compress import compression
+from .hatanaka import crxversion
+from .rinex2 import _header2, _epochs2, _plan2, _attrs2, _use
+from .rinex3 import _getObsTypes, _epochs3, _plan3, _attrs3
+from . import getRinexVersion, rinexobs, rinexheader
+
+DATA = (0, 1, 6)  # epoch flags of epochs with observations
+
+
+class RinexBackendEntrypoint(BackendEntrypoint):
+    """open RINEX OBS files lazily with xarray.open_dataset(fn, engine='rinex', use=None, meas=None)"""
+
+    description = 'Lazily read RINEX 2/3 OBS files with pyrinex'
+    url = 'https://github.com/scivision/pyrinex'
+    open_dataset_parameters = ('filename_or_obj', 'drop_variables', 'use', 'meas')
+
+    def open_dataset(self, filename_or_obj, *, drop_variables=None,
+                     use:Union[str,list,tuple]=None, meas:Union[str,list,tuple]=None) -> xarray.Dataset:
+        """
+        use: RINEX 2: systems to keep, as rinexobs(). RINEX 3: the system of the Dataset.
+        meas: observation types, as rinexobs()
+        """
+        fn = Path(filename_or_obj).expanduser()
+        if compression(fn) or crxversion(fn):
+            ds = rinexobs(fn, use=_system(fn, use), meas=meas)
+        else:
+            store = RinexStore(fn, use, meas)
+            ds = xarray.Dataset({k: (('time','sv'), indexing.LazilyIndexedArray(RinexArray(store, k)))
+                                 for k in store.names},
+                                coords={'time': store.time, 'sv': store.sv},
+                                attrs=store.attrs)
+
+        if drop_variables:
+            ds = ds.drop_vars(drop_variables, errors='ignore')
+
+        return ds
+
+    def guess_can_open(self, filename_or_obj) -> bool:
+        try:
+            return rinextype(filename_or_obj) == 'obs'
+        except TypeError:
+            return False
+
+
+class RinexStore:
+    """
+    epochs, satellites and header of an OBS file, and reading of variables over a range of epochs
+
+    use, meas: as RinexBackendEntrypoint.open_dataset()
+    """
+
+    def __init__(self, fn:Path, use:Union[str,list,tuple]=None, meas:Union[str,list,tuple]=None):
+        self.fn = fn
+
+        with fn.open('rb') as f:
+            ver = float(f.read(9))
+            f.seek(0)
+            if int(ver) == 2:
+                self.header = _header2(f)
+                self.use = _use(use)
+                self.fields = None
+                self.names = _plan2(self.header['fields'], meas)[1]
+                self.attrs = _attrs2(self.header)
+            elif int(ver) == 3:
+                self.fields, self.header, _ = _getObsTypes(f, _system(fn, use))
+                self.use = next(iter(self.fields))
+                self.names = _plan3(self.fields, meas)[1][self.use]
+                self.attrs = _attrs3(self.header)
+            else:
+                raise ValueError('unknown RINEX verion {}  {}'.format(ver,fn))
+            start = f.tell()
+
+        idx = load_index(fn)
+        if idx is None:
+            idx = obsindex(fn)
+        data = np.isin(idx['flag'], DATA)
+        self.time = idx['time'][data]
+        self.offset = idx['offset'][data]
+        # each data epoch's data ends where the next epoch of any kind begins
+        end = np.append(idx['offset'][1:], -1)
+        self.end = end[data]
+
+        with fn.open('rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if int(ver) == 2:
+                self.sv = _svs2(mm, start, idx[data], self.use)
+                if self.offset.size:
+                    # as the reader, the receiver clock offset of the first epoch
+                    self.attrs['toffset'] = mm[self.offset[0]:mm.find(b'\n', self.offset[0])+1].decode('ascii','replace')[68:80]
+            else:
+                self.sv = _svs3(mm, start, idx[data], self.use)
+
+    def read(self, name:str, i:np.ndarray) -> np.ndarray:
+        """(len(i), sv) values of variable name at epochs i, parsing only epochs min(i) to max(i)"""
+        out = np.full((i.size, self.sv.size), np.nan)
+        if not i.size:
+            return out
+
+        i0, i1 = i.min(), i.max()
+        meas = [name[:-3] if name.endswith(('lli','ssi')) else name]
+        stop = int(self.end[i1]) if self.end[i1] >= 0 else None
+        with self.fn.open('rb') as f:
+            f.seek(int(self.offset[i0]))
+            if self.fields is None:
+                ds = next(_epochs2(f, self.header, self.use, meas, None, None, stop, None))
+            else:
+                ds = next(_epochs3(f, self.fields, self.header, meas, None, None, stop, None))[self.use]
+
+        assert ds.time.size == i1 - i0 + 1, 'epochs read incorrectly'
+        return ds[name].reindex(sv=self.sv).values[i - i0]
+
+
+class RinexArray(BackendArray):
+    """one (time, sv) variable of a RinexStore"""
+
+    def __init__(self, store:RinexStore, name:str):
+        self.store = store
+        self.name = name
+        self.shape = (store.time.size, store.sv.size)
+        self.dtype = np.dtype(float)
+
+    def __getitem__(self, key:indexing.ExplicitIndexer) -> np.ndarray:
+        return indexing.explicit_indexing_adapter(key, self.shape, indexing.IndexingSupport.OUTER, self._getitem)
+
+    def _getitem(self, key:tuple) -> np.ndarray:
+        it, isv = key
+        i = np.arange(self.shape[0])[it]
+        values = self.store.read(self.name, np.atleast_1d(i))[:, isv]
+
+        return values[0] if np.ndim(i) == 0 else values
+
+
+def _system(fn:Path, use:Union[str,list,tuple]) -> str:
+    """the one RINEX 3 system of the Dataset"""
+    use = _use(use)
+    if int(getRinexVersion(fn)) != 3:
+        return use
+
+    if use is None:
+        return next(iter(rinexheader(fn).fields))
+    elif not isinstance(use, str):
+        if len(use) > 1:
+            raise ValueError('a RINEX 3 Dataset is one system, not {}'.format(use))
+        use = use[0]
+
+    return use
+
+
+def _order(svs:list) -> np.ndarray:
+    """satellites in the order the reader gives: the file's if every epoch has the same, else sorted"""
+    first = next((s for s in svs if s), [])
+    if all(s == first for s in svs if s):
+        return np.array(first, dtype=str)
+
+    return np.array(sorted(set().union(*svs)), dtype=str)
+
+
+def _svs2(mm:mmap.mmap, start:int, idx:np.ndarray, use) -> np.ndarray:
+    """satellites of the RINEX 2 data epochs idx, from their epoch lines"""
+    lines = _epochlines(mm, start)
+    pos = np.searchsorted(lines, idx['offset'])
+    Nl = np.maximum(1, np.ceil(idx['nsv']/12).astype(int))
+
+    # epoch line and its continuation lines of more satellites
+    il = np.repeat(pos, Nl) + np.arange(Nl.sum()) - np.repeat(np.cumsum(Nl) - Nl, Nl)
+    c = np.ascontiguousarray(_rows(mm, lines[il], 68)[:, 32:68])
+    ids = np.char.strip(c.view('S3').astype(str))
+
+    svs = []
+    j = 0
+    for n,nl in zip(idx['nsv'], Nl):
+        sv = ids[j:j+nl].ravel()[:n].tolist()
+        svs.append([s for s in sv if use is None or s[0] in use])
+        j += nl
+
+    return _order(svs)
+
+
+def _svs3(mm:mmap.mmap, start:int, idx:np.ndarray, system:str) -> np.ndarray:
+    """satellites of system in the RINEX 3 data epochs idx, from the start of their satellite lines"""
+    lines = _epochlines(mm, start)
+    pos = np.searchsorted(lines, idx['offset'])
+    N = idx['nsv'].astype(int)
+
+    il = np.repeat(pos + 1, N) + np.arange(N.sum()) - np.repeat(np.cumsum(N) - N, N)
+    ids = np.ascontiguousarray(_rows(mm, lines[il], 3)).view('S3')[:,0].astype(str)
+
+    svs = []
+    j = 0
+    for n in N:
+        svs.append([s for s in ids[j:j+n].tolist() if s[0] == system])
+        j += n
+
+    return _order(svs)
@@ -0,0 +1,153 @@
+"""
+Batch conversion of many RINEX files to NetCDF in a process pool.
+"""
+from pathlib import Path
+import os
+import csv
+import glob
+import re
+import logging
+from time import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Union, List, Sequence
+#
+from .compress import stem
+
+FIELDS = ('file', 'output', 'status', 'seconds', 'error')
+# file type by name, without a compression suffix
+NAMES = (('nav', re.compile(r'(\.\d\dn|_[A-Z]N\.rnx)$', re.IGNORECASE)),
+         ('obs', re.compile(r'(\.\d\d[od]|_[A-Z]O\.(rnx|crx))$', re.IGNORECASE)),
+         ('nc', re.compile(r'\.nc$', re.IGNORECASE)))
+
+
+def rinextype(fn:Path) -> str:
+    """
+    'obs', 'nav' or 'nc' from the file name, None if it isn't a RINEX or NetCDF file name
+
+    RINEX names are short .YYo/.YYn or long _MO.rnx/_MN.rnx, Hatanaka compressed .YYd and _MO.crx are 'obs'.
+    a compression suffix is ignored e.g. demo.10o.gz is 'obs'.
+    """
+    name = stem(fn)
+    for t,pat in NAMES:
+        if pat.search(name):
+            return t
+
+
+def findrinex(paths:Union[str,Path,Sequence]) -> List[Path]:
+    """
+    RINEX OBS/NAV files from file names, directories and glob patterns, sorted without duplicates
+
+    a directory gives the RINEX files directly inside it.
+    """
+    if isinstance(paths, (str,Path)):
+        paths = [paths]
+
+    flist = set()
+    for p in paths:
+        p = Path(p).expanduser()
+        if p.is_dir():
+            flist.update(f for f in p.iterdir() if f.is_file() and rinextype(f) in ('obs','nav'))
+        elif p.is_file():
+            flist.add(p)
+        else:
+            flist.update(Path(f) for f in glob.glob(str(p), recursive=True)
+                         if Path(f).is_file() and rinextype(f) in ('obs','nav'))
+
+    return sorted(flist)
+
+
+def outputs(ofn:Path) -> List[Path]:
+    """existing output files of NetCDF file ofn, including the G-<name> per-system files of earlier versions"""
+    return [f for f in [ofn] + sorted(ofn.parent.glob('?-' + ofn.name)) if f.is_file()]
+
+
+def uptodate(fn:Path, ofn:Path) -> bool:
+    """ofn has been written since fn was last modified"""
+    out = outputs(ofn)
+    return bool(out) and all(f.stat().st_mtime >= fn.stat().st_mtime for f in out)
+
+
+def convert_many(paths:Union[str,Path,Sequence], outdir:Path=None, workers:int=None, force:bool=False,
+                 summary:Path=None, use:Union[str,list,tuple]=None, tlim:tuple=None, interval:float=None,
+                 meas:Union[str,list,tuple]=None, compact:Union[bool,str]=False) -> List[dict]:
+    """
+    convert RINEX OBS/NAV files to NetCDF <outdir>/<name>.nc in a pool of workers processes
+
+    compressed files are read directly, the NetCDF name has no compression suffix e.g. demo.10o.gz -> demo.10o.nc
+
+    paths: files, directories and glob patterns e.g. 'data/*/*.17o'
+    outdir: output directory, default is next to each RINEX file
+    workers: number of processes, default one per CPU. 1 converts in this process.
+    force: convert even if the output is newer than the RINEX file
+    summary: write the per-file summary to this CSV file
+    use, tlim, interval, meas, compact: OBS read options, see rinexobs()
+
+    A file that fails to convert is logged and the others continue.
+    returns list of dict per file: file, output, status ('ok', 'skipped', 'error'), seconds, error
+    """
+    flist = findrinex(paths)
+    if outdir is not None:
+        outdir = Path(outdir).expanduser()
+        outdir.mkdir(parents=True, exist_ok=True)
+
+    opts = {'use': use, 'tlim': tlim, 'interval': interval, 'meas': meas, 'compact': compact}
+
+    jobs = []
+    results = {}
+    for fn in flist:
+        ofn = (outdir if outdir is not None else fn.parent) / (stem(fn) + '.nc')
+        if not force and uptodate(fn, ofn):
+            results[fn] = {'file': fn, 'output': ofn, 'status': 'skipped', 'seconds': 0., 'error': ''}
+        else:
+            jobs.append((fn, ofn))
+
+    if workers == 1 or len(jobs) <= 1:
+        for fn,ofn in jobs:
+            results[fn] = _convert(fn, ofn, opts)
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            futs = {fn: pool.submit(_convert, fn, ofn, opts) for fn,ofn in jobs}
+            for (fn,ofn) in jobs:
+                try:
+                    results[fn] = futs[fn].result()
+                except Exception as e:  # e.g. a worker process died
+                    results[fn] = {'file': fn, 'output': ofn, 'status': 'error', 'seconds': 0.,
+                                   'error': '{}: {}'.format(type(e).__name__, e)}
+                    logging.error('{}  {}'.format(fn, results[fn]['error']))
+
+    results = [results[fn] for fn in flist]
+
+    if summary:
+        summary = Path(summary).expanduser()
+        with summary.open('w', newline='') as f:
+            w = csv.DictWriter(f, FIELDS)
+            w.writeheader()
+            w.writerows(results)
+
+    Nerr = sum(r['status'] == 'error' for r in results)
+    logging.info('{} converted, {} up to date, {} failed'.format(
+                  sum(r['status'] == 'ok' for r in results), sum(r['status'] == 'skipped' for r in results), Nerr))
+
+    return results
+
+
+def _convert(fn:Path, ofn:Path, opts:dict) -> dict:
+    """worker: convert one file, returning its summary instead of raising"""
+    from . import readrinex
+
+    res = {'file': fn, 'output': ofn, 'status': 'ok', 'seconds': 0., 'error': ''}
+    tic = time()
+    try:
+        for f in outputs(ofn):  # NetCDF output would be appended to
+            os.remove(f)
+        readrinex(fn, ofn, verbose=False, **opts)
+    except Exception as e:
+        for f in outputs(ofn):  # don't leave a partial file that looks up to date
+            os.remove(f)
+        res['status'] = 'error'
+        res['error'] = '{}: {}'.format(type(e).__name__, e)
+        logging.error('{}  {}'.format(fn, res['error']))
+
+    res['seconds'] = round(time() - tic, 3)
+
+    return res
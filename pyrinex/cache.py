@@ -0,0 +1,138 @@
+"""
+Opt-in on-disk cache of parsed RINEX files, for files read again and again.
+
+The cache is a directory given by cache_dir= of rinexobs()/rinexnav(), or by environment variable PYRINEX_CACHE.
+An entry is a NetCDF file named by a hash of the RINEX file's path, size, mtime, content and the parse options,
+so a changed file or different options never hit a stale entry.
+Entries are written to a temporary file renamed into place, so processes sharing the cache only see
+complete entries. When the cache is over PYRINEX_CACHE_SIZE bytes the least recently read entries are removed.
+"""
+from pathlib import Path
+import os
+import hashlib
+import logging
+import tempfile
+import numpy as np
+import xarray
+from time import time
+from typing import Union
+#
+from .compress import BLOCK
+
+ENV = 'PYRINEX_CACHE'
+ENVSIZE = 'PYRINEX_CACHE_SIZE'
+SIZE = 10 * 2**30  # [bytes] default maximum size of the cache
+STALE = 3600  # [seconds] age of temporary files left by a writer that died
+FORMAT = 1  # of the cache entries, changed with the parsed output so old entries aren't used
+
+
+def cachedir(cache_dir:Path=None) -> Path:
+    """cache directory from cache_dir, else environment variable PYRINEX_CACHE, None if caching is off"""
+    if cache_dir is None:
+        cache_dir = os.environ.get(ENV)
+    if not cache_dir:
+        return
+
+    cache_dir = Path(cache_dir).expanduser()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    return cache_dir
+
+
+def cachekey(fn:Path, kind:str, **opts) -> str:
+    """hash of RINEX file fn (path, size, mtime, content), the kind of read e.g. 'obs' and its parse options"""
+    fn = Path(fn).expanduser().resolve()
+    st = fn.stat()
+
+    if opts.get('tlim') is not None:
+        opts['tlim'] = tuple(str(np.datetime64(t, 'ns')) for t in opts['tlim'])
+    for k in ('use', 'meas'):
+        if isinstance(opts.get(k), (list,tuple)):
+            opts[k] = tuple(opts[k])
+
+    h = hashlib.sha256()
+    h.update(repr((FORMAT, str(fn), st.st_size, st.st_mtime_ns, kind, sorted(opts.items()))).encode())
+    with fn.open('rb') as f:
+        for b in iter(lambda: f.read(BLOCK), b''):
+            h.update(b)
+
+    return h.hexdigest()
+
+
+def load(cache_dir:Path, key:str) -> Union[xarray.Dataset, dict]:
+    """cached data of key, None if not cached"""
+    fn = cache_dir / (key + '.nc')
+    try:
+        with xarray.open_dataset(fn) as root:
+            systems = root.attrs.get('systems')
+
+        if systems is None:
+            with xarray.open_dataset(fn, group='data') as ds:
+                data = ds.load()
+        else:
+            data = {}
+            for k in systems.split(','):
+                with xarray.open_dataset(fn, group=k) as ds:
+                    data[k] = ds.load()
+
+        os.utime(fn)  # most recently used
+    except (OSError, KeyError) as e:  # not cached, or removed by another process meanwhile
+        if fn.is_file():
+            logging.warning('unreadable cache entry {}: {}'.format(fn, e))
+        return
+
+    return data
+
+
+def store(cache_dir:Path, key:str, data:Union[xarray.Dataset, dict]):
+    """add data to the cache as key, then evict least recently used entries over the cache size"""
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=str(cache_dir))
+    os.close(fd)
+    try:
+        if isinstance(data, dict):
+            xarray.Dataset(attrs={'systems': ','.join(data)}).to_netcdf(tmp, mode='w')
+            for k,v in data.items():
+                v.to_netcdf(tmp, group=k, mode='a')
+        else:
+            xarray.Dataset().to_netcdf(tmp, mode='w')
+            data.to_netcdf(tmp, group='data', mode='a')
+
+        os.replace(tmp, str(cache_dir / (key + '.nc')))
+    except Exception as e:  # the cache is an optimization, the read goes on
+        logging.warning('could not cache {}: {}'.format(key, e))
+        os.remove(tmp)
+        return
+
+    evict(cache_dir)
+
+
+def evict(cache_dir:Path, size:int=None):
+    """remove least recently used entries until the cache is at most size bytes (default PYRINEX_CACHE_SIZE)"""
+    if size is None:
+        size = int(os.environ.get(ENVSIZE, SIZE))
+
+    entries = []
+    for f in list(cache_dir.glob('*.nc')) + list(cache_dir.glob('*.tmp')):
+        try:
+            st = f.stat()
+        except FileNotFoundError:  # removed by another process
+            continue
+        if f.suffix == '.tmp':
+            if time() - st.st_mtime > STALE:
+                _remove(f)
+            continue
+        entries.append((st.st_mtime, st.st_size, f))
+
+    total = sum(e[1] for e in entries)
+    for _,s,f in sorted(entries):
+        if total <= size:
+            break
+        _remove(f)
+        total -= s
+
+
+def _remove(fn:Path):
+    try:
+        fn.unlink()
+    except FileNotFoundError:
+        pass
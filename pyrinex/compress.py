@@ -0,0 +1,168 @@
+"""
+Transparent reading of compressed RINEX files: gzip, bz2, xz, Unix compress (.Z) and zip.
+
+The compression is detected from the file's magic bytes, and the file is
+decompressed as a stream into the parser, without an intermediate file.
+"""
+from pathlib import Path
+import io
+import bz2
+import gzip
+import lzma
+import zipfile
+from typing import BinaryIO, Iterator
+
+MAGIC = ((b'\x1f\x8b', 'gz'),
+         (b'\x1f\x9d', 'Z'),
+         (b'BZh', 'bz2'),
+         (b'\xfd7zXZ\x00', 'xz'),
+         (b'PK\x03\x04', 'zip'))
+
+SUFFIXES = ('.gz', '.z', '.bz2', '.xz', '.zip')
+
+BLOCK = 65536  # bytes of compressed input read at a time
+
+
+def compression(fn:Path) -> str:
+    """'gz', 'Z', 'bz2', 'xz', 'zip' from the magic bytes of file fn, None if not compressed"""
+    with Path(fn).expanduser().open('rb') as f:
+        magic = f.read(6)
+
+    for m,c in MAGIC:
+        if magic.startswith(m):
+            return c
+
+
+def stem(fn:Path) -> str:
+    """file name without a compression suffix e.g. demo.10o.gz -> demo.10o"""
+    name = Path(fn).name
+    if Path(name).suffix.lower() in SUFFIXES:
+        name = name[:-len(Path(name).suffix)]
+
+    return name
+
+
+def opener(fn:Path) -> BinaryIO:
+    """open RINEX file fn for binary reading, decompressing as it's read"""
+    fn = Path(fn).expanduser()
+    c = compression(fn)
+
+    if c is None:
+        return fn.open('rb')
+    elif c == 'gz':
+        return gzip.open(fn, 'rb')
+    elif c == 'bz2':
+        return bz2.open(fn, 'rb')
+    elif c == 'xz':
+        return lzma.open(fn, 'rb')
+    elif c == 'Z':
+        return io.BufferedReader(_LZWFile(fn.open('rb')), BLOCK)
+    elif c == 'zip':
+        with zipfile.ZipFile(fn) as z:  # the open member keeps the archive file open
+            names = [i.filename for i in z.infolist() if not i.filename.endswith('/')]  # no ZipInfo.is_dir() in Python 3.5
+            if not names:
+                raise ValueError('no file in {}'.format(fn))
+            return z.open(names[0])
+
+
+class _LZWFile(io.RawIOBase):
+    """read-only stream of the decompressed data of a Unix compress (.Z) file"""
+
+    def __init__(self, f:BinaryIO):
+        self._f = f
+        self._chunks = _unlzw(f)
+        self._buf = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buf:
+            try:
+                self._buf = next(self._chunks)
+            except StopIteration:
+                return 0
+
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._f.close()
+        super().close()
+
+
+def _unlzw(f:BinaryIO) -> Iterator[bytes]:
+    """
+    decompress Unix compress (LZW) data, yielding a chunk per BLOCK of input
+
+    Codes are read in groups of `bits` bytes (8 codes). When the code width grows,
+    or on a CLEAR code, the rest of the group is discarded as compress(1) does.
+    """
+    hdr = f.read(3)
+    if len(hdr) < 3 or hdr[:2] != b'\x1f\x9d':
+        raise ValueError('not a .Z file')
+
+    maxbits = hdr[2] & 0x1f
+    block = hdr[2] & 0x80
+    if not 9 <= maxbits <= 16 or hdr[2] & 0x60:
+        raise ValueError('unsupported .Z file flags {:#x}'.format(hdr[2]))
+
+    table = [bytes((i,)) for i in range(256)] + [b''] * ((1 << maxbits) - 256)
+    bits = 9
+    mask = 0x1ff
+    end = 256 if block else 255  # last code in use
+    prev = None
+
+    buf = b''
+    eof = False
+    while not eof:
+        b = f.read(BLOCK)
+        eof = not b
+        buf += b
+
+        out = []
+        i = 0
+        # whole groups of `bits` bytes, and at the end of file the last partial group
+        while True:
+            if end >= mask and bits < maxbits:
+                bits += 1
+                mask = (mask << 1) | 1
+            if i + bits > len(buf) and not (eof and i < len(buf)):
+                break
+
+            grp = buf[i:i+bits]
+            i += bits
+            val = int.from_bytes(grp, 'little')
+
+            for k in range(len(grp)*8 // bits):
+                code = (val >> (k*bits)) & mask
+
+                if code == 256 and block:  # CLEAR
+                    bits = 9
+                    mask = 0x1ff
+                    end = 255
+                    break
+
+                if code <= end:
+                    entry = table[code]
+                elif code == end + 1 and prev is not None:
+                    entry = prev + prev[:1]
+                else:
+                    raise ValueError('corrupt .Z data')
+
+                out.append(entry)
+                if prev is not None and end < mask:
+                    end += 1
+                    table[end] = prev + entry[:1]
+                prev = entry
+
+                if end >= mask and bits < maxbits:
+                    break  # code width grows at the next group
+
+        buf = buf[i:]
+        if out:
+            yield b''.join(out)
@@ -0,0 +1,234 @@
+"""
+Linear combinations of dual-frequency observations and slant TEC, from OBS Datasets of rinexobs().
+
+The observables of two bands are picked by name, RINEX 2 (P1, C1, L1) or RINEX 3 (C1C, C2W, L1C),
+and their frequencies by satellite system, so every combination is a whole (time, sv) array expression.
+With dask-backed Datasets (e.g. open_mfrinex()) the results are lazy and computed chunk by chunk.
+
+Phase leveling fits the phase to the code over each continuous arc of a satellite: arcs end at gaps,
+loss of lock (LLI) and jumps of the geometry-free phase. All arcs of all satellites are found and
+averaged at once, over time; with dask, chunks of satellites are leveled in parallel.
+"""
+import numpy as np
+import xarray
+from typing import Dict, Sequence, Tuple, Union
+#
+C = 299792458.  # [m/s] speed of light
+K = 40.3082  # [m^3/s^2] ionospheric refraction constant, delay = K*TEC/f^2
+TECU = 1e16  # [electrons/m^2]
+
+# [Hz] carrier frequencies of (system, band); GLONASS FDMA bands 1, 2 are from the channel of each satellite
+FREQ = {('G',1): 1575.42e6, ('G',2): 1227.60e6, ('G',5): 1176.45e6,
+        ('E',1): 1575.42e6, ('E',5): 1176.45e6, ('E',6): 1278.75e6, ('E',7): 1207.14e6, ('E',8): 1191.795e6,
+        ('C',1): 1575.42e6, ('C',2): 1561.098e6, ('C',5): 1176.45e6, ('C',6): 1268.52e6, ('C',7): 1207.14e6,
+        ('C',8): 1191.795e6,
+        ('J',1): 1575.42e6, ('J',2): 1227.60e6, ('J',5): 1176.45e6, ('J',6): 1278.75e6,
+        ('S',1): 1575.42e6, ('S',5): 1176.45e6,
+        ('I',5): 1176.45e6, ('I',9): 2492.028e6,
+        ('R',3): 1202.025e6, ('R',4): 1600.995e6, ('R',6): 1248.06e6}
+GLONASS = {1: (1602e6, 562.5e3), 2: (1246e6, 437.5e3)}  # [Hz] band: (frequency of channel 0, channel step)
+
+ATTRIBUTES = 'CPWYSLXIQDBZMAN'  # RINEX 3 tracking codes of an observable in order of preference
+MAXGAP = 300.  # [seconds] a longer gap ends an arc
+GFJUMP = 1.  # [m] a larger step of the geometry-free phase between epochs is a cycle slip
+MINARC = 10  # [epochs] shorter arcs are dropped from leveling
+
+Channels = Union[Dict[str,int], xarray.Dataset]
+
+
+def geometry_free(obs:xarray.Dataset, phase:bool=False, bands:Tuple[int,int]=(1,2),
+                  names:Tuple[str,str]=None, glonass:Channels=None) -> xarray.DataArray:
+    """
+    geometry-free combination [m]: code P2 - P1, phase L1 - L2 (in meters), each the ionospheric
+    delay difference I2 - I1 plus biases, and the phase its ambiguity
+
+    phase: phase, else code
+    bands: the two frequency bands e.g. (1,5)
+    names: the two observables, default picked from obs (see observable())
+    glonass: GLONASS frequency channel of each satellite, {'R01': 1, ...} or a NAV Dataset with FreqNum
+    """
+    a, b, _, _ = _pair(obs, 'L' if phase else 'C', bands, names, glonass)
+
+    return (a - b if phase else b - a).rename('L4' if phase else 'P4')
+
+
+def iono_free(obs:xarray.Dataset, phase:bool=False, bands:Tuple[int,int]=(1,2),
+              names:Tuple[str,str]=None, glonass:Channels=None) -> xarray.DataArray:
+    """ionosphere-free combination [m] (f1^2 a - f2^2 b) / (f1^2 - f2^2) of code, or phase in meters"""
+    a, b, f1, f2 = _pair(obs, 'L' if phase else 'C', bands, names, glonass)
+
+    return ((a*f1**2 - b*f2**2) / (f1**2 - f2**2)).rename('LC' if phase else 'PC')
+
+
+def melbourne_wubbena(obs:xarray.Dataset, bands:Tuple[int,int]=(1,2), names:Tuple[str,str,str,str]=None,
+                      glonass:Channels=None) -> xarray.DataArray:
+    """
+    Melbourne-Wubbena combination [wide-lane cycles]: wide-lane phase minus narrow-lane code,
+    constant over an arc but for noise, multipath and cycle slips
+
+    names: code and phase observables (C1, C2, L1, L2)
+    """
+    names = names or (None,)*4
+    P1, P2, f1, f2 = _pair(obs, 'C', bands, names[:2], glonass)
+    L1, L2, _, _ = _pair(obs, 'L', bands, names[2:], glonass)
+
+    mw = (L1*f1 - L2*f2) / (f1 - f2) - (P1*f1 + P2*f2) / (f1 + f2)
+
+    return (mw * (f1 - f2) / C).rename('MW')
+
+
+def slant_tec(obs:xarray.Dataset, level:bool=True, bands:Tuple[int,int]=(1,2),
+              names:Tuple[str,str,str,str]=None, glonass:Channels=None, **arcs) -> xarray.DataArray:
+    """
+    slant TEC [TECU] along each receiver-satellite path, with the receiver and satellite biases
+
+    level: from phase leveled to code over each arc (see level_phase()), else from code only
+    names: code and phase observables (C1, C2, L1, L2)
+    arcs: maxgap, gfjump, minarc of level_phase()
+    """
+    names = names or (None,)*4
+    if level:
+        gf = level_phase(obs, bands, names, glonass, **arcs)
+    else:
+        gf = geometry_free(obs, False, bands, names[:2], glonass)
+
+    f1, f2 = (frequency(obs.sv, b, glonass) for b in bands)
+
+    return (gf * f1**2 * f2**2 / (K * (f1**2 - f2**2)) / TECU).rename('sTEC')
+
+
+def level_phase(obs:xarray.Dataset, bands:Tuple[int,int]=(1,2), names:Tuple[str,str,str,str]=None,
+                glonass:Channels=None, maxgap:float=MAXGAP, gfjump:float=GFJUMP,
+                minarc:int=MINARC) -> xarray.DataArray:
+    """
+    geometry-free phase [m] leveled to the geometry-free code: over each continuous arc,
+    the phase plus the mean of code minus phase. NaN on arcs shorter than minarc epochs.
+
+    An arc ends at a gap of more than maxgap seconds, loss of lock indicated on either phase,
+    or a step of the geometry-free phase of more than gfjump meters.
+    names: code and phase observables (C1, C2, L1, L2)
+    """
+    names = names or (None,)*4
+    P4 = geometry_free(obs, False, bands, names[:2], glonass)
+    L4 = geometry_free(obs, True, bands, names[2:], glonass)
+
+    slip = xarray.zeros_like(L4, dtype=bool)
+    for n in (names[2] or observable(obs, 'L', bands[0]), names[3] or observable(obs, 'L', bands[1])):
+        if n + 'lli' in obs:  # bit 0: loss of lock. NaN or 255 (compactobs()): none given
+            lli = obs[n + 'lli']
+            slip = slip | ((lli - 2*np.floor(lli / 2) == 1) & (lli < 255))
+
+    t = (obs.time - obs.time[0]) / np.timedelta64(1, 's')
+
+    return xarray.apply_ufunc(_level, P4, L4, slip, t,
+                              input_core_dims=[['time']]*4, output_core_dims=[['time']],
+                              kwargs={'maxgap': maxgap, 'gfjump': gfjump, 'minarc': minarc},
+                              dask='parallelized', output_dtypes=[float],
+                              dask_gufunc_kwargs={'allow_rechunk': True}).transpose(*L4.dims).rename('L4')
+
+
+def observable(obs:xarray.Dataset, kind:str, band:int) -> str:
+    """
+    name of the observable of kind 'C' code or 'L' phase on band in obs
+
+    RINEX 2: P1 before C1. RINEX 3: the first of the tracking codes in ATTRIBUTES, e.g. C1C before C1W.
+    """
+    if kind == 'C':
+        for n in ('P{}'.format(band), 'C{}'.format(band)):
+            if n in obs:
+                return n
+    elif 'L{}'.format(band) in obs:
+        return 'L{}'.format(band)
+
+    for a in ATTRIBUTES:
+        n = '{}{}{}'.format(kind, band, a)
+        if n in obs:
+            return n
+
+    raise KeyError('no {} observable of band {} in {}'.format('code' if kind == 'C' else 'phase', band,
+                                                             list(obs.data_vars)))
+
+
+def frequency(sv:Union[xarray.DataArray,Sequence[str]], band:int, glonass:Channels=None) -> xarray.DataArray:
+    """
+    [Hz] carrier frequency of band for each satellite sv e.g. 'G07', 'G 7', NaN if unknown
+
+    glonass: GLONASS frequency channel of each satellite, for bands 1 and 2
+    """
+    sv = np.asarray(sv, dtype=str)
+    f = np.array([FREQ.get((s[:1], band), np.nan) for s in sv])
+
+    if band in GLONASS:
+        f0, step = GLONASS[band]
+        k = _channels(glonass)
+        for i,s in enumerate(sv):
+            if s[:1] == 'R':
+                f[i] = f0 + k.get(_svname(s), np.nan)*step
+
+    return xarray.DataArray(f, dims='sv', coords={'sv': sv})
+
+
+def _pair(obs:xarray.Dataset, kind:str, bands:Tuple[int,int], names:Tuple[str,str],
+          glonass:Channels) -> tuple:
+    """observables of the two bands [m] (phase cycles times wavelength) and their frequencies"""
+    names = names or (None, None)
+    out = []
+    for b,n in zip(bands, names):
+        f = frequency(obs.sv, b, glonass)
+        x = obs[n or observable(obs, kind, b)]
+        out.append((x * (C / f) if kind == 'L' else x, f))
+
+    (a, f1), (b, f2) = out
+
+    return a, b, f1, f2
+
+
+def _channels(glonass:Channels) -> dict:
+    """GLONASS frequency channel of each satellite e.g. {'R01': 1}"""
+    if glonass is None:
+        return {}
+    if isinstance(glonass, xarray.Dataset):  # NAV: the last channel of each satellite
+        sv = glonass['sv'].values.astype(str)
+        k = glonass['FreqNum'].values
+        return {s: int(c) for s,c in zip(sv, k) if s[:1] == 'R' and np.isfinite(c)}
+
+    return {_svname(s): int(c) for s,c in glonass.items()}
+
+
+def _svname(sv:str) -> str:
+    """'R 1' of RINEX 2 is 'R01'"""
+    return sv[:1] + sv[1:].strip().zfill(2)
+
+
+def _level(P4:np.ndarray, L4:np.ndarray, slip:np.ndarray, t:np.ndarray,
+           maxgap:float, gfjump:float, minarc:int) -> np.ndarray:
+    """
+    leveling of (..., time) arrays, all arcs at once
+
+    Each epoch with both P4 and L4 either starts a new arc or continues the one of the previous such epoch
+    of its satellite. The arcs are numbered by a cumulative sum along time, made unique over
+    satellites, and averaged by bincount.
+    """
+    shape = L4.shape
+    P4, L4, slip = (np.ascontiguousarray(np.reshape(x, (-1, shape[-1]))) for x in (P4, L4, slip))  # along time
+    t = np.broadcast_to(t, L4.shape)
+
+    ok = np.isfinite(P4) & np.isfinite(L4)
+    i = np.arange(L4.shape[1])
+    # previous epoch of each satellite with both observations
+    last = np.maximum.accumulate(np.where(ok, i, -1), axis=1)
+    prev = np.concatenate((np.full((L4.shape[0], 1), -1), last[:,:-1]), axis=1)
+    p = np.maximum(prev, 0)
+    r = np.arange(L4.shape[0])[:,None]
+
+    start = ok & ((prev < 0) | slip | (t - t[r,p] > maxgap) | (np.abs(L4 - L4[r,p]) > gfjump))
+    arc = np.cumsum(start, axis=1) + r*(L4.shape[1] + 1)  # unique over satellites
+    arc = arc[ok]
+
+    n = np.bincount(arc)
+    offset = np.bincount(arc, weights=(P4 - L4)[ok]) / np.maximum(n, 1)
+
+    out = np.full(L4.shape, np.nan)
+    out[ok] = np.where(n[arc] >= minarc, L4[ok] + offset[arc], np.nan)
+
+    return out.reshape(shape)
@@ -0,0 +1,358 @@
+"""
+Satellite positions and clock corrections from the broadcast ephemeris of a NAV Dataset.
+
+Every requested epoch of every satellite is computed at once on (time, sv) arrays:
+the ephemeris record of each satellite and epoch is picked by searchsorted on a per-satellite index
+sorted by Toe (navindex), its elements gathered into (time, sv) arrays, and Kepler's equation
+is solved by Newton iterations on the whole array.
+The arrays are computed in blocks of times small enough to stay in CPU cache.
+
+Keplerian records of GPS and QZSS follow IS-GPS-200 Table 20-IV.
+SBAS records are ECEF position, velocity and acceleration, extrapolated from their time.
+Records of other systems in a mixed NAV Dataset are left out: their time systems and constants differ,
+and GLONASS state vectors need numerical integration.
+Times are GPS time, the satellite positions at those times (no light-time or Earth rotation correction
+for a receiver).
+"""
+import math
+import numpy as np
+import xarray
+from typing import Sequence, Union
+#
+GM = 3.986005e14  # [m^3/s^2] WGS 84 gravitational constant of GPS
+OMEGAE = 7.2921151467e-5  # [rad/s] WGS 84 Earth rotation rate
+F = -4.442807633e-10  # [s/m^(1/2)] relativistic clock correction constant
+GPS0 = np.datetime64('1980-01-06T00:00:00', 'ns')  # start of GPS week 0
+WEEK = 604800  # [seconds]
+
+KEPLER = ('SVclockBias','SVclockDrift','SVclockDriftRate','Crs','DeltaN','M0','Cuc','Eccentricity','Cus',
+          'sqrtA','Toe','Cic','omega0','Cis','Io','Crc','omega','OmegaDot','IDOT','GPSWeek')
+STATE = ('SVclockBias','SVRelFreqBias','X','dX','dX2','Y','dY','dY2','Z','dZ','dZ2')
+
+FIT = 4  # [hours] fit interval of Keplerian records that don't give one
+MAXDT = 360.  # [seconds] validity of SBAS records either side of their time
+NAVINDEX = np.dtype([('sv', 'U3'),
+                     ('toe', 'datetime64[ns]'),   # Toe, or the record time of SBAS records
+                     ('start', 'datetime64[ns]'),  # fit interval
+                     ('end', 'datetime64[ns]'),
+                     ('record', np.int64)])       # index of the record along the NAV Dataset time
+
+NEWTON = 10  # most iterations of Kepler's equation
+TOL = 1e-8  # [rad] last Newton step of the eccentric anomaly, whose error after is ~ e*TOL^2
+SERIES = 0.25  # [rad] largest step of an angle whose sin and cos are by series
+BLOCK = 8192  # (time, sv) elements computed together
+
+
+def sv_positions(nav:xarray.Dataset, times:Sequence, sv:Sequence[str]=None, index:np.ndarray=None) -> xarray.Dataset:
+    """
+    ECEF positions and clock corrections of the satellites of nav at times
+
+    times: GPS times, datetime64 or anything numpy.datetime64 takes
+    sv: satellites e.g. ['G01','G07'], default all of nav
+    index: navindex(nav), to reuse over many calls
+
+    The ephemeris of each satellite and time is as navselect().
+    returns Dataset of (time, sv) variables x, y, z [m] ECEF and clock [s], the satellite clock offset
+    with the relativistic correction (without TGD). NaN where there's no valid ephemeris.
+    """
+    t = np.atleast_1d(np.asarray(times, dtype='datetime64[ns]'))
+    if index is None:
+        index = navindex(nav)
+    if sv is None:
+        sv = np.unique(index['sv'])
+    sv = np.asarray(sv, dtype=str)
+# %% record of each time and satellite
+    kepler, state = _kinds(nav)
+    rec = np.empty((t.size, sv.size), dtype=np.int64)
+    iskepler = np.zeros(sv.size, bool)
+    isstate = np.zeros(sv.size, bool)
+    for j,s in enumerate(sv):
+        rec[:,j] = navselect(index, s, t)
+        i = index['record'][index['sv'] == s]
+        iskepler[j] = kepler[i].any()
+        isstate[j] = state[i].any() and not iskepler[j]
+
+    found = rec >= 0
+    rec[~found] = 0
+# %% all satellites and times at once
+    t0 = t[0] if t.size else GPS0
+    ts = _seconds(t - t0)[:,None]
+    out = {k: np.full((t.size, sv.size), np.nan) for k in ('x','y','z','clock')}
+    for K,f,c in ((iskepler, _kepler, _keplerrecords), (isstate, _state, _staterecords)):
+        if not K.any():
+            continue
+        names, V = c(nav, t0)
+        rK = rec[:,K]
+        miss = ~found[:,K]
+        cols = slice(None) if K.all() else K
+        n = max(1, BLOCK // K.sum())
+        for i in range(0, t.size, n):  # blocks that stay in CPU cache through the many steps
+            m = miss[i:i+n]
+            if m.all():
+                continue
+            e = dict(zip(names, np.take(V, rK[i:i+n], axis=1)))
+            for k,v in zip(('x','y','z','clock'), f(e, ts[i:i+n])):
+                if m.any():
+                    v[m] = np.nan
+                out[k][i:i+n,cols] = v
+
+    return xarray.Dataset({k: (('time','sv'), v) for k,v in out.items()},
+                          coords={'time': t, 'sv': sv})
+
+
+def navindex(nav:xarray.Dataset, healthy:bool=True) -> np.ndarray:
+    """
+    index of the ephemeris records of a NAV Dataset, sorted by satellite then Toe
+
+    healthy: leave out records whose SVhealth isn't 0
+
+    Repeated broadcasts of a record, as from merged daily or station NAV files, are one entry:
+    of the records of a satellite with the same Toe the last in nav is kept.
+    The fit interval is FitIntvl hours around Toe, default FIT hours, and MAXDT either side of
+    the time of SBAS records.
+    """
+    names = _svnames(nav)
+    kepler, state = _kinds(nav)
+    ok = kepler | state
+    if healthy and 'SVhealth' in nav:
+        h = nav['SVhealth'].values
+        ok &= (h == 0) | np.isnan(h)  # NaN: not given
+    i = np.nonzero(ok)[0]
+# %% reference time and fit interval of each record
+    toe = nav.time.values[i].astype('datetime64[ns]')
+    half = np.full(i.size, np.nan)
+    if kepler.any():
+        k = kepler[i]
+        toe[k] = _gpstime(nav['GPSWeek'].values[i[k]], nav['Toe'].values[i[k]])
+        fit = nav['FitIntvl'].values[i[k]] if 'FitIntvl' in nav else np.full(k.sum(), np.nan)
+        half[k] = np.where(fit > 0, fit, FIT) * 1800  # 0: 4 hours in RINEX 2
+    half[~kepler[i]] = MAXDT
+
+    ok = ~np.isnat(toe)
+    i, toe, half = i[ok], toe[ok], half[ok]
+# %% sort, and one of each repeated broadcast
+    order = np.lexsort((i, toe, names[i]))
+    i, toe, half = i[order], toe[order], half[order]
+    sv = names[i]
+    last = np.append((sv[1:] != sv[:-1]) | (toe[1:] != toe[:-1]), True)
+
+    idx = np.empty(last.sum(), dtype=NAVINDEX)
+    idx['sv'] = sv[last]
+    idx['toe'] = toe[last]
+    dt = np.round(half[last]*1e9).astype('timedelta64[ns]')
+    idx['start'] = idx['toe'] - dt
+    idx['end'] = idx['toe'] + dt
+    idx['record'] = i[last]
+
+    return idx
+
+
+def navselect(index:np.ndarray, sv:Union[str,Sequence[str]], times:Sequence) -> np.ndarray:
+    """
+    records of a NAV Dataset for satellites sv at times, from its navindex()
+
+    sv and times broadcast together, e.g. sv[None,:] and times[:,None] for (time, sv).
+    The record is the one of nearest Toe among the two around each time, that's in its fit interval.
+    returns record indices along the NAV Dataset time, -1 where there's no valid ephemeris
+    """
+    sv = np.asarray(sv, dtype=str)
+    t = np.asarray(times, dtype='datetime64[ns]')
+    if sv.ndim == 0:
+        return _select(index, str(sv), t)
+
+    sv, t = np.broadcast_arrays(sv, t)
+    rec = np.full(sv.shape, -1, dtype=np.int64)
+    u, inv = np.unique(sv, return_inverse=True)
+    inv = inv.reshape(sv.shape)
+    for k,s in enumerate(u):
+        m = inv == k
+        rec[m] = _select(index, s, t[m])
+
+    return rec
+
+
+def _select(index:np.ndarray, sv:str, t:np.ndarray) -> np.ndarray:
+    """
+    navselect() of one satellite
+
+    The record is constant between the times where it can change: starts and ends of fit intervals,
+    the Toe and the midpoints between Toe. The rule is evaluated at just those, and looked up by searchsorted.
+    """
+    a, b = np.searchsorted(index['sv'], sv, 'left'), np.searchsorted(index['sv'], sv, 'right')
+    seg = index[a:b]
+    if not seg.size:
+        return np.full(t.shape, -1, dtype=np.int64)
+
+    toe, start, end = (seg[k].view(np.int64) for k in ('toe','start','end'))  # [ns]
+    edges = np.unique(np.concatenate((start, end + 1, toe + 1, (toe[1:] + toe[:-1] + 1) // 2)))
+    rec = np.append(-1, _nearest(toe, start, end, seg['record'], edges))
+
+    return rec[np.searchsorted(edges, t.view(np.int64), 'right')]
+
+
+def _nearest(toe:np.ndarray, start:np.ndarray, end:np.ndarray, record:np.ndarray, t:np.ndarray) -> np.ndarray:
+    """record of nearest Toe of the two around each of t, that's in its fit interval, else -1"""
+    k = np.searchsorted(toe, t)
+    after = np.minimum(k, toe.size - 1)
+    before = np.maximum(k - 1, 0)
+    va = (start[after] <= t) & (t <= end[after])
+    vb = (start[before] <= t) & (t <= end[before])
+    a = va & ((toe[after] - t <= t - toe[before]) | ~vb)
+
+    return np.where(a, record[after], np.where(vb, record[before], -1))
+
+
+def _kinds(nav:xarray.Dataset) -> tuple:
+    """records of GPS week Keplerian elements (GPS, QZSS), and of SBAS state vectors"""
+    n = nav.time.size
+    kepler = np.zeros(n, bool)
+    if all(k in nav for k in KEPLER):
+        kepler = np.isfinite(nav['sqrtA'].values) & np.isfinite(nav['GPSWeek'].values)
+    state = np.zeros(n, bool)
+    if all(k in nav for k in STATE):
+        state = np.isfinite(nav['X'].values) & ~kepler & (_svnames(nav).astype('U1') == 'S')
+
+    return kepler, state
+
+
+def _svnames(nav:xarray.Dataset) -> np.ndarray:
+    """satellite of each record e.g. 'G07'; RINEX 2 NAV has GPS PRN numbers"""
+    sv = nav['sv'].values
+    if sv.dtype.kind in 'US':
+        return sv.astype(str)
+
+    return np.char.add('G', np.char.zfill(sv.astype(int).astype(str), 2))
+
+
+def _gpstime(week:np.ndarray, sow:np.ndarray) -> np.ndarray:
+    """datetime64 of GPS week and seconds of week, NaT where missing"""
+    ns = np.round((week*WEEK + sow) * 1e9)
+    ok = np.isfinite(ns)
+    t = GPS0 + np.where(ok, ns, 0).astype('timedelta64[ns]')
+    t[~ok] = np.datetime64('NaT')
+
+    return t
+
+
+def _seconds(dt:np.ndarray) -> np.ndarray:
+    return dt / np.timedelta64(1, 's')
+
+
+def _keplerrecords(nav:xarray.Dataset, t0:np.datetime64) -> tuple:
+    """
+    names and (name, record) values of the elements of each record, the terms of the orbit
+    that are constant over a record, and the Toe and Toc [seconds] since t0
+    """
+    v = {k: nav[k].values for k in KEPLER}
+    A = v['sqrtA']**2
+
+    v['toe'] = _seconds(_gpstime(v['GPSWeek'], v['Toe']) - t0)
+    v['toc'] = _seconds(nav.time.values.astype('datetime64[ns]') - t0)
+    v['A'] = A
+    v['n'] = np.sqrt(GM / A**3) + v['DeltaN']
+    v['sqrt1e2'] = np.sqrt(1 - v['Eccentricity']**2)
+    v['sinw'] = np.sin(v['omega'])
+    v['cosw'] = np.cos(v['omega'])
+    v['sinIo'] = np.sin(v['Io'])
+    v['cosIo'] = np.cos(v['Io'])
+    v['Omega0'] = v['omega0'] - OMEGAE*v['Toe']
+    v['OmegaRate'] = v['OmegaDot'] - OMEGAE
+    v['F'] = F * v['Eccentricity'] * v['sqrtA']
+
+    return list(v), np.array(list(v.values()), dtype=float)
+
+
+def _kepler(e:dict, t:np.ndarray) -> tuple:
+    """
+    IS-GPS-200 Table 20-IV at times t [seconds since t0] with the record values e of _keplerrecords()
+
+    sin and cos are the costly steps, so besides those of M and Omega they're found from
+    sin and cos of a nearby angle: by trigonometric identities for the true anomaly and argument of latitude,
+    and by series of the small steps of E in Newton's method and of i from Io.
+    """
+    tk = t - e['toe']
+    ecc = e['Eccentricity']
+    M = e['M0'] + e['n']*tk
+# %% Kepler's equation M = E - e sin(E), Newton iterations from E = M
+    E = M.copy()
+    sinE = np.sin(E)
+    cosE = np.cos(E)
+    for _ in range(NEWTON):
+        dE = (M - E + ecc*sinE) / (1 - ecc*cosE)
+        E += dE
+        sinE, cosE = _sincos(E, dE, sinE, cosE)
+        if np.nanmax(np.abs(dE), initial=0) < TOL:
+            break
+# %% argument of latitude, radius, inclination
+    den = 1 - ecc*cosE
+    sinv = e['sqrt1e2']*sinE / den
+    cosv = (cosE - ecc) / den
+    sinw = e['sinw']
+    cosw = e['cosw']
+    sinP = sinv*cosw + cosv*sinw  # Phi = true anomaly + omega
+    cosP = cosv*cosw - sinv*sinw
+    s2 = 2*sinP*cosP
+    c2 = 1 - 2*sinP**2
+
+    du = e['Cus']*s2 + e['Cuc']*c2  # ~1e-5 rad: second order is exact
+    h = 1 - 0.5*du**2
+    sinu = sinP*h + cosP*du
+    cosu = cosP*h - sinP*du
+    r = e['A']*den + e['Crs']*s2 + e['Crc']*c2
+    di = e['Cis']*s2 + e['Cic']*c2 + e['IDOT']*tk
+    sini, cosi = _sincos(e['Io'] + di, di, e['sinIo'], e['cosIo'])
+# %% ECEF
+    xp = r*cosu
+    yp = r*sinu
+    Omega = e['Omega0'] + e['OmegaRate']*tk
+    cosO = np.cos(Omega)
+    sinO = np.sin(Omega)
+    ycosi = yp*cosi
+
+    x = xp*cosO - ycosi*sinO
+    y = xp*sinO + ycosi*cosO
+    z = yp*sini
+# %% clock, polynomial from the record time (Toc) and relativistic correction
+    dt = t - e['toc']
+    clock = e['SVclockBias'] + (e['SVclockDrift'] + e['SVclockDriftRate']*dt)*dt + e['F']*sinE
+
+    return x, y, z, clock
+
+
+def _sincos(a:np.ndarray, d:np.ndarray, s:np.ndarray, c:np.ndarray) -> tuple:
+    """sin and cos of angles a from s, c: sin and cos of a - d, by Taylor series of small d"""
+    m = np.nanmax(np.abs(d), initial=0)
+    if m > SERIES:
+        return np.sin(a), np.cos(a)
+    # terms until they're below float64 precision
+    n = 1
+    while m**(2*n) / math.factorial(2*n) > 1e-17:
+        n += 1
+
+    d2 = d*d
+    cosd = 1 - d2 / ((2*n-1)*2*n)
+    sind = 1 - d2 / (2*n*(2*n+1))
+    for k in range(n-1, 0, -1):  # Horner: cos d = 1 - d^2/2 (1 - d^2/12 (...)), sin d = d (1 - d^2/6 (1 - d^2/20 (...)))
+        cosd = 1 - d2 * cosd / ((2*k-1)*2*k)
+        sind = 1 - d2 * sind / (2*k*(2*k+1))
+    sind *= d
+
+    return s*cosd + c*sind, c*cosd - s*sind
+
+
+def _staterecords(nav:xarray.Dataset, t0:np.datetime64) -> tuple:
+    """names and (name, record) values of SBAS records, and their time [seconds] since t0"""
+    v = {k: nav[k].values for k in STATE}
+    v['toc'] = _seconds(nav.time.values.astype('datetime64[ns]') - t0)
+
+    return list(v), np.array(list(v.values()), dtype=float)
+
+
+def _state(e:dict, t:np.ndarray) -> tuple:
+    """SBAS: position [km], velocity [km/s], acceleration [km/s^2] at the record time"""
+    dt = t - e['toc']
+
+    x, y, z = ((e[k] + e['d'+k]*dt + 0.5*e['d'+k+'2']*dt**2) * 1e3 for k in ('X','Y','Z'))
+    clock = e['SVclockBias'] + e['SVRelFreqBias']*dt
+
+    return x, y, z, clock
@@ -0,0 +1,142 @@
+"""
+Vectorized decoding of fixed-width (Fortran formatted) text.
+
+A block of records sharing one layout is joined into a single byte buffer and
+viewed as an (nrec, width) uint8 array, so each column is a plain slice and
+all records are converted in one NumPy call instead of one np.genfromtxt()
+per record.
+"""
+import numpy as np
+from typing import Sequence
+
+SPACE = ord(' ')
+OBSW = 16  # RINEX OBS field: F14.3 value, I1 LLI, I1 SSI
+
+
+def chararray(lines:Sequence[bytes], width:int, start:int=0) -> np.ndarray:
+    """
+    join lines into an (nrec, width) uint8 array of columns start:start+width
+
+    short lines (including truncated lines and end of line characters) are blank padded.
+    """
+    # \r and \n are mapped to space below, so truncated lines just look blank
+    raw = b''.join([l[start:start+width].ljust(width) for l in lines])
+
+    c = np.frombuffer(raw, dtype=np.uint8).reshape(len(lines), width).copy()
+    c[(c == 10) | (c == 13) | (c == 0)] = SPACE
+
+    return c
+
+
+def tofloat(c:np.ndarray) -> np.ndarray:
+    """
+    convert fixed-width numeric fields to float
+
+    c: (..., w) uint8 array, last axis is the characters of one field
+    blank fields become NaN, Fortran D exponents are accepted.
+    """
+    shape = c.shape[:-1]
+    w = c.shape[-1]
+    if not c.size:
+        return np.empty(shape)
+
+    c = np.array(c, dtype=np.uint8, order='C').reshape(-1, w)
+    c[(c == ord('D')) | (c == ord('d'))] = ord('E')
+
+    s = c.view('S{}'.format(w)).ravel()
+    s[(c == SPACE).all(axis=1)] = b'nan'
+
+    try:
+        return s.astype(float).reshape(shape)
+    except ValueError:  # garbage field somewhere, NaN just the bad fields
+        return np.array([_float(x) for x in s]).reshape(shape)
+
+
+def _float(s:bytes) -> float:
+    try:
+        return float(s)
+    except ValueError:
+        return np.nan
+
+
+def todigit(c:np.ndarray) -> np.ndarray:
+    """convert single-character integer fields (I1) to float, blank -> NaN"""
+    d = c.astype(float) - ord('0')
+    d[(d < 0) | (d > 9)] = np.nan
+
+    return d
+
+
+def toint(c:np.ndarray) -> np.ndarray:
+    """convert fixed-width integer fields (..., w) to int, blanks are ignored and a blank field is 0"""
+    d = c.astype(np.int64) - ord('0')
+    isdig = (d >= 0) & (d <= 9)
+    d[~isdig] = 0
+    # number of digits to the right of each digit
+    right = np.cumsum(isdig[...,::-1], axis=-1)[...,::-1] - isdig
+    sign = np.where((c == ord('-')).any(axis=-1), -1, 1)
+
+    return sign * (d * 10**right).sum(axis=-1)
+
+
+def obsfields(c:np.ndarray, iobs:Sequence[int]) -> np.ndarray:
+    """
+    decode RINEX OBS value, LLI and SSI for all records at once
+
+    c: (nrec, width) uint8 array, the observations start at column 0
+    iobs: index of each observation field to decode
+
+    returns (nrec, len(iobs)*3) array, columns are value, LLI, SSI per observation
+    """
+    iobs = np.asarray(iobs, dtype=int)
+    nobs = iobs.max() + 1 if iobs.size else 0
+
+    if c.shape[1] < nobs*OBSW:
+        c = np.hstack((c, np.full((c.shape[0], nobs*OBSW - c.shape[1]), SPACE, dtype=np.uint8)))
+
+    f = c[:, :nobs*OBSW].reshape(c.shape[0], nobs, OBSW)[:, iobs, :]
+
+    darr = np.empty((c.shape[0], iobs.size, 3))
+    darr[..., 0] = tofloat(f[..., :OBSW-2])
+    darr[..., 1] = todigit(f[..., OBSW-2])
+    darr[..., 2] = todigit(f[..., OBSW-1])
+
+    return darr.reshape(c.shape[0], iobs.size*3)
+
+
+def navfields(c:np.ndarray, starts:np.ndarray, Nl:int, col0:int, col:int, Nf:int, Lf:int=19) -> np.ndarray:
+    """
+    decode the D19.12 fields of NAV records that all have the same number of lines
+
+    c: (nline, 80) uint8 array of the data lines
+    starts: index of the first line of each record
+    Nl: number of lines per record
+    col0: column of the first field on a record's first line, which holds 3 fields
+    col: column of the first field on continuation lines, which hold 4 fields
+    Nf: number of fields to return
+
+    returns (nrec, Nf) float array
+    """
+    starts = np.asarray(starts, dtype=int)
+
+    first = c[starts, col0:col0+3*Lf]
+    rest = c[starts[:,None] + np.arange(1,Nl), col:col+4*Lf].reshape(starts.size, (Nl-1)*4*Lf)
+    f = np.hstack((first, rest))
+
+    if f.shape[1] < Nf*Lf:
+        f = np.hstack((f, np.full((starts.size, Nf*Lf - f.shape[1]), SPACE, dtype=np.uint8)))
+
+    return tofloat(f[:, :Nf*Lf].reshape(starts.size, Nf, Lf))
+
+
+def todatetime(year:np.ndarray, month:np.ndarray, day:np.ndarray,
+               hour:np.ndarray, minute:np.ndarray, second:np.ndarray) -> np.ndarray:
+    """datetime64[ns] from arrays of calendar fields, second may be fractional (microsecond resolution)"""
+    year, month, day, hour, minute = (np.asarray(x, dtype=np.int64) for x in (year, month, day, hour, minute))
+
+    t = ((year-1970).astype('datetime64[Y]').astype('datetime64[M]') + (month-1).astype('timedelta64[M]')).astype('datetime64[D]')
+    t = t + (day-1).astype('timedelta64[D]')
+
+    us = (hour*3600 + minute*60) * 1000000 + np.round(np.asarray(second)*1e6).astype(np.int64)
+
+    return t.astype('datetime64[ns]') + us.astype('timedelta64[us]')
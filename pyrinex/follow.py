@@ -0,0 +1,111 @@
+"""
+Following a RINEX 2/3 OBS file that a receiver is still appending to.
+
+The header is read once. Each poll reads only the bytes appended since the previous poll,
+finds the complete epochs among them -- an epoch whose lines are all there and newline terminated --
+and parses just those with the usual reader. An epoch still being written is kept for the next poll.
+"""
+from pathlib import Path
+import io
+import logging
+from math import ceil
+from time import time, sleep
+import xarray
+from typing import Union, Iterator
+#
+from .rinex2 import _header2, _epochs2, _nlines2
+from .rinex3 import _getObsTypes, _epochs3, _nlines3
+from .compress import compression
+from .hatanaka import crxversion
+
+
+def follow_obs(fn:Path, poll:float=1., timeout:float=None, use:Union[str,list,tuple]=None,
+               meas:Union[str,list,tuple]=None, interval:float=None, chunk_epochs:int=3600,
+               verbose:bool=False) -> Iterator[Union[xarray.Dataset,dict]]:
+    """
+    yield the epochs newly appended to OBS file fn, checking it for more every poll seconds
+
+    Each Dataset (dict of Datasets for several RINEX 3 systems) holds the complete epochs appended since
+    the previous one, at most chunk_epochs of them, starting with the epochs already in the file.
+    Earlier epochs are never read again.
+    timeout: [seconds] stop when the file hasn't grown for this long, None: follow forever
+    use, meas, interval: as rinexobs()
+    """
+    fn = Path(fn).expanduser()
+    if compression(fn) or crxversion(fn):
+        raise ValueError('a compressed file can only be read whole, not followed: {}'.format(fn))
+
+    last = time()
+    with fn.open('rb') as f:
+# %% header, once it's all written
+        while True:
+            buf = f.read()
+            i = buf.find(b'END OF HEADER')
+            if i >= 0 and buf.find(b'\n', i) >= 0:
+                break
+            if timeout is not None and time() - last > timeout:
+                return
+            f.seek(0)
+            sleep(poll)
+
+        h = io.BytesIO(buf)
+        ver = float(buf[:9])
+        if int(ver) == 2:
+            header = _header2(h)
+            Nl_sv = int(ceil(header['Nobs']/5))
+        elif int(ver) == 3:
+            fields, header, _ = _getObsTypes(h, use)
+        else:
+            raise ValueError('unknown RINEX verion {}  {}'.format(ver,fn))
+        header['filename'] = f.name
+        nlines = (lambda l: _nlines2(l, Nl_sv)) if int(ver) == 2 else _nlines3
+
+        pos = h.tell()  # end of the last complete epoch
+        tail = buf[pos:]  # read after pos: epochs not yet parsed
+# %% new complete epochs
+        while True:
+            buf = tail + f.read()
+            n = _complete(buf, nlines)
+            tail = buf[n:]
+
+            if n:
+                epochs = io.BytesIO(buf[:n])
+                if int(ver) == 2:
+                    yield from _epochs2(epochs, header, use, meas, None, interval, None, chunk_epochs, verbose)
+                else:
+                    for obs in _epochs3(epochs, fields, header, meas, None, interval, None, chunk_epochs, verbose):
+                        if len(obs) == 1:
+                            obs = next(iter(obs.values()))
+                        yield obs
+                pos += n
+                last = time()
+            elif fn.stat().st_size < pos + len(tail):
+                logging.warning('{} was truncated, stopped following it'.format(fn))
+                return
+            elif timeout is not None and time() - last > timeout:
+                return
+            else:
+                sleep(poll)
+
+
+def _complete(buf:bytes, nlines) -> int:
+    """
+    bytes of buf that are whole epochs
+
+    nlines(l): number of lines of the epoch starting with epoch line l, e.g. _nlines2, _nlines3
+    """
+    n = 0  # end of the last whole epoch
+    while True:
+        j = buf.find(b'\n', n)
+        if j < 0:
+            return n
+        l = buf[n:j]
+        if not l.strip():  # blank line
+            n = j+1
+            continue
+
+        for _ in range(nlines(l) - 1):
+            j = buf.find(b'\n', j+1)
+            if j < 0:
+                return n
+        n = j+1
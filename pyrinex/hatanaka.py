@@ -0,0 +1,288 @@
+"""
+Decoding of Hatanaka compressed RINEX OBS files (Compact RINEX, CRINEX 1 for RINEX 2 and CRINEX 3 for RINEX 3).
+
+Compact RINEX keeps the RINEX header, and for each epoch stores
+* the epoch line as a text difference to the previous epoch line,
+* the receiver clock offset line,
+* one line per satellite of its observations as integers (units of 0.001), each the
+  arc's n-th order difference, or "n&value" to start an arc of order n, then the
+  LLI/SSI flags as a text difference to the previous epoch's flags of that satellite.
+
+The text of a batch of epochs is converted to integer arrays at once, then the differences of
+all satellites and observations of the batch are integrated together by cumulative sums along
+the epochs, and the observations go straight to the readers' accumulators without the
+expanded RINEX text being made.
+"""
+from pathlib import Path
+import numpy as np
+from typing import BinaryIO, Iterator, Sequence, Tuple
+#
+from .compress import opener
+from .fixedwidth import chararray, todigit, SPACE
+
+CRX = 'CRINEX VERS   / TYPE'  # header label of first line
+AMP = ord('&')
+LEVELS = 10  # arc orders 0-9
+
+MISSING = 0
+DIFF = 1
+INIT = 2
+
+
+def crxversion(fn:Path) -> float:
+    """CRINEX version of file fn, None if it isn't Compact RINEX"""
+    with opener(fn) as f:
+        line = f.readline().decode('ascii','replace')
+
+    if CRX in line[60:]:
+        return float(line[:9])
+
+
+class CRXDecoder:
+    """
+    state of the data section of a Compact RINEX file
+
+    crxver: CRINEX version, 1 or 3
+    nobs: number of observation types per system e.g. {'G': 12, 'R': 3}; key None for RINEX 2 (all systems)
+    """
+
+    def __init__(self, crxver:float, nobs:dict):
+        self.ver = int(crxver)
+        if self.ver == 1:
+            self.init = '&'  # first character of a full (not differenced) epoch line
+            self.cflag = 28
+            self.cnsv = slice(29,32)
+            self.csv = 32
+            self.cunit = 1e-9
+        elif self.ver == 3:
+            self.init = '>'
+            self.cflag = 31
+            self.cnsv = slice(32,35)
+            self.csv = 41
+            self.cunit = 1e-12
+        else:
+            raise ValueError('unknown CRINEX version {}'.format(crxver))
+
+        self.nobs = nobs
+        self.N = max(nobs.values())
+
+        self.line = ''
+        self.clock = [0]*LEVELS; self.corder = -1; self.carc = 0
+        # per satellite
+        self.rows = {}
+        self.U = np.zeros((0, self.N, LEVELS), dtype=np.int64)  # arc differences of order 0..LEVELS-1
+        self.order = np.zeros((0, self.N), dtype=np.int8)
+        self.arc = np.zeros((0, self.N), dtype=np.int8)
+        self.flags = np.zeros((0, 2*self.N), dtype=np.uint8)
+        self.present = np.zeros(0, dtype=bool)  # in the previous epoch
+
+    def records(self, f:BinaryIO) -> Iterator[Tuple[str, list, float, list]]:
+        """
+        yield each data epoch of f from the current position as (epoch line, satellites, clock offset, data lines)
+
+        the epoch line is restored in RINEX 2 (CRINEX 1) or RINEX 3 layout, with all the satellites
+        on the line. clock offset [seconds] is None if absent. Events (epoch flag 2-5) are skipped.
+        """
+        for l in f:
+            l = l.decode('ascii','replace').rstrip('\r\n')
+            if not l.strip():
+                continue
+
+            if l[0] == self.init:
+                if self.ver == 1:
+                    l = ' ' + l[1:]
+            else:
+                l = _repair(self.line, l)
+
+            nsv = int(l[self.cnsv])
+            if not int(l[self.cflag]) in (0,1,6):  # event, special records are not compressed
+                for _ in range(nsv):
+                    f.readline()
+                continue
+            self.line = l
+
+            sv = [l[self.csv+i*3:self.csv+3+i*3].strip() for i in range(nsv)]
+            clock = self._clock(f.readline().decode('ascii','replace').strip())
+
+            yield l, sv, clock, [f.readline() for _ in range(nsv)]
+
+    def _clock(self, c:str) -> float:
+        """integrate the receiver clock offset"""
+        U = self.clock
+        if not c:
+            self.corder = -1
+            return
+        elif c[1:2] == '&':
+            self.carc = int(c[0])
+            U[:] = [int(c[2:])] + [0]*(LEVELS-1)
+            self.corder = 0
+        elif self.corder < 0:
+            raise ValueError('Compact RINEX clock difference without initialization: {}'.format(c))
+        else:
+            m = min(self.corder+1, self.carc)
+            U[m] = int(c)
+            for k in range(m-1, -1, -1):
+                U[k] += U[k+1]
+            self.corder = m
+
+        return U[0] * self.cunit
+
+    def decode(self, epochs:Sequence[Tuple[list,list]]) -> np.ndarray:
+        """
+        observations of a batch of consecutive epochs, (sv list, data lines) each
+
+        every epoch read must be decoded in order, as each continues the previous one's differences.
+        returns (total satellites, N, 3) array: value, LLI, SSI of each observation
+        """
+        sv = [s for e in epochs for s in e[0]]
+        lines = [l for e in epochs for l in e[1]]
+        if not sv:
+            self.present[:] = False
+            return np.empty((0, self.N, 3))
+
+        nobs = [self.nobs[s[0] if s[0] in self.nobs else None] for s in sv]
+        val, kind, arc, flags = _parse(lines, nobs, self.N)
+
+        for s in sv:
+            if s not in self.rows:
+                self._addrow(s)
+# %% (epoch, satellite) layout of the batch, satellites absent from an epoch are missing
+        rows, rr = np.unique([self.rows[s] for s in sv], return_inverse=True)
+        tt = np.repeat(np.arange(len(epochs)), [len(e[0]) for e in epochs])
+        T = len(epochs); R = rows.size; N = self.N
+
+        K = np.full((T, R, N), MISSING, dtype=np.int8); K[tt,rr] = kind
+        V = np.zeros((T, R, N), dtype=np.int64); V[tt,rr] = val
+        A = np.zeros((T, R, N), dtype=np.int8); A[tt,rr] = arc
+        D = np.full((T, R, 2*N), SPACE, dtype=np.uint8); D[tt,rr] = flags
+        present = np.zeros((T, R), dtype=bool); present[tt,rr] = True
+
+        U, order, arco = self._integrate(K, V, A, self.U[rows], self.order[rows], self.arc[rows])
+        F = self._flags(D, present, self.flags[rows], self.present[rows])
+# %% state for the next batch
+        self.U[rows] = U[-1]
+        self.order[rows] = order[-1]
+        self.arc[rows] = arco[-1]
+        self.flags[rows] = F[-1]
+        self.present[:] = False
+        self.present[rows] = present[-1]
+
+        miss = K[tt,rr] == MISSING
+        out = np.empty((len(sv), N, 3))
+        out[..., 0] = U[tt,rr,:,0] / 1000
+        out[..., 1] = todigit(F[tt,rr,0::2])
+        out[..., 2] = todigit(F[tt,rr,1::2])
+        out[miss] = np.nan  # flags of missing observations are kept for later epochs, not output
+
+        return out
+
+    def _addrow(self, s:str):
+        n = len(self.rows)
+        if n == self.U.shape[0]:
+            N = max(2*n, 64)
+            self.U = np.resize(self.U, (N, self.N, LEVELS))
+            self.order = np.resize(self.order, (N, self.N))
+            self.order[n:] = -1
+            self.arc = np.resize(self.arc, (N, self.N))
+            self.flags = np.resize(self.flags, (N, 2*self.N))
+            self.present = np.resize(self.present, N)
+            self.present[n:] = False
+        self.rows[s] = n
+
+    @staticmethod
+    def _integrate(K:np.ndarray, V:np.ndarray, A:np.ndarray,
+                   U0:np.ndarray, order0:np.ndarray, arc0:np.ndarray) -> tuple:
+        """
+        integrate the differences of all satellites and observations of a batch of epochs together
+
+        K, V, A: (epoch, satellite, observation) field kind, integer, arc order of the fields
+        U0, order0, arc0: differences of order 0..LEVELS-1, current order, arc order before the batch
+
+        At epoch t an arc of order M that started at epoch s sends its m = min(t-s, M) th difference.
+        Difference level k is then a running sum of level k+1, restarted where level k itself is sent,
+        so each level is a cumulative sum along the epochs, from the top level down to the values at k=0.
+        """
+        T = K.shape[0]
+        t = np.arange(T).reshape(T, 1, 1)
+# %% order of the difference sent at each epoch
+        diff = K == DIFF
+        s = np.maximum.accumulate(np.where(diff, -1, t), axis=0)  # start of arc, or -1: before this batch
+        s0 = np.maximum(s, 0)
+
+        inbatch = s >= 0
+        if (diff & inbatch & (np.take_along_axis(K, s0, axis=0) == MISSING)).any() or \
+           (diff & ~inbatch & (order0 < 0)).any():
+            raise ValueError('Compact RINEX difference without arc initialization')
+
+        arco = np.where(inbatch, np.take_along_axis(A, s0, axis=0), arc0)
+        m = np.where(diff, np.minimum(np.where(inbatch, t - s, t + 1 + order0), arco),
+                     np.where(K == INIT, 0, -1))
+# %% each level from the top down: sent where m == k, running sum of level k+1 where m > k
+        U = np.zeros(K.shape + (LEVELS,), dtype=np.int64)
+        U[-1] = U0  # levels above this batch's orders keep their state
+        te = np.arange(T+1).reshape(T+1, 1, 1)
+        for k in range(m.max(initial=0), -1, -1):
+            run = m > k
+            a = np.where(m == k, V, np.where(run, U[..., k+1] if k+1 < LEVELS else 0, 0))
+            a = np.concatenate((U0[None,..., k], a))  # state before the batch starts the first run
+            start = np.concatenate((np.ones((1,) + run.shape[1:], dtype=bool), ~run))
+
+            c = np.cumsum(a, axis=0)
+            i = np.maximum.accumulate(np.where(start, te, 0), axis=0)
+            U[..., k] = (c - np.take_along_axis(c, i, axis=0) + np.take_along_axis(a, i, axis=0))[1:]
+
+        return U, m, arco
+
+    @staticmethod
+    def _flags(D:np.ndarray, present:np.ndarray, F0:np.ndarray, present0:np.ndarray) -> np.ndarray:
+        """
+        LLI/SSI characters of a batch of epochs from their text differences
+
+        a character is the last one sent for it, and a satellite absent from the previous epoch starts blank.
+        """
+        T = D.shape[0]
+        new = present & ~np.concatenate((present0[None], present[:-1]))
+
+        a = np.concatenate((F0[None], np.where(D == AMP, SPACE, D)))
+        start = np.concatenate((np.ones((1,) + D.shape[1:], dtype=bool), (D != SPACE) | new[..., None]))
+        i = np.maximum.accumulate(np.where(start, np.arange(T+1).reshape(T+1, 1, 1), 0), axis=0)
+
+        return np.take_along_axis(a, i, axis=0)[1:]
+
+
+def _parse(lines:Sequence[bytes], nobs:Sequence[int], N:int) -> tuple:
+    """
+    convert satellite data lines to (nline, N) arrays of integer, field kind, arc order,
+    and the (nline, 2N) flag text differences
+    """
+    flat = []
+    flags = []
+    for l,n in zip(lines, nobs):
+        p = l.rstrip(b'\r\n').split(b' ', n)
+        flags.append(p[n] if len(p) > n else b'')
+        p = p[:n]
+        flat += p + [b''] * (N - len(p))
+
+    a = np.array(flat, dtype=bytes)
+    c = a.view(np.uint8).reshape(a.size, a.dtype.itemsize)
+    if c.shape[1] < 2:
+        c = np.hstack((c, np.zeros((c.shape[0], 2-c.shape[1]), dtype=np.uint8)))
+
+    ini = c[:,1] == AMP
+    kind = np.where(c[:,0] == 0, MISSING, np.where(ini, INIT, DIFF)).astype(np.int8)
+    arc = np.where(ini, c[:,0].astype(np.int8) - ord('0'), 0).astype(np.int8)
+
+    c = c.copy()
+    c[ini, :-2] = c[ini, 2:]
+    c[ini, -2:] = 0
+    c[c[:,0] == 0, 0] = ord('0')
+    val = c.view('S{}'.format(c.shape[1])).ravel().astype(np.int64)
+
+    shape = (len(lines), N)
+    return val.reshape(shape), kind.reshape(shape), arc.reshape(shape), chararray(flags, 2*N)
+
+
+def _repair(old:str, d:str) -> str:
+    """restore a line from its text difference d to the previous line: space is unchanged, & is a space"""
+    old = old.ljust(len(d))
+    return ''.join(o if c == ' ' else (' ' if c == '&' else c) for o,c in zip(old, d)) + old[len(d):]
@@ -0,0 +1,167 @@
+"""
+Header-only reading of RINEX 2/3 OBS/NAV files, for routing and cataloguing files without reading their data.
+
+Only the header lines are read. The time of the last epoch, which the header needn't give
+(or give rightly), can be found by reading just the end of an OBS file.
+"""
+from pathlib import Path
+import re
+from collections import deque
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional, Dict, List, Tuple
+#
+from .compress import opener, compression, BLOCK
+from .hatanaka import CRX
+from .rinex2 import _obstime
+from .rinex3 import _timeobs3
+
+TAIL = 65536  # [bytes] first read from the end of the file for the last epoch
+
+FILETYPES = {'O': 'obs', 'N': 'nav', 'G': 'nav', 'H': 'nav', 'M': 'met'}
+NAVSYSTEMS2 = {'N': 'G', 'G': 'R', 'H': 'S'}  # RINEX 2 NAV file type: system
+
+# epoch lines of epochs with observations, flag 0 or 1
+EPOCH2 = re.compile(rb'^ [ \d]\d( [ \d]\d){4}[ \d]{2}\d\.\d{7}  [01]')
+EPOCH3 = re.compile(rb'^> \d{4}( [ \d]\d){4}[ \d]{2}\d\.\d{7}  [01]')
+
+RinexHeader = NamedTuple('RinexHeader', [('filename', Path),
+                                         ('version', float),
+                                         ('filetype', str),
+                                         ('system', str),
+                                         ('marker', str),
+                                         ('position', Optional[Tuple[float,float,float]]),
+                                         ('fields', Dict[str,List[str]]),
+                                         ('interval', Optional[float]),
+                                         ('first', Optional[datetime]),
+                                         ('last', Optional[datetime]),
+                                         ('hatanaka', bool)])
+RinexHeader.__doc__ = """
+RINEX file metadata from its header
+
+filetype: 'obs', 'nav' or 'met'
+system: 'G', 'R', 'E', 'S', 'C', 'J', 'I' or 'M' (mixed)
+position: approximate marker position XYZ [m], None if not given
+fields: OBS types of each system. RINEX 2: one list for all systems, under key system.
+interval: [seconds] None if not given
+first, last: times of the first and last epoch, None if unknown
+hatanaka: Compact RINEX (Hatanaka compressed) file
+"""
+
+
+def rinexheader(fn:Path, tail:bool=False) -> RinexHeader:
+    """
+    metadata of RINEX file fn from its header
+
+    first is TIME OF FIRST OBS, else the time of the first epoch line of a file that isn't Hatanaka compressed.
+    last is TIME OF LAST OBS, or with tail=True the time of the last epoch,
+    found by reading the end of the file (or the whole stream of a compressed file).
+    """
+    fn = Path(fn).expanduser()
+
+    with opener(fn) as f:
+        hdr = {}
+        l = f.readline().decode('ascii','replace')
+        hatanaka = CRX in l[60:]
+        if hatanaka:  # RINEX header follows the 2 CRINEX lines
+            f.readline()
+            l = f.readline().decode('ascii','replace')
+
+        while l:
+            h = l[60:80].strip()
+            if h == 'END OF HEADER':
+                break
+            # continuation lines e.g. of OBS types are joined
+            hdr[h] = hdr[h] + '\n' + l[:60] if h in hdr else l[:60]
+            l = f.readline().decode('ascii','replace')
+        else:
+            raise ValueError('END OF HEADER not found in {}'.format(fn))
+
+        first = None
+        if not hatanaka and 'TIME OF FIRST OBS' not in hdr:
+            first = _epochtime(f.readline())
+
+    vt = hdr['RINEX VERSION / TYPE']
+    version = float(vt[:9])
+    filetype = FILETYPES.get(vt[20], vt[20])
+    if filetype == 'nav' and int(version) == 2:
+        system = NAVSYSTEMS2.get(vt[20], 'G')
+    else:
+        system = vt[40].strip() or 'G'
+
+    position = None
+    if 'APPROX POSITION XYZ' in hdr:
+        position = tuple(float(x) for x in hdr['APPROX POSITION XYZ'].split()[:3])
+
+    interval = float(hdr['INTERVAL'][:10]) if 'INTERVAL' in hdr else None
+    if 'TIME OF FIRST OBS' in hdr:
+        first = _headertime(hdr['TIME OF FIRST OBS'])
+
+    if tail and filetype == 'obs' and not hatanaka:
+        last = _lastepoch(fn)
+    else:
+        last = _headertime(hdr['TIME OF LAST OBS']) if 'TIME OF LAST OBS' in hdr else None
+
+    return RinexHeader(fn, version, filetype, system, hdr.get('MARKER NAME', '').strip(), position,
+                       _fields(hdr, version, system), interval, first, last, hatanaka)
+
+
+def _fields(hdr:dict, version:float, system:str) -> dict:
+    """OBS types of each system"""
+    fields = {}
+    if int(version) == 2 and '# / TYPES OF OBSERV' in hdr:
+        fields[system] = [t for l in hdr['# / TYPES OF OBSERV'].split('\n') for t in l[6:60].split()]
+    elif 'SYS / # / OBS TYPES' in hdr:
+        k = None
+        for l in hdr['SYS / # / OBS TYPES'].split('\n'):
+            if l[0].strip():
+                k = l[0]
+                fields[k] = []
+            fields[k] += l[6:60].split()
+
+    return fields
+
+
+def _headertime(c:str) -> datetime:
+    """time of TIME OF FIRST/LAST OBS"""
+    t = c[:43].split()
+    return datetime(int(t[0]), int(t[1]), int(t[2]), int(t[3]), int(t[4])) + timedelta(seconds=float(t[5]))
+
+
+def _epochtime(l:bytes) -> Optional[datetime]:
+    """time of RINEX 2/3 OBS epoch line l of an epoch with observations, None if l isn't one"""
+    if EPOCH3.match(l):
+        return _timeobs3(l.decode('ascii'))
+    elif EPOCH2.match(l):
+        return _obstime(l[:26].decode('ascii').split())
+
+
+def _lastepoch(fn:Path) -> Optional[datetime]:
+    """time of the last epoch of OBS file fn, reading the file backward from its end"""
+    if compression(fn):  # no seeking back: keep the last blocks of the stream
+        with opener(fn) as f:
+            blocks = deque(maxlen=max(1, TAIL // BLOCK) + 1)
+            size = 0
+            for b in iter(lambda: f.read(BLOCK), b''):
+                blocks.append(b)
+                size += len(b)
+        buf = b''.join(blocks)
+        return _lasttime(buf, len(buf) < size)
+
+    with fn.open('rb') as f:
+        size = f.seek(0, 2)
+        n = TAIL
+        while True:
+            f.seek(max(0, size - n))
+            t = _lasttime(f.read(n), n < size)
+            if t is not None or n >= size:
+                return t
+            n *= 8
+
+
+def _lasttime(buf:bytes, partial:bool) -> Optional[datetime]:
+    """time of the last epoch line in buf, whose first line may be partial"""
+    lines = buf.split(b'\n')
+    for l in reversed(lines[1:] if partial else lines):
+        t = _epochtime(l)
+        if t is not None:
+            return t
@@ -0,0 +1,255 @@
+"""
+Byte-offset index of the epochs of RINEX 2/3 OBS files.
+
+The file is scanned once through mmap for epoch header lines -- '>' at the start
+of a line in RINEX 3, and the epoch flag / satellite count of RINEX 2 epoch lines
+to step over the satellite lines -- without decoding any observations.
+The index can be saved to a sidecar file next to the OBS file, and lets reads of
+a time range or a single epoch seek directly to it.
+"""
+from pathlib import Path
+import mmap
+import numpy as np
+from math import ceil
+from datetime import datetime
+from typing import Tuple
+#
+from .fixedwidth import toint, tofloat, todatetime, SPACE
+from .compress import compression
+
+INDEX = np.dtype([('offset', np.int64),       # byte offset of epoch header line
+                  ('time', 'datetime64[ns]'),
+                  ('flag', np.uint8),         # epoch flag
+                  ('nsv', np.uint16)])        # number of satellites, or special records for flag > 1
+
+SIDECAR = '.idx.npz'
+TOL = 1e-3 # [seconds] tolerance of epoch times to the decimation grid
+
+
+def obsindex(fn:Path, sidecar:bool=False) -> np.ndarray:
+    """
+    index of the epochs of a RINEX 2/3 OBS file
+
+    sidecar: load the index from the sidecar file if it is up to date, else build it and save the sidecar
+    """
+    fn = Path(fn).expanduser()
+    if compression(fn):
+        raise ValueError('the epoch index is for uncompressed files, not {}'.format(fn))
+
+    if sidecar:
+        idx = load_index(fn)
+        if idx is not None:
+            return idx
+
+    with fn.open('rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        ver, Nobs, start = _header(mm)
+        if int(ver) == 2:
+            idx = _index2(mm, start, Nobs)
+        elif int(ver) == 3:
+            idx = _index3(mm, start)
+        else:
+            raise ValueError('unknown RINEX verion {}  {}'.format(ver,fn))
+
+    if sidecar:
+        save_index(fn, idx)
+
+    return idx
+
+
+def save_index(fn:Path, idx:np.ndarray):
+    """write the index to the sidecar file of OBS file fn"""
+    fn = Path(fn).expanduser()
+    st = fn.stat()
+
+    with (fn.parent / (fn.name + SIDECAR)).open('wb') as f:
+        np.savez(f, index=idx, size=st.st_size, mtime=st.st_mtime)
+
+
+def load_index(fn:Path) -> np.ndarray:
+    """read the sidecar index of OBS file fn, None if missing or out of date"""
+    fn = Path(fn).expanduser()
+    ifn = fn.parent / (fn.name + SIDECAR)
+    if not ifn.is_file():
+        return
+
+    st = fn.stat()
+    with np.load(ifn) as z:
+        if z['size'] != st.st_size or z['mtime'] != st.st_mtime:
+            return
+        return z['index']
+
+
+def epochrange(idx:np.ndarray, tlim:tuple) -> Tuple[int,int]:
+    """
+    byte range (start, stop) holding the epochs with tlim[0] <= time <= tlim[1]
+
+    stop is None when the range extends to the end of file.
+    (0, 0) is returned if no epoch is in tlim.
+    """
+    t0, t1 = (np.datetime64(t, 'ns') for t in tlim)
+    i = np.nonzero((idx['time'] >= t0) & (idx['time'] <= t1))[0]
+    if not i.size:
+        return 0, 0
+
+    start = int(idx['offset'][i[0]])
+    stop = int(idx['offset'][i[-1]+1]) if i[-1]+1 < idx.size else None
+
+    return start, stop
+
+
+def epochfilter(tlim:tuple=None, interval:float=None):
+    """
+    selection of epochs by time window and decimation interval
+
+    tlim: (start, stop) times, inclusive
+    interval: keep only epochs on this grid of seconds, counted from the start of the day
+
+    returns function of epoch time (datetime): True keep, False skip, None past the end of tlim
+    """
+    if tlim is not None:
+        t0, t1 = (np.datetime64(t, 'us').item() for t in tlim)
+
+    def keep(t:datetime):
+        if tlim is not None:
+            if t > t1:
+                return None
+            if t < t0:
+                return False
+
+        if interval:
+            r = (t - t.replace(hour=0, minute=0, second=0, microsecond=0)).total_seconds() % interval
+            return min(r, interval - r) < TOL
+
+        return True
+
+    return keep
+
+
+def _header(mm:mmap.mmap) -> tuple:
+    """RINEX version, number of RINEX 2 observation types and byte offset of the first epoch"""
+    i = mm.find(b'END OF HEADER')
+    if i < 0:
+        raise ValueError('END OF HEADER not found')
+    start = mm.find(b'\n', i) + 1
+
+    hdr = mm[:start].decode('ascii','replace').splitlines()
+    if 'CRINEX VERS' in hdr[0][60:]:
+        raise ValueError('the epoch index is not for Hatanaka compressed files')
+    ver = float(hdr[0][:9])
+
+    Nobs = None
+    for l in hdr:
+        if '# / TYPES OF OBSERV' in l[60:]:
+            Nobs = int(l[:6])
+            break
+
+    return ver, Nobs, start
+
+
+def _epochlines(mm:mmap.mmap, start:int) -> np.ndarray:
+    """byte offset of each line after the header"""
+    a = np.frombuffer(mm, dtype=np.uint8)
+    try:
+        nl = np.nonzero(a[start:] == 10)[0] + start + 1
+    finally:
+        del a  # must release the buffer before the mmap is closed
+
+    nl = np.insert(nl, 0, start)
+    return nl[nl < len(mm)]
+
+
+def _rows(mm:mmap.mmap, offsets:np.ndarray, width:int) -> np.ndarray:
+    """(noffsets, width) uint8 array of the bytes at each offset"""
+    a = np.frombuffer(mm, dtype=np.uint8)
+    try:
+        i = offsets[:,None] + np.arange(width)
+        c = a[np.minimum(i, a.size-1)]
+        c[i >= a.size] = ord(' ')
+    finally:
+        del a
+
+    c[(c == 10) | (c == 13)] = ord(' ')
+    return c
+
+
+def _index3(mm:mmap.mmap, start:int) -> np.ndarray:
+    """RINEX 3: every epoch header line starts with '>'"""
+    a = np.frombuffer(mm, dtype=np.uint8)
+    try:
+        off = np.nonzero(a[start:] == ord('>'))[0] + start
+        off = off[(off == start) | (a[off-1] == 10)]
+    finally:
+        del a
+
+    c = _rows(mm, off, 35)
+
+    idx = np.empty(off.size, dtype=INDEX)
+    idx['offset'] = off
+    idx['time'] = _times(c[:,2:29], _time3)
+    idx['flag'] = toint(c[:,31:32])
+    idx['nsv'] = toint(c[:,32:35])
+
+    return idx
+
+
+def _index2(mm:mmap.mmap, start:int, Nobs:int) -> np.ndarray:
+    """RINEX 2: step over the satellite lines using each epoch's flag and number of satellites"""
+    from .rinex2 import _nlines2  # rinex2 imports this module
+
+    Nl_sv = int(ceil(Nobs/5))
+    lines = _epochlines(mm, start)
+
+    off = []
+    i = 0
+    while i < lines.size:
+        o = lines[i]
+        l = mm[o:o+32]
+        if not l.strip():  # blank line
+            i += 1
+            continue
+
+        off.append(o)
+        i += _nlines2(l, Nl_sv)
+
+    off = np.array(off, dtype=np.int64)
+    c = _rows(mm, off, 32)
+
+    idx = np.empty(off.size, dtype=INDEX)
+    idx['offset'] = off
+    idx['time'] = _times(c[:,1:26], _time2)
+    idx['flag'] = toint(c[:,28:29])
+    idx['nsv'] = toint(c[:,29:32])
+
+    return idx
+
+
+def _time3(c:np.ndarray) -> np.ndarray:
+    """time of RINEX 3 epoch lines from their columns 2:29"""
+    return todatetime(toint(c[:,0:4]), toint(c[:,5:7]), toint(c[:,8:10]),
+                      toint(c[:,11:13]), toint(c[:,14:16]), tofloat(c[:,16:27]))
+
+
+def _time2(c:np.ndarray) -> np.ndarray:
+    """time of RINEX 2 epoch lines from their columns 1:26"""
+    year = toint(c[:,0:2])
+    year[(80 <= year) & (year <= 99)] += 1900
+    year[year < 80] += 2000
+
+    return todatetime(year, toint(c[:,3:5]), toint(c[:,6:8]), toint(c[:,9:11]), toint(c[:,12:14]), tofloat(c[:,14:25]))
+
+
+def _times(c:np.ndarray, totime) -> np.ndarray:
+    """
+    epoch times from the time columns c of the epoch lines, by totime(c)
+
+    Event records may leave the time blank: they get the time of the epoch before them
+    (at the start of the file, after them), so the index stays in time order.
+    """
+    blank = (c == SPACE).all(axis=1)
+    t = np.full(c.shape[0], np.datetime64('NaT'), dtype='datetime64[ns]')
+    i = np.nonzero(~blank)[0]
+    if not i.size:
+        return t
+
+    t[i] = totime(c[i])
+    return t[i[np.maximum(np.searchsorted(i, np.arange(t.size), side='right') - 1, 0)]]
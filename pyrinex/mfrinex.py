@@ -0,0 +1,57 @@
+"""
+Opening many RINEX OBS files, e.g. a network of stations over weeks, as one dask-backed Dataset.
+
+Each file is opened lazily by the xarray backend (see pyrinex.backend), so opening reads only headers
+and epoch indexes. Each dask chunk of a variable is read by parsing just its file's range of epochs,
+so the computation runs in parallel and out-of-core on the dask scheduler.
+
+Needs the dask package.
+"""
+from pathlib import Path
+from datetime import datetime
+import numpy as np
+import xarray
+from typing import Union, Sequence
+#
+from .batch import findrinex, rinextype
+from .compress import stem
+from .header import rinexheader
+
+
+def open_mfrinex(paths:Union[str,Path,Sequence], use:Union[str,list,tuple]=None,
+                 meas:Union[str,list,tuple]=None, chunks:dict=None) -> xarray.Dataset:
+    """
+    open RINEX OBS files as one (station, time, sv) Dataset of dask arrays
+
+    paths: files, directories and glob patterns, as convert_many()
+    use: systems to keep, as rinexobs(). For RINEX 3 one system, default the first of each file's header.
+    meas: observation types, as rinexobs()
+    chunks: dask chunks of each file e.g. {'time': 2880} for ranges of epochs, default one chunk per file
+
+    A station is the MARKER NAME of the header, else the first 4 characters of the file name.
+    The files of a station are joined along time in order of their first epoch.
+    Satellites and times missing at a station are NaN.
+    """
+    from .backend import RinexBackendEntrypoint
+
+    stations = {}
+    for fn in findrinex(paths):
+        if rinextype(fn) != 'obs':
+            continue
+        h = rinexheader(fn)
+        name = h.marker or stem(fn)[:4].upper()
+        stations.setdefault(name, []).append((h.first or datetime.min, fn))
+
+    if not stations:
+        raise FileNotFoundError('no RINEX OBS files in {}'.format(paths))
+
+    names = sorted(stations)
+    data = []
+    for name in names:
+        files = [fn for _,fn in sorted(stations[name])]
+        obs = [xarray.open_dataset(fn, engine=RinexBackendEntrypoint, use=use, meas=meas,
+                                   chunks=chunks if chunks is not None else {}) for fn in files]
+        data.append(xarray.concat(obs, dim='time', join='outer', combine_attrs='drop_conflicts') if len(obs) > 1 else obs[0])
+
+    return xarray.concat(data, dim=xarray.DataArray(np.array(names, dtype=str), dims='station', name='station'),
+                         join='outer', combine_attrs='drop_conflicts')
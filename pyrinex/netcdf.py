@@ -0,0 +1,138 @@
+"""
+NetCDF4 output of OBS data, and selective reads of NetCDF OBS/NAV files.
+
+OBS variables are chunked in (time, sv) for the two usual reads, one satellite's whole time series
+and all satellites over a time range: a chunk spans CHUNKTIME of epochs and as few satellites
+as keep it at least MINCHUNK bytes, so either read touches a column or a row of chunks.
+The shuffle filter groups the bytes of the values before zlib, which compresses them better.
+The systems of a RINEX 3 file are groups OBS/G, OBS/R, ... of one file, listed by attribute 'systems' of OBS.
+"""
+from pathlib import Path
+import logging
+import numpy as np
+import xarray
+from typing import Union
+#
+from .accumulate import isflag, isfloat32, FILL
+from .rinex2 import _use
+
+COMPLVL = 1  # for NetCDF compression. too high slows down with little space savings.
+CHUNKTIME = 3600.  # [seconds] time span of a chunk
+MINCHUNK = 16384  # [bytes] smallest chunk, for data of long intervals
+
+
+def chunks(obs:xarray.Dataset, itemsize:int) -> tuple:
+    """(time, sv) chunk shape of the OBS variables with itemsize bytes per value"""
+    Nt = max(obs.time.size, 1)
+    Ns = max(obs.sv.size, 1)
+
+    if obs.time.size > 1:  # the header interval may not be the data's, e.g. when decimated
+        dt = np.median(np.diff(obs.time.values)) / np.timedelta64(1, 's')
+    else:
+        dt = obs.attrs.get('interval')
+    if not dt or dt <= 0:
+        dt = 1.
+
+    ct = int(min(Nt, max(1, round(CHUNKTIME / dt))))
+    cs = int(min(Ns, max(1, MINCHUNK // (ct * itemsize))))
+
+    return ct, cs
+
+
+def encoding(obs:xarray.Dataset, compact:Union[bool,str]=False) -> dict:
+    """NetCDF encoding of the OBS variables: chunks, shuffle, zlib, and the dtypes of compact (see rinexobs)"""
+    enc = {}
+    for k in obs.data_vars:
+        enc[k] = {'zlib':True, 'complevel':COMPLVL, 'fletcher32':True, 'shuffle':True}
+        itemsize = obs[k].dtype.itemsize
+        if compact and isflag(k):
+            enc[k].update(dtype='uint8', _FillValue=FILL)
+            itemsize = 1
+        elif compact == 'float32' and isfloat32(k):
+            enc[k].update(dtype='float32')
+            itemsize = 4
+
+        if obs[k].dims == ('time', 'sv'):
+            enc[k]['chunksizes'] = chunks(obs, itemsize)
+
+    return enc
+
+
+def writeobs(obs:Union[xarray.Dataset,dict], ofn:Path, group:str='OBS', compact:Union[bool,str]=False):
+    """write OBS data to NetCDF file ofn, a dict of systems as groups <group>/G, <group>/R, ..."""
+    ofn = Path(ofn).expanduser()
+    wmode = 'a' if ofn.is_file() else 'w'
+
+    if isinstance(obs, xarray.Dataset):
+        obs.to_netcdf(ofn, group=group, mode=wmode, encoding=encoding(obs, compact))
+    else:
+        xarray.Dataset(attrs={'systems': ','.join(obs)}).to_netcdf(ofn, group=group, mode=wmode)
+        for k,v in obs.items():
+            v.to_netcdf(ofn, group=group+'/'+k, mode='a', encoding=encoding(v, compact))
+
+
+def readnc(fn:Path, group:str, use:Union[str,list,tuple]=None,
+           meas:Union[str,list,tuple]=None, tlim:tuple=None) -> Union[xarray.Dataset,dict]:
+    """
+    read group of NetCDF file fn, selecting systems, observation types and times like rinexobs()
+
+    only the chunks holding the selection are read.
+    a group with per-system groups gives a dict of the systems in use, unwrapped if just one.
+    None if the group isn't in the file.
+
+    Each group is read and closed in turn: the netCDF library can crash on a file
+    open several times that is then closed out of order.
+    """
+    fn = Path(fn).expanduser()
+    if isinstance(meas, str):
+        meas = [meas]
+    use = _use(use)
+
+    try:
+        with xarray.open_dataset(fn, group=group) as ds:
+            systems = ds.attrs.get('systems')
+            if systems is None:
+                return _select(ds, use, meas, tlim).load()
+    except OSError:
+        logging.error('Group {} not found in {}'.format(group,fn))
+        return
+
+    obs = {}
+    for k in systems.split(','):
+        if use is None or k in use:
+            with xarray.open_dataset(fn, group=group+'/'+k) as ds:
+                obs[k] = _select(ds, None, meas, tlim).load()
+    if len(obs) == 1:
+        obs = next(iter(obs.values()))
+
+    return obs
+
+
+def _select(ds:xarray.Dataset, use:Union[str,list,tuple], meas:list, tlim:tuple) -> xarray.Dataset:
+    if tlim is not None:
+        t0, t1 = (np.datetime64(t, 'ns') for t in tlim)
+        t = ds.time.values
+        ds = ds.isel(time=_indexer((t >= t0) & (t <= t1)))
+
+    if use is not None and 'sv' in ds.variables:
+        if ds.sv.dtype.kind in 'US':
+            system = np.array([str(s)[:1] for s in ds.sv.values])
+        else:  # RINEX 2 NAV: PRN numbers of GPS satellites
+            system = np.full(ds.sv.size, 'G')
+        ds = ds.isel({ds.sv.dims[0]: _indexer(np.isin(system, list(use)))})
+
+    if meas is not None:
+        ds = ds[[k for k in ds.data_vars if k != 'sv' and any(k.startswith(m) for m in meas)]]
+
+    return ds
+
+
+def _indexer(mask:np.ndarray) -> Union[slice,np.ndarray]:
+    """contiguous selections as a slice, read as one hyperslab"""
+    i = np.nonzero(mask)[0]
+    if not i.size:
+        return slice(0, 0)
+    if i[-1] - i[0] + 1 == i.size:
+        return slice(int(i[0]), int(i[-1]) + 1)
+
+    return i
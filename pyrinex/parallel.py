@@ -0,0 +1,170 @@
+"""
+Parallel parsing of one OBS file across processes.
+
+A quick boundary scan (pyrinex.index) splits the file at epoch boundaries into
+byte ranges of about equal size. Each range is parsed in a process pool by the
+usual _scan2/_scan3, and the workers return the numeric data through shared
+memory -- only names, shapes, times and SV lists are pickled. Without
+multiprocessing.shared_memory (Python < 3.8) the data is pickled too.
+The partial results are then stitched together in time order on the union of SVs.
+"""
+from pathlib import Path
+import os
+import numpy as np
+import xarray
+from concurrent.futures import ProcessPoolExecutor
+from typing import Union, List
+#
+from .index import obsindex, load_index, epochrange
+from .rinex2 import _scan2
+from .rinex3 import _scan3
+
+
+def splitranges(idx:np.ndarray, N:int, offsets:tuple=None, size:int=None) -> List[tuple]:
+    """
+    split the epochs of an epoch index into N byte ranges (start, stop) at epoch boundaries
+
+    offsets: restrict to this (start, stop) byte range, stop None is end of file
+    size: file size in bytes, the end of the last range
+    """
+    off = idx['offset']
+    if offsets is not None:
+        start, stop = offsets
+        off = off[(off >= start) & (off < (stop if stop is not None else np.inf))]
+    if not off.size:
+        return []
+
+    end = size if offsets is None or offsets[1] is None else offsets[1]
+    # epoch nearest each 1/N of the bytes
+    cuts = np.searchsorted(off, np.linspace(off[0], end, N+1)[1:-1])
+    bounds = np.unique(np.concatenate(([off[0]], off[np.minimum(cuts, off.size-1)])))
+
+    return [(int(a), int(b)) for a,b in zip(bounds, np.append(bounds[1:], end))]
+
+
+def rinexobs_parallel(fn:Path, ver:float, workers:int, use:Union[str,list,tuple]=None,
+                      tlim:tuple=None, interval:float=None, meas:Union[str,list,tuple]=None):
+    """
+    parse an OBS file in byte ranges across workers processes
+
+    returns Dataset (RINEX 2) or dict of Datasets (RINEX 3), as _scan2/_scan3
+    """
+    try:
+        from multiprocessing import shared_memory  # Python >= 3.8
+    except ImportError:  # the workers return the data pickled
+        shared_memory = None
+
+    fn = Path(fn).expanduser()
+
+    idx = load_index(fn)
+    if idx is None:
+        idx = obsindex(fn)
+    offsets = epochrange(idx, tlim) if tlim is not None else None
+
+    ranges = splitranges(idx, workers, offsets, fn.stat().st_size)
+    if len(ranges) <= 1:
+        ranges = [offsets if offsets is not None else (0, None)]
+
+    parts = []
+    try:
+        with ProcessPoolExecutor(workers) as pool:
+            futs = [pool.submit(_part, fn, ver, r, use, tlim, interval, meas, shared_memory is not None)
+                    for r in ranges]
+        # all workers are done: keep the blocks of those that succeeded for unlinking, then raise any error
+        parts = [f.result() for f in futs if f.exception() is None]
+        for f in futs:
+            f.result()
+
+        out = {}
+        for k in parts[0]:  # in time order
+            out[k] = _stitch([p[k] for p in parts], shared_memory)
+    finally:
+        for p in parts:
+            for meta in p.values():
+                if meta['shm'] is not None:
+                    shm = shared_memory.SharedMemory(meta['shm'])
+                    shm.close()
+                    shm.unlink()
+
+    return out[None] if int(ver) == 2 else out
+
+
+def _part(fn:Path, ver:float, offsets:tuple, use, tlim, interval, meas, shm:bool=True) -> dict:
+    """worker: parse one byte range, leaving the data in shared memory if shm, else returning it"""
+    if int(ver) == 2:
+        obs = {None: _scan2(fn, use, False, offsets, tlim, interval, meas)}
+    else:
+        obs = _scan3(fn, use, False, offsets, tlim, interval, meas)
+
+    return {k: _toshm(ds, shm) for k,ds in obs.items()}
+
+
+def _toshm(ds:xarray.Dataset, shm:bool=True) -> dict:
+    """copy the (time, sv) variables of ds into a new shared memory block, or into 'data' if not shm"""
+    names = list(ds.data_vars)
+    shape = (len(names), ds.time.size, ds.sv.size)
+    meta = {'names': names, 'shape': shape, 'shm': None, 'data': None,
+            'time': ds.time.values, 'sv': ds.sv.values.tolist(), 'attrs': ds.attrs}
+
+    nbytes = int(np.prod(shape)) * 8
+    if not nbytes:
+        return meta
+    if not shm:
+        meta['data'] = np.array([ds[k].values for k in names], dtype=np.float64).reshape(shape)
+        return meta
+
+    from multiprocessing import shared_memory, resource_tracker
+
+    # the parent process unlinks the block, don't let this process' resource tracker do it too
+    try:
+        shm = shared_memory.SharedMemory(create=True, size=nbytes, track=False)  # Python >= 3.13
+    except TypeError:
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        if os.name == 'posix':  # tracked by its POSIX name, with the leading '/' that shm.name drops
+            resource_tracker.unregister('/' + shm.name, 'shared_memory')
+
+    buf = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    for i,k in enumerate(names):
+        buf[i] = ds[k].values
+    del buf
+    shm.close()
+
+    meta['shm'] = shm.name
+    return meta
+
+
+def _stitch(parts:list, shared_memory) -> xarray.Dataset:
+    """
+    concatenate the partial results in time order on the union of SVs
+
+    SV order matches a serial read: the common SV order if every part has the same one, else sorted.
+    """
+    names = parts[0]['names']
+    used = [p for p in parts if p['time'].size]
+
+    svs = [p['sv'] for p in used if p['sv']]  # as ObsAccumulator, parts without this system's SVs don't count
+    if svs and all(s == svs[0] for s in svs):
+        sv = svs[0]
+    else:
+        sv = sorted(set(s for p in svs for s in p))
+    col = {s:i for i,s in enumerate(sv)}
+
+    time = np.concatenate([p['time'] for p in used]) if used else np.empty(0, dtype='datetime64[ns]')
+    darr = np.full((len(names), time.size, len(sv)), np.nan)
+
+    t = 0
+    for p in used:
+        nt = p['time'].size
+        if p['data'] is not None:
+            darr[:, t:t+nt, [col[s] for s in p['sv']]] = p['data']
+        elif p['shm'] is not None:
+            shm = shared_memory.SharedMemory(p['shm'])
+            buf = np.ndarray(p['shape'], dtype=np.float64, buffer=shm.buf)
+            darr[:, t:t+nt, [col[s] for s in p['sv']]] = buf
+            del buf
+            shm.close()
+        t += nt
+
+    return xarray.Dataset({k: (('time','sv'), darr[i]) for i,k in enumerate(names)},
+                          coords={'time': time, 'sv': np.array(sv, dtype=str)},
+                          attrs=parts[0]['attrs'])
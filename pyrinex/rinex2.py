@@ -1,12 +1,18 @@
 from pathlib import Path
 import numpy as np
 from math import ceil
-from datetime import datetime
-from io import BytesIO
+from datetime import datetime, timedelta
 import xarray
-from typing import Union
+from typing import Union, Iterator, BinaryIO
 #
+from .accumulate import ObsAccumulator
+from .index import epochfilter
+from .compress import opener
+from .hatanaka import CRXDecoder, CRX
+from .fixedwidth import chararray, obsfields, navfields, tofloat, toint, todatetime, SPACE
+
 STARTCOL2 = 3 #column where numerical data starts for RINEX 2
+BATCH = 1000 # number of OBS epochs decoded together
 
 F = ('SVclockBias','SVclockDrift','SVclockDriftRate','IODE','Crs','DeltaN',
      'M0','Cuc','Eccentricity','Cus','sqrtA','Toe','Cic','omega0','Cis','Io',
@@ -29,11 +35,9 @@ def _rinexnav2(fn:Path) -> xarray.Dataset:
     assert len(F) == 29
     Lf = 19 # string length per field
 
-    sv = []; epoch=[]; raws=[]
-
-    with fn.open('r') as f:
+    with opener(fn) as f:
         """verify RINEX version, and that it's NAV"""
-        line = f.readline()
+        line = f.readline().decode('ascii','replace')
         ver = float(line[:9])
         assert int(ver)==2,'see _rinexnav3() for RINEX 3.0 files'
         assert line[20] == 'N', 'Did not detect Nav file'
@@ -42,42 +46,30 @@ def _rinexnav2(fn:Path) -> xarray.Dataset:
         skip header, which has non-constant number of rows
         """
         while True:
-            if 'END OF HEADER' in f.readline():
+            if b'END OF HEADER' in f.readline():
                 break
         """
-        now read data
+        now read data, all at once
         """
-        for l in f:
-            # format I2 http://gage.upc.edu/sites/default/files/gLAB/HTML/GPS_Navigation_Rinex_v2.11.html
-            sv.append(int(l[:2]))
-            # format I2
-            year = int(l[3:5])  # yes, skipping one unused columsn
-            if 80 <= year <=99:
-                year += 1900
-            elif year<80: #good till year 2180
-                year += 2000
-
-            epoch.append(datetime(year =year,
-                                  month   =int(l[6:8]),
-                                  day     =int(l[9:11]),
-                                  hour    =int(l[12:14]),
-                                  minute  =int(l[15:17]),
-                                  second  =int(l[17:20]),  # python reads second and fraction in parts
-                                  microsecond=int(l[21])*100000))
-            """
-            now get the data as one big long string per SV
-            """
-            raw = l[22:79]  # NOTE: MUST be 79, not 80 due to some files that put \n a character early!
-            for _ in range(Nl):
-                raw += f.readline()[STARTCOL2:79]
-            # one line per SV
-            raws.append(raw.replace('D','E'))
+        lines = f.read().rstrip().splitlines()
+
+    c = chararray(lines, 80)
+    # the first line of a record has the PRN (format I2), continuation lines are blank there
+    starts = np.nonzero((c[:,:2] != SPACE).any(axis=1))[0]
+    if not (np.diff(np.append(starts, len(lines))) == Nl+1).all():
+        raise ValueError('{} records must have {} lines each'.format(fn, Nl+1))
 # %% parse
-    # for RINEX 2, don't use delimiter
-    darr = np.empty((len(raws), Nf))
+    # http://gage.upc.edu/sites/default/files/gLAB/HTML/GPS_Navigation_Rinex_v2.11.html
+    sv = toint(c[starts, :2])
+    year = toint(c[starts, 3:5])  # yes, skipping one unused columsn
+    year[(80 <= year) & (year <= 99)] += 1900
+    year[year < 80] += 2000  #good till year 2180
 
-    for i,r in enumerate(raws):
-        darr[i,:] = np.genfromtxt(BytesIO(r.encode('ascii')), delimiter=[Lf]*Nf)  # must have *Nf to avoid false nan on trailing spaces
+    epoch = todatetime(year, toint(c[starts, 6:8]), toint(c[starts, 9:11]),
+                       toint(c[starts, 12:14]), toint(c[starts, 15:17]), tofloat(c[starts, 17:22]))
+
+    # NOTE: fields end at column 79, not 80 due to some files that put \n a character early!
+    darr = navfields(c, starts, Nl+1, 22, STARTCOL2, Nf, Lf)
 
     dsf = {f: ('time',d) for (f,d) in zip(F,darr.T)}
     dsf.update({'sv':('time',sv)})
@@ -91,23 +83,48 @@ def _rinexnav2(fn:Path) -> xarray.Dataset:
     return nav
 
 
-def _scan2(fn:Path, use:Union[str,list,tuple], verbose:bool=False) -> xarray.Dataset:
-  """
-   procss RINEX OBS data
-  """
+def _scan2(fn:Path, use:Union[str,list,tuple], verbose:bool=False,
+           offsets:tuple=None, tlim:tuple=None, interval:float=None,
+           meas:Union[str,list,tuple]=None) -> xarray.Dataset:
+    """
+    procss RINEX OBS data
+
+    offsets: (start, stop) byte range of epochs to read, from pyrinex.index. stop None is end of file.
+    tlim, interval: epoch selection, see pyrinex.index.epochfilter().
+        The satellite lines of other epochs are skipped without being parsed.
+    meas: observation types to decode, e.g. ['C1','P2','L1','L2'], each also matching types it is a prefix of.
+        Other observation columns are never converted or allocated.
+    """
+    return next(_iter2(fn, use, verbose, offsets, tlim, interval, meas))
+
+
+def _iter2(fn:Path, use:Union[str,list,tuple], verbose:bool=False,
+           offsets:tuple=None, tlim:tuple=None, interval:float=None,
+           meas:Union[str,list,tuple]=None, chunk:int=None) -> Iterator[xarray.Dataset]:
+    """
+    yield RINEX OBS data as one Dataset per chunk of epochs, or one Dataset of the whole file if chunk is None
+    """
+    with opener(fn) as f:
+        header = _header2(f)
+        if CRX in header:  # Hatanaka compressed
+            yield from _crxepochs2(f, header, use, meas, tlim, interval, chunk, verbose)
+            return
 
-  if (not use or not use[0].strip() or
-      isinstance(use,str) and use.lower() in ('m','all') or
-      isinstance(use,(tuple,list,np.ndarray)) and use[0].lower() in ('m','all')):
+        stop = None
+        if offsets is not None:
+            f.seek(max(offsets[0], f.tell()))
+            stop = offsets[1]
 
-      use = None
+        yield from _epochs2(f, header, use, meas, tlim, interval, stop, chunk, verbose)
 
 
-  with fn.open('r') as f:
+def _header2(f:BinaryIO) -> dict:
+    """read RINEX 2 OBS header, leaving f at the first epoch"""
     header={}
     Nobs = None
     # Capture header info
     for l in f:
+        l = l.decode('ascii','replace')
         if "END OF HEADER" in l:
             break
 
@@ -125,91 +142,240 @@ def _scan2(fn:Path, use:Union[str,list,tuple], verbose:bool=False) -> xarray.Dat
             header[h.strip()] += " " + c
             #concatenate to the existing string
 
-
-    verRinex = float(header['RINEX VERSION / TYPE'][:9])  # %9.2f
+    header['version'] = float(header['RINEX VERSION / TYPE'][:9])  # %9.2f
+    header['filename'] = getattr(f, 'name', None)
     # list with x,y,z cartesian
-    header['APPROX POSITION XYZ'] = [float(j) for j in header['APPROX POSITION XYZ'].split()]
+    if 'APPROX POSITION XYZ' in header:
+        header['APPROX POSITION XYZ'] = [float(j) for j in header['APPROX POSITION XYZ'].split()]
     #observation types
-    fields = header['# / TYPES OF OBSERV'].split()
-    assert Nobs == len(fields), 'header read incorrectly'
+    header['fields'] = header['# / TYPES OF OBSERV'].split()
+    header['Nobs'] = Nobs
+    assert Nobs == len(header['fields']), 'header read incorrectly'
+
+    if 'INTERVAL' in header:
+        header['INTERVAL'] = float(header['INTERVAL'][:10])
+
+    return header
 
-    header['INTERVAL'] = float(header['INTERVAL'][:10])
 
-    data = None
+def _epochs2(f:BinaryIO, header:dict, use:Union[str,list,tuple], meas:Union[str,list,tuple]=None,
+             tlim:tuple=None, interval:float=None, stop:int=None, chunk:int=None,
+             verbose:bool=False) -> Iterator[xarray.Dataset]:
+    """
+    parse the epochs from the current position of f up to byte offset stop (None: end of file)
+
+    yields a Dataset every chunk epochs, and one at the end (always, if chunk is None)
+    """
+    use = _use(use)
+    iobs, names, cols = _plan2(header['fields'], meas)
+
+    Nl_sv = int(ceil(header['Nobs']/5))  # CEIL needed for Py27 only.
+    batch = min(BATCH, chunk) if chunk else BATCH
+    attrs = _attrs2(header)
+
+    data = ObsAccumulator(names)
+    epochs = []; raws = []  # epochs waiting to be decoded together
+    keep = epochfilter(tlim, interval)
 # %% process rest of file
-    while True:
-        l = f.readline()
+    while stop is None or f.tell() < stop:
+        l = f.readline().decode('ascii','replace')
         if not l:
             break
+        if not l.strip():
+            continue
 
         eflag = int(l[28])
-        if not eflag in (0,1,5,6): # EPOCH FLAG
-             print(eflag)
+        if not eflag in (0,1,6): # EPOCH FLAG
+             for _ in range(int(l[29:32])): # event, skip special records
+                 f.readline()
              continue
 
         time =  _obstime([l[1:3],  l[4:6], l[7:9],  l[10:12], l[13:15], l[16:26]])
+        Nsv = int(l[29:32])  # Number of visible satellites this time %i3
+
+        k = keep(time)
+        if k is None: # past the end of tlim
+            break
+        elif not k:
+            for _ in range(int(ceil(Nsv/12))-1 + Nsv*Nl_sv):
+                f.readline()
+            continue
+
         if verbose:
             print(time,'\r',end="")
 
-        try:
-            toffset = l[68:80]
-        except ValueError:
-            toffset = None
+        if not data and not epochs:
+            attrs['toffset'] = l[68:80]
 # %% get SV indices
-        Nsv = int(l[29:32])  # Number of visible satellites this time %i3
         # get first 12 SV ID's
         sv = _getSVlist(l, min(12,Nsv), [])
 
         # any more SVs?
         n = Nsv-12
         while n > 0:
-            l = f.readline()
+            l = f.readline().decode('ascii','replace')
             sv = _getSVlist(l, min(12,n), sv)
             n -= 12
         assert Nsv == len(sv), 'satellite list read incorrectly'
 # %% select one, a few, or all satellites
+        gsv = [s for s in sv if use is None or s[0] in use]
+# %% read the lines of the used satellites, decoded later in one block per batch of epochs
+        for s in sv:
+            if use is None or s[0] in use:
+                raws += [f.readline() for _ in range(Nl_sv)]
+            else: # save a lot of time by not processing discarded satellites
+                for _ in range(Nl_sv):
+                    f.readline()
+
+        epochs.append((time, gsv))
+        if len(epochs) == batch:
+            _decode2(data, epochs, raws, Nl_sv, iobs, cols)
+            epochs = []; raws = []
+
+            if chunk and len(data) >= chunk:
+                yield data.to_dataset(attrs=dict(attrs))
+                data = ObsAccumulator(names)
+
+    _decode2(data, epochs, raws, Nl_sv, iobs, cols)
+
+    if data or not chunk:
+        yield data.to_dataset(attrs=attrs)
+
+
+def _crxepochs2(f:BinaryIO, header:dict, use:Union[str,list,tuple], meas:Union[str,list,tuple]=None,
+                tlim:tuple=None, interval:float=None, chunk:int=None,
+                verbose:bool=False) -> Iterator[xarray.Dataset]:
+    """
+    _epochs2() for Compact RINEX 1 (Hatanaka): the observations are restored by integrating
+    their differences, and every epoch is decoded as each continues the previous one.
+    """
+    use = _use(use)
+    iobs, names, cols = _plan2(header['fields'], meas)
+
+    batch = min(BATCH, chunk) if chunk else BATCH
+    attrs = _attrs2(header)
+
+    dec = CRXDecoder(float(header[CRX][:9]), {None: header['Nobs']})
+    data = ObsAccumulator(names)
+    epochs = []  # (time, keep, clock offset, sv, lines) waiting to be decoded together
+    keep = epochfilter(tlim, interval)
+
+    for l,sv,clock,lines in dec.records(f):
+        time = _obstime([l[1:3],  l[4:6], l[7:9],  l[10:12], l[13:15], l[16:26]])
+        k = keep(time)
+        if k is None: # past the end of tlim
+            break
+        if k and verbose:
+            print(time,'\r',end="")
+
         if use is not None:
-            iuse = [i for i,s in enumerate(sv) if s[0] in use]
-        else:
-            iuse = slice(None)
-        gsv = np.array(sv)[iuse]
-        Ngsv = len(gsv)
-# %% assign data for each time step
-        darr = np.empty((Nsv,Nobs*3))
-        Nl_sv = int(ceil(Nobs/5))  # CEIL needed for Py27 only.
-
-        for i,s in enumerate(sv):
-            raw = ''
-            for _ in range(Nl_sv):
-                raw += f.readline()[:80]
-
-            if use is not None and not s[0] in use: # save a lot of time by not processing discarded satellites
-                continue
-
-            raw = raw.replace('\n',' ')  # some files truncate and put \n in data space.
-
-            darr[i,:] = np.genfromtxt(BytesIO(raw.encode('ascii')), delimiter=[Ngsv,1,1]*Nobs)
-# % select only "used" satellites
-        garr = darr[iuse,:]
-        dsf = {}
-        for i,k in enumerate(fields):
-            dsf[k] = (('time','sv'),np.atleast_2d(garr[:,i*3]))
-            if not k in ('S1','S2'): # FIXME which other should be excluded?
-                if k in ('L1','L2'):
-                    dsf[k+'lli'] = (('time','sv'),np.atleast_2d(garr[:,i*3+1]))
-                dsf[k+'ssi'] = (('time','sv'),np.atleast_2d(garr[:,i*3+2]))
-
-        if data is None:
-            data = xarray.Dataset(dsf,coords={'time':[time],'sv':gsv}, attrs={'toffset':toffset})
-        else:
-            data = xarray.concat((data,
-                                  xarray.Dataset(dsf,coords={'time':[time],'sv':gsv}, attrs={'toffset':toffset})),
-                                  dim='time')
+            lines = [r for s,r in zip(sv,lines) if s[0] in use]
+            sv = [s for s in sv if s[0] in use]
+        epochs.append((time, k, clock, sv, lines))
+
+        if len(epochs) == batch:
+            _crxdecode2(data, dec, epochs, iobs, cols, attrs)
+            epochs = []
+
+            if chunk and len(data) >= chunk:
+                yield data.to_dataset(attrs=dict(attrs))
+                data = ObsAccumulator(names)
+                attrs.pop('toffset', None)
+
+    _crxdecode2(data, dec, epochs, iobs, cols, attrs)
+
+    if data or not chunk:
+        yield data.to_dataset(attrs=attrs)
+
+
+def _crxdecode2(data:ObsAccumulator, dec:CRXDecoder, epochs:list, iobs:list, cols:list, attrs:dict):
+    """decode a batch of Compact RINEX epochs, keeping those selected"""
+    if not epochs:
+        return
+
+    darr = dec.decode([(sv, lines) for _,_,_,sv,lines in epochs])
+    darr = darr[:, iobs, :].reshape(darr.shape[0], len(iobs)*3)[:, cols]
+
+    i = 0
+    for time,k,clock,sv,_ in epochs:
+        if k:
+            if 'toffset' not in attrs:
+                attrs['toffset'] = '{:12.9f}'.format(clock) if clock is not None else ''
+            data.add(time, sv, darr[i:i+len(sv)])
+        i += len(sv)
+
+
+def _nlines2(l:bytes, Nl_sv:int) -> int:
+    """
+    lines of the RINEX 2 epoch starting with epoch line l
+
+    Nl_sv: lines per satellite. An event (flag 2-5) is the epoch line and its Nsv special records.
+    """
+    flag = int(l[28:29])
+    Nsv = int(l[29:32])
+    if flag in (0,1,6):
+        return max(1, int(ceil(Nsv/12))) + Nsv*Nl_sv
+    else:  # event: Nsv special records follow
+        return 1 + Nsv
+
+
+def _use(use:Union[str,list,tuple]) -> Union[str,list,tuple]:
+    """None for all systems"""
+    if (not use or not use[0].strip() or
+        isinstance(use,str) and use.lower() in ('m','all') or
+        isinstance(use,(tuple,list,np.ndarray)) and use[0].lower() in ('m','all')):
+
+        return None
+
+    return use
+
+
+def _plan2(fields:list, meas:Union[str,list,tuple]) -> tuple:
+    """
+    plan which observations are decoded, and which of their (value, LLI, SSI) columns become variables
+
+    returns index of the decoded observation types, variable names, column of each variable
+    """
+    if isinstance(meas,str):
+        meas = [meas]
+
+    iobs = [i for i,k in enumerate(fields) if meas is None or any(k.startswith(m) for m in meas)]
+
+    names = []; cols = []
+    for j,i in enumerate(iobs):
+        k = fields[i]
+        names.append(k); cols.append(j*3)
+        if not k in ('S1','S2'): # FIXME which other should be excluded?
+            if k in ('L1','L2'):
+                names.append(k+'lli'); cols.append(j*3+1)
+            names.append(k+'ssi'); cols.append(j*3+2)
+
+    return iobs, names, cols
+
+
+def _attrs2(header:dict) -> dict:
+    attrs = {'filename':header['filename'],
+             'RINEX version':header['version']}
+    if 'APPROX POSITION XYZ' in header:
+        attrs['position'] = header['APPROX POSITION XYZ']
+    if 'INTERVAL' in header:
+        attrs['interval'] = header['INTERVAL']
+
+    return attrs
+
+
+def _decode2(data:ObsAccumulator, epochs:list, raws:list, Nl_sv:int, iobs:list, cols:list):
+    """decode a batch of epochs, each SV record is Nl_sv lines of 5 observations"""
+    if not epochs:
+        return
 
-    data.attrs['filename'] = f.name
-    data.attrs['RINEX version'] = verRinex
+    c = chararray(raws, 80).reshape(len(raws)//Nl_sv, Nl_sv*80)
+    darr = obsfields(c, iobs)[:,cols]
 
-    return data
+    i = 0
+    for time,sv in epochs:
+        data.add(time, sv, darr[i:i+len(sv)])
+        i += len(sv)
 
 
 def _getSVlist(l:str, N:int, sv:list) -> list:
@@ -230,7 +396,4 @@ def _obstime(fol:str) -> datetime:
     elif year<80: #because we might pass in four-digit year
         year+=2000
     return datetime(year=year, month=int(fol[1]), day= int(fol[2]),
-                    hour= int(fol[3]), minute=int(fol[4]),
-                    second=int(float(fol[5])),
-                    microsecond=int(float(fol[5]) % 1 * 100000)
-                    )
+                    hour= int(fol[3]), minute=int(fol[4])) + timedelta(seconds=float(fol[5]))
@@ -1,34 +1,80 @@
 from pathlib import Path
 import numpy as np
-from datetime import datetime
-from io import BytesIO
+from datetime import datetime, timedelta
 import xarray
 from typing import Union
-from typing.io import TextIO
+from typing import BinaryIO, Iterator
 #
+from .accumulate import ObsAccumulator
+from .index import epochfilter
+from .compress import opener
+from .hatanaka import CRXDecoder, CRX
+from .fixedwidth import chararray, obsfields, navfields, toint, todatetime, OBSW, SPACE
+from .rinex2 import _use
+
 STARTCOL3 = 4 #column where numerical data starts for RINEX 3
+BATCH = 1000 # number of OBS epochs decoded together
 """https://github.com/mvglasow/satstat/wiki/NMEA-IDs"""
 SBAS=100 # offset for ID
 GLONASS=37
 QZSS=192
 BEIDOU=0
 
-def _rinexnav3(fn:Path) -> xarray.Dataset:
+# RINEX 3 NAV record layout of each system: lines per record, and field names, None for spare fields.
+# ftp://igs.org/pub/data/format/rinex303.pdf Tables A6 (GPS), A8 (Galileo), A10 (GLONASS), A12 (QZSS), A14 (BeiDou),
+# A16 (SBAS), A18 (IRNSS)
+_KEPLER = ['SVclockBias','SVclockDrift','SVclockDriftRate',
+           'IODE','Crs','DeltaN','M0',
+           'Cuc','Eccentricity','Cus','sqrtA',
+           'Toe','Cic','omega0','Cis',
+           'Io','Crc','omega','OmegaDot']
+_STATE = ['SVclockBias','SVRelFreqBias','MsgTxTime',
+          'X','dX','dX2','SVhealth',
+          'Y','dY','dY2','URA',
+          'Z','dZ','dZ2','IODN']
+NAV3 = {'G': (8, _KEPLER + ['IDOT','CodesL2','GPSWeek','L2Pflag',
+                            'SVacc','SVhealth','TGD','IODC',
+                            'TransTime','FitIntvl']),
+        'J': (8, _KEPLER + ['IDOT','CodesL2','GPSWeek','L2Pflag',
+                            'SVacc','SVhealth','TGD','IODC',
+                            'TransTime','FitIntvl']),
+        'E': (8, ['IODnav' if f == 'IODE' else f for f in _KEPLER] +
+                 ['IDOT','DataSrc','GALWeek',None,
+                  'SISA','SVhealth','BGDe5a','BGDe5b',
+                  'TransTime']),
+        'C': (8, ['AODE' if f == 'IODE' else f for f in _KEPLER] +
+                 ['IDOT',None,'BDTWeek',None,
+                  'SVacc','SVhealth','TGD1','TGD2',
+                  'TransTime','AODC']),
+        'I': (8, ['IODEC' if f == 'IODE' else f for f in _KEPLER] +
+                 ['IDOT',None,'IRNWeek',None,
+                  'URA','SVhealth','TGD',None,
+                  'TransTime']),
+        'R': (4, ['SVclockBias','SVRelFreqBias','MsgFrameTime',
+                  'X','dX','dX2','SVhealth',
+                  'Y','dY','dY2','FreqNum',
+                  'Z','dZ','dZ2','AgeOpInfo']),
+        'S': (4, _STATE)}
+
+
+def _rinexnav3(fn:Path, use:Union[str,list,tuple]=None) -> xarray.Dataset:
     """
     Reads RINEX 3.0 NAV files
     Michael Hirsch, Ph.D.
     SciVision, Inc.
     http://www.gage.es/sites/default/files/gLAB/HTML/SBAS_Navigation_Rinex_v3.01.html
+
+    use: systems to read e.g. 'E' or ['G','R'], default all.
+    The records of all systems are read in one pass; each system's are decoded together with the layout of NAV3.
+    A Dataset of several systems has the variables of all of them, NaN for records of systems without the variable.
     """
     Lf = 19 # string length per field
 
     fn = Path(fn).expanduser()
 
-    svs = []; epoch=[]; raws=[]
-
-    with fn.open('r') as f:
+    with opener(fn) as f:
         """verify RINEX version, and that it's NAV"""
-        line = f.readline()
+        line = f.readline().decode('ascii','replace')
         ver = float(line[:9])
         assert int(ver)==3,'see _rinexnav2() for RINEX 3.0 files'
         assert line[20] == 'N', 'Did not detect Nav file'
@@ -37,37 +83,45 @@ def _rinexnav3(fn:Path) -> xarray.Dataset:
         skip header, which has non-constant number of rows
         """
         while True:
-            if 'END OF HEADER' in f.readline():
+            if b'END OF HEADER' in f.readline():
                 break
         """
-        now read data
+        now read data, all at once
         """
-        line = f.readline()
-        while True:
-            sv,time,fields = _newnav(line)
-            svs.append(sv)
-            epoch.append(time)
-# %% get the data as one big long string per SV, unknown # of lines per SV
-            raw = line[23:80]  # NOTE: 80, files put data in the last column!
-
-            while True:
-                line = f.readline()
-                if not line or line[0] != ' ': # new SV
-                    break
-
-                raw += line[STARTCOL3:80]
-            # one line per SV
-            raws.append(raw.replace('D','E'))
-
-            if not line: # EOF
-                break
-# %% parse
-    darr = np.empty((len(raws), len(fields)))
+        lines = f.read().rstrip().splitlines()
+
+    c = chararray(lines, 80)
+    # the first line of a record has the SV, continuation lines are indented.
+    starts = np.nonzero(c[:,0] != SPACE)[0]
+    Nl = np.diff(np.append(starts, len(lines)))  # unknown # of lines per SV
+
+    svtype = c[starts,0]
+    use = _use(use)  # blank, 'm' and 'all' are all systems, as for OBS
+    if use is not None:
+        keep = np.isin(svtype, np.frombuffer(''.join(use).encode('ascii'), np.uint8))
+        starts, Nl, svtype = starts[keep], Nl[keep], svtype[keep]
+
+    svs = c[starts,:3].copy().view('S3').ravel().astype(str)
+
+    epoch = todatetime(toint(c[starts,4:8]), toint(c[starts,9:11]), toint(c[starts,12:14]),
+                       toint(c[starts,15:17]), toint(c[starts,18:20]), toint(c[starts,21:23]))
+# %% parse each system's records of the same length as one block
+    dsf = {}
+    for k in svtype[np.sort(np.unique(svtype, return_index=True)[1])]:
+        Ln, fields = _navfields(chr(k))
+        for f in fields:
+            if f is not None and not f in dsf:
+                dsf[f] = ('time', np.full(starts.size, np.nan))
+
+        isys = svtype == k
+        for n in np.unique(Nl[isys]):
+            i = np.nonzero(isys & (Nl == n))[0]
+            # NOTE: 80, files put data in the last column!
+            darr = navfields(c, starts[i], min(n, Ln), 23, STARTCOL3, len(fields), Lf)
+            for f,d in zip(fields, darr.T):
+                if f is not None:
+                    dsf[f][1][i] = d
 
-    for i,r in enumerate(raws):
-        darr[i,:] = np.genfromtxt(BytesIO(r.encode('ascii')), delimiter=Lf)
-
-    dsf = {f: ('time',d) for (f,d) in zip(fields,darr.T)}
     dsf.update({'sv':('time',svs)})
 
     nav = xarray.Dataset(dsf,
@@ -79,119 +133,266 @@ def _rinexnav3(fn:Path) -> xarray.Dataset:
     return nav
 
 
-def _newnav(l:str) -> tuple:
-    sv = l[:3]
-
-    svtype = sv[0]
-
-    if svtype == 'G':
-        """ftp://igs.org/pub/data/format/rinex302.pdf page A-16, A-18"""
-        fields = ['SVclockBias','SVclockDrift','SVclockDriftRate',
-                  'IODE','Crs','DeltaN','M0',
-                  'Cuc','Eccentricity','Cus','sqrtA',
-                  'Toe','Cic','omega0','Cis',
-                  'Io','Crc','omega','OmegaDot',
-                  'IDOT','CodesL2','GPSWeek','L2Pflag',
-                  'SVacc','SVhealth','TGD','IODC',
-                  'TransTime','FitIntvl']
-    elif svtype == 'C':
-        raise NotImplementedError('Beidou Compass not yet done')
-    elif svtype == 'R':
-        raise NotImplementedError('GLONASS Not yet done')
-    elif svtype == 'S':
-        fields=['SVclockBias','SVRelFreqBias','MsgTxTime',
-                'X','dX','dX2','SVhealth',
-                'Y','dY','dY2','URA',
-                'Z','dZ','dZ2','IODN']
-    elif svtype == 'J':
-        raise NotImplementedError('QZSS not yet done')
-    elif svtype == 'E':
-        raise NotImplementedError('Galileo not yet done')
-    else:
-        raise ValueError('Unknown SV type {}'.format(sv[0]))
-
-
-    year = int(l[4:8]) # I4
-
-    time = datetime(year = year,
-                  month   =int(l[9:11]),
-                  day     =int(l[12:14]),
-                  hour    =int(l[15:17]),
-                  minute  =int(l[18:20]),
-                  second  =int(l[21:23]))
-
-    return sv, time, fields
-
-
-def _scan3(fn:Path, use:Union[str,list,tuple], verbose:bool=False) -> xarray.Dataset:
+def _navfields(svtype:str) -> tuple:
+    """NAV record lines and field names of a system"""
+    if svtype not in NAV3:
+        raise ValueError('Unknown SV type {}'.format(svtype))
+
+    return NAV3[svtype]
+
+
+def _scan3(fn:Path, use:Union[str,list,tuple], verbose:bool=False,
+           offsets:tuple=None, tlim:tuple=None, interval:float=None,
+           meas:Union[str,list,tuple]=None) -> dict:
     """
     procss RINEX OBS data
+
+    offsets: (start, stop) byte range of epochs to read, from pyrinex.index. stop None is end of file.
+    tlim, interval: epoch selection, see pyrinex.index.epochfilter().
+        The satellite lines of other epochs are skipped without being parsed.
+    meas: observation types to decode, e.g. ['C1C','C2W','L1C','L2W'], each also matching types it is a prefix of.
+        Other observation columns are never converted or allocated.
+
+    The file is read once, and each satellite line is routed to the accumulator
+    of its system, which uses that system's own SYS / # / OBS TYPES layout.
+
+    returns dict of xarray.Dataset, one per system selected by "use"
     """
+    return next(_iter3(fn, use, verbose, offsets, tlim, interval, meas))
+
 
-    with fn.open('r') as f:
+def _iter3(fn:Path, use:Union[str,list,tuple], verbose:bool=False,
+           offsets:tuple=None, tlim:tuple=None, interval:float=None,
+           meas:Union[str,list,tuple]=None, chunk:int=None) -> Iterator[dict]:
+    """
+    yield RINEX OBS data as one dict of Datasets per chunk of epochs, or one dict for the whole file if chunk is None
+    """
+    with opener(fn) as f:
         fields, header, Fmax = _getObsTypes(f, use)
+        if CRX in header:  # Hatanaka compressed
+            yield from _crxepochs3(f, fields, header, meas, tlim, interval, chunk, verbose)
+            return
 
+        stop = None
+        if offsets is not None:
+            f.seek(max(offsets[0], f.tell()))
+            stop = offsets[1]
 
-        data = None
-    # %% process rest of file
-        while True:
+        yield from _epochs3(f, fields, header, meas, tlim, interval, stop, chunk, verbose)
+
+
+def _epochs3(f:BinaryIO, fields:dict, header:dict, meas:Union[str,list,tuple]=None,
+             tlim:tuple=None, interval:float=None, stop:int=None, chunk:int=None,
+             verbose:bool=False) -> Iterator[dict]:
+    """
+    parse the epochs from the current position of f up to byte offset stop (None: end of file)
+
+    yields a dict of Datasets every chunk epochs, and one at the end (always, if chunk is None)
+    """
+    iobs, names, cols = _plan3(fields, meas)
+
+    batch = min(BATCH, chunk) if chunk else BATCH
+    attrs = _attrs3(header)
+
+    data = {k:ObsAccumulator(names[k]) for k in fields}
+    n = 0  # epochs in data
+    epochs = []; raws = {k:[] for k in fields}  # epochs waiting to be decoded together
+    keep = epochfilter(tlim, interval)
+# %% process rest of file
+    while stop is None or f.tell() < stop:
+        l = f.readline().decode('ascii','replace')
+        if not l:
+            break
+        if not l.strip():
+            continue
+
+        assert l[0] == '>'  # pg. A13
+
+        Nsv = int(l[32:35])  # Number of visible satellites this time %i3  pg. A13
+        if not int(l[31]) in (0,1,6): # EPOCH FLAG
+            for _ in range(Nsv): # event, skip special records
+                f.readline()
+            continue
+
+        time = _timeobs3(l)
+
+        k = keep(time)
+        if k is None: # past the end of tlim
+            break
+        elif not k:
+            for _ in range(Nsv):
+                f.readline()
+            continue
+
+        if verbose:
+            print(time,'\r',end="")
+# %% route each satellite line to its system
+        sv = {k:[] for k in fields}
+        for i in range(Nsv):
             l = f.readline()
-            if not l:
-                break
+            k = l[:1].decode('ascii')
+            if k in sv:
+                sv[k].append(l[:3].decode('ascii'))
+                raws[k].append(l)
+
+        epochs.append((time, sv))
+        if len(epochs) == batch:
+            _decode3(data, epochs, raws, iobs, cols)
+            n += len(epochs)
+            epochs = []; raws = {k:[] for k in fields}
+
+            if chunk and n >= chunk:
+                yield {k: acc.to_dataset(attrs=dict(attrs)) for k,acc in data.items()}
+                data = {k:ObsAccumulator(names[k]) for k in fields}
+                n = 0
+
+    _decode3(data, epochs, raws, iobs, cols)
+    n += len(epochs)
+
+    if n or not chunk:
+        yield {k: acc.to_dataset(attrs=dict(attrs)) for k,acc in data.items()}
+
+
+def _crxepochs3(f:BinaryIO, fields:dict, header:dict, meas:Union[str,list,tuple]=None,
+                tlim:tuple=None, interval:float=None, chunk:int=None,
+                verbose:bool=False) -> Iterator[dict]:
+    """
+    _epochs3() for Compact RINEX 3 (Hatanaka): the observations are restored by integrating
+    their differences, and every epoch is decoded as each continues the previous one.
+    """
+    iobs, names, cols = _plan3(fields, meas)
+
+    batch = min(BATCH, chunk) if chunk else BATCH
+    attrs = _attrs3(header)
+
+    dec = CRXDecoder(float(header[CRX][:9]), {k:len(fl) for k,fl in fields.items()})
+    data = {k:ObsAccumulator(names[k]) for k in fields}
+    n = 0  # epochs in data
+    epochs = []  # (time, keep, sv, lines) waiting to be decoded together
+    keep = epochfilter(tlim, interval)
+
+    for l,sv,_,lines in dec.records(f):
+        time = _timeobs3(l)
+        k = keep(time)
+        if k is None: # past the end of tlim
+            break
+        if k and verbose:
+            print(time,'\r',end="")
+
+        lines = [r for s,r in zip(sv,lines) if s[0] in fields]
+        sv = [s for s in sv if s[0] in fields]
+        epochs.append((time, k, sv, lines))
+
+        if len(epochs) == batch:
+            n += _crxdecode3(data, dec, epochs, iobs, cols)
+            epochs = []
+
+            if chunk and n >= chunk:
+                yield {k: acc.to_dataset(attrs=dict(attrs)) for k,acc in data.items()}
+                data = {k:ObsAccumulator(names[k]) for k in fields}
+                n = 0
+
+    n += _crxdecode3(data, dec, epochs, iobs, cols)
+
+    if n or not chunk:
+        yield {k: acc.to_dataset(attrs=dict(attrs)) for k,acc in data.items()}
+
+
+def _crxdecode3(data:dict, dec:CRXDecoder, epochs:list, iobs:dict, cols:dict) -> int:
+    """decode a batch of Compact RINEX epochs, keeping those selected. returns number of epochs kept"""
+    if not epochs:
+        return 0
+
+    darr = dec.decode([(sv, lines) for _,_,sv,lines in epochs])
+    system = np.array([v[0] for _,_,sv,_ in epochs for v in sv], dtype='U1')
+
+    for s,acc in data.items():
+        d = darr[system == s][:, iobs[s], :]
+        d = d.reshape(d.shape[0], len(iobs[s])*3)[:, cols[s]]
+
+        i = 0
+        for time,k,sv,_ in epochs:
+            sv = [v for v in sv if v[0] == s]
+            if k:
+                acc.add(time, sv, d[i:i+len(sv)])
+            i += len(sv)
+
+    return sum(1 for e in epochs if e[1])
+
+
+def _plan3(fields:dict, meas:Union[str,list,tuple]) -> tuple:
+    """
+    per-system plan of which observations are decoded, which of their (value, LLI, SSI) columns become variables
+
+    returns dicts of index of the decoded observation types, variable names, column of each variable
+    """
+    if isinstance(meas,str):
+        meas = [meas]
+
+    iobs = {}; names = {}; cols = {}
+    for k,fl in fields.items():
+        iobs[k] = [i for i,o in enumerate(fl) if meas is None or any(o.startswith(m) for m in meas)]
+
+        names[k] = []; cols[k] = []
+        for j,i in enumerate(iobs[k]):
+            o = fl[i]
+            names[k].append(o); cols[k].append(j*3)
+            if o.startswith('L1') or o.startswith('L2'):
+                names[k].append(o+'lli'); cols[k].append(j*3+1)
+            names[k].append(o+'ssi'); cols[k].append(j*3+2)
+
+    return iobs, names, cols
+
+
+def _attrs3(header:dict) -> dict:
+    attrs = {'filename':header['filename'],
+             'RINEX version':header['version']}
+    if 'APPROX POSITION XYZ' in header:
+        attrs['position'] = header['APPROX POSITION XYZ']
+    if 'INTERVAL' in header:
+        attrs['interval'] = header['INTERVAL']
+
+    return attrs
+
+
+def _decode3(data:dict, epochs:list, raws:dict, iobs:dict, cols:dict):
+    """decode a batch of epochs, one block per system"""
+    if not epochs:
+        return
+
+    darr = {}
+    for k,io in iobs.items():
+        # only as far as the last decoded observation
+        c = chararray(raws[k], (max(io, default=-1)+1)*OBSW, STARTCOL3-1)
+        darr[k] = obsfields(c, io)[:,cols[k]]
+
+    i = {k:0 for k in iobs}
+    for time,sv in epochs:
+        for k,acc in data.items():
+            n = len(sv[k])
+            acc.add(time, sv[k], darr[k][i[k]:i[k]+n])
+            i[k] += n
+
+
+def _timeobs3(l:str) -> datetime:
+    """time of RINEX 3 OBS epoch header line, pg. A13"""
+    return datetime(int(l[2:6]), int(l[7:9]), int(l[10:12]),
+                    hour=int(l[13:15]), minute=int(l[16:18])) + timedelta(seconds=float(l[18:29]))
+
+
+def _nlines3(l:bytes) -> int:
+    """lines of the RINEX 3 epoch starting with epoch line l"""
+    return 1 + int(l[32:35])  # epoch line, then a line per satellite or special record
+
 
-            assert l[0] == '>'  # pg. A13
-
-            time = datetime(int(l[2:6]), int(l[7:9]), int(l[10:12]),
-                            hour=int(l[13:15]), minute=int(l[16:18]), second=int(l[19:21]),
-                            microsecond=int(l[22:29])*1000000)
-            if verbose:
-                print(time,'\r',end="")
-# %% get SV indices
-            Nsv = int(l[33:35])  # Number of visible satellites this time %i3  pg. A13
-
-            sv = []
-            raw = ''
-            for i in range(Nsv):
-                l = f.readline()
-                k = l[:3]
-                sv.append(k)
-                raw += l[3:]
-
-            darr = np.genfromtxt(BytesIO(raw.encode('ascii')), delimiter=(14,1,1)*Fmax)
-# %% Tselect one, few, or all satellites
-            i = [i for i,s in enumerate(sv) if s[0] in use]
-            garr = darr[i,:]
-            gsv = np.array(sv)[i]
-# %% assign data for each time step
-            dsf = {}
-            for i,k in enumerate(fields):
-                dsf[k] = (('time','sv'), np.atleast_2d(garr[:,i*3]))
-                if k.startswith('L1') or k.startswith('L2'):
-                   dsf[k+'lli'] = (('time','sv'), np.atleast_2d(garr[:,i*3+1]))
-                dsf[k+'ssi'] = (('time','sv'), np.atleast_2d(garr[:,i*3+2]))
-
-            if verbose:
-                print(time,'\r',end='')
-
-            if data is None:
-                data = xarray.Dataset(dsf,coords={'time':[time],'sv':gsv})#, attrs={'toffset':toffset})
-            else:
-                data = xarray.concat((data,
-                                      xarray.Dataset(dsf,coords={'time':[time],'sv':gsv})),#, attrs={'toffset':toffset})),
-                                    dim='time')
-
-    data.attrs['filename'] = f.name
-
-    return data
-
-
-def _getObsTypes(f:TextIO, use:Union[str,list,tuple]) -> tuple:
+def _getObsTypes(f:BinaryIO, use:Union[str,list,tuple]) -> tuple:
     """ get RINEX 3 OBS types, for each system type"""
     header={}
     fields={}
     Fmax = 0
     # Capture header info
     for l in f:
+        l = l.decode('ascii','replace')
         if "END OF HEADER" in l:
             break
 
@@ -205,7 +406,7 @@ def _getObsTypes(f:TextIO, use:Union[str,list,tuple]) -> tuple:
 
             n = N-13
             while n > 0: # Rinex 3.03, pg. A6, A7
-                l = f.readline()
+                l = f.readline().decode('ascii','replace')
                 assert 'SYS / # / OBS TYPES' in l[60:]
                 fields[k] += l[6:60].split()
                 n -= 13
@@ -220,12 +421,17 @@ def _getObsTypes(f:TextIO, use:Union[str,list,tuple]) -> tuple:
         else: # concatenate to the existing string
             header[h.strip()] += " " + c
 
+    header['version'] = float(header['RINEX VERSION / TYPE'][:9])  # %9.2f
+    header['filename'] = getattr(f, 'name', None)
     # list with x,y,z cartesian
-    header['APPROX POSITION XYZ'] = [float(j) for j in header['APPROX POSITION XYZ'].split()]
+    if 'APPROX POSITION XYZ' in header:
+        header['APPROX POSITION XYZ'] = [float(j) for j in header['APPROX POSITION XYZ'].split()]
+    if 'INTERVAL' in header:
+        header['INTERVAL'] = float(header['INTERVAL'][:10])
 # %% select specific satellite systems only (optional)
-    if isinstance(use,str):
-        fields = fields[use]
-    elif isinstance(use,(tuple,list,np.ndarray)):
-        fields = [fields[u] for u in use]
+    if isinstance(use,str) and use.strip() and not use.lower() in ('m','all'):
+        fields = {use: fields[use]}
+    elif isinstance(use,(tuple,list,np.ndarray)) and not use[0].lower() in ('m','all'):
+        fields = {u: fields[u] for u in use}
 
     return fields, header, Fmax
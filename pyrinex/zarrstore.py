@@ -0,0 +1,112 @@
+"""
+Zarr output of OBS data, written chunk by chunk as the file is parsed.
+
+Each chunk of epochs from iter_obs() is appended along time as soon as it's parsed, so memory
+follows the chunk size and the epochs written so far are readable while the parse goes on.
+Satellites first seen in a later chunk grow the sv dimension of the store, the earlier epochs
+being missing for them, so sv is in order of first appearance.
+The systems of a RINEX 3 file are groups OBS/G, OBS/R, ... listed by attribute 'systems' of OBS, as in NetCDF.
+
+Needs the zarr package.
+"""
+from pathlib import Path
+import numpy as np
+import xarray
+from typing import Union, Iterator
+#
+from .accumulate import isflag, isfloat32, FILL
+from .netcdf import chunks, _select, _use
+
+
+def writezarr(data:Iterator[Union[xarray.Dataset,dict]], ofn:Path, group:str='OBS', compact:Union[bool,str]=False):
+    """
+    append OBS data chunks (Datasets, or dicts of them per system, in time order) to Zarr store ofn
+
+    group is replaced if it's already in the store.
+    """
+    ofn = Path(ofn).expanduser()
+
+    first = True
+    for obs in data:
+        if isinstance(obs, xarray.Dataset):
+            obs = {group: obs}
+        else:
+            if first:
+                xarray.Dataset(attrs={'systems': ','.join(obs)}).to_zarr(ofn, group=group, mode='w')
+            obs = {group+'/'+k: v for k,v in obs.items()}
+
+        for g,ds in obs.items():
+            if first:
+                ds.to_zarr(ofn, group=g, mode='w', encoding=encoding(ds, compact))
+            else:
+                _append(ds, ofn, g)
+        first = False
+
+
+def encoding(obs:xarray.Dataset, compact:Union[bool,str]=False) -> dict:
+    """
+    Zarr chunks of the OBS variables as for NetCDF (see pyrinex.netcdf), and the fill of compact flags
+
+    time is in integer microseconds (the resolution of the parsed epochs), as later chunks are appended in the units of the first.
+    """
+    enc = {'time': {'units': 'microseconds since 1970-01-01', 'dtype': 'int64', 'chunks': (chunks(obs, 8)[0],)}}
+    for k in obs.data_vars:
+        enc[k] = {}
+        itemsize = obs[k].dtype.itemsize
+        if compact and isflag(k):
+            enc[k]['_FillValue'] = FILL
+            itemsize = 1
+        elif compact == 'float32' and isfloat32(k):
+            itemsize = 4
+
+        if obs[k].dims == ('time', 'sv'):
+            enc[k]['chunks'] = chunks(obs, itemsize)
+
+    return enc
+
+
+def _append(obs:xarray.Dataset, ofn:Path, group:str):
+    """append obs along time to group of the store, first growing sv by the satellites new to the store"""
+    import zarr
+
+    z = zarr.open_group(str(ofn), mode='r+', path=group)
+    sv = z['sv'][:].tolist()
+    new = [s for s in obs.sv.values.tolist() if s not in set(sv)]
+    if new:
+        N = len(sv) + len(new)
+        for k in obs.data_vars:
+            if obs[k].dims == ('time', 'sv'):
+                a = z[k]
+                a.resize((a.shape[0], N))
+                a[:, len(sv):] = FILL if a.dtype == np.uint8 else np.nan  # earlier epochs are missing
+        z['sv'].resize((N,))
+        z['sv'][len(sv):] = np.array(new)
+        sv += new
+
+    fill = {k:FILL for k in obs.data_vars if obs[k].dtype == np.uint8}
+    obs.reindex(sv=sv, fill_value=fill if fill else np.nan).to_zarr(ofn, group=group, append_dim='time')
+
+
+def readzarr(fn:Path, group:str='OBS', use:Union[str,list,tuple]=None,
+             meas:Union[str,list,tuple]=None, tlim:tuple=None) -> Union[xarray.Dataset,dict]:
+    """
+    lazily open group of Zarr store fn, selecting systems, observation types and times like rinexobs()
+
+    a group with per-system groups gives a dict of the systems in use, unwrapped if just one.
+    """
+    fn = Path(fn).expanduser()
+    if isinstance(meas, str):
+        meas = [meas]
+    use = _use(use)
+
+    ds = xarray.open_dataset(fn, group=group, engine='zarr', chunks=None)
+    systems = ds.attrs.get('systems')
+    if systems is None:
+        return _select(ds, use, meas, tlim)
+
+    obs = {k: _select(xarray.open_dataset(fn, group=group+'/'+k, engine='zarr', chunks=None), None, meas, tlim)
+           for k in systems.split(',') if use is None or k in use}
+    if len(obs) == 1:
+        obs = next(iter(obs.values()))
+
+    return obs
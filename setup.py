@@ -13,9 +13,11 @@ setup(name='pyrinex',
 	  url='https://github.com/scivision/pyrinex',
 	  install_requires=install_requires,
 	  tests_require=tests_require,
-      python_requires='>=3.5',
+      python_requires='>=3.5',  # pyrinex.aio: >= 3.5.2
       extras_require={'plot':['matplotlib','seaborn','pymap3d'],
-                       'tests':tests_require,},
+                       'tests':tests_require,
+                       'zarr':['zarr'],
+                       'dask':['dask'],},
       classifiers=[
       'Development Status :: 4 - Beta',
       'Environment :: Console',
@@ -27,5 +29,6 @@ setup(name='pyrinex',
       'Topic :: Scientific/Engineering :: Atmospheric Science',
       ],
       script=['ReadRinex.py'],
+      entry_points={'xarray.backends': ['rinex=pyrinex.backend:RinexBackendEntrypoint']},
       include_package_data=True,
 	  )
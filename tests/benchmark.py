@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""
+Benchmarks of PyRinex parsing, using synthetic files made by repeating the demo files' epochs.
+
+./tests/benchmark.py decode
+./tests/benchmark.py obs2 -n 2880
+./tests/benchmark.py obs3 -n 86400 -w 8
+./tests/benchmark.py nav3 -n 5000
+"""
+import numpy as np
+import tempfile
+from io import BytesIO
+from time import time
+from pathlib import Path
+from datetime import datetime, timedelta
+#
+import pyrinex as pr
+from pyrinex.fixedwidth import chararray, obsfields
+
+rdir = Path(__file__).parent
+
+
+def synth_obs2(ofn:Path, Nepoch:int, interval:float=30.) -> Path:
+    """write a RINEX 2 OBS file of Nepoch copies of the first epoch of demo.10o"""
+    lines = (rdir/'demo.10o').read_text().splitlines()
+    i = [j for j,l in enumerate(lines) if 'END OF HEADER' in l][0] + 1
+    hdr = lines[:i]
+    epoch = lines[i:i+30]
+    t0 = datetime(2010,3,5)
+
+    with Path(ofn).open('w') as f:
+        f.write('\n'.join(hdr) + '\n')
+        for k in range(Nepoch):
+            t = t0 + timedelta(seconds=k*interval)
+            f.write(' {:02d} {:2d} {:2d} {:2d} {:2d} {:10.7f}'.format(t.year % 100, t.month, t.day,
+                                                                  t.hour, t.minute, t.second + t.microsecond/1e6))
+            f.write(epoch[0][26:] + '\n')
+            f.write('\n'.join(epoch[1:]) + '\n')
+
+    return Path(ofn)
+
+
+def synth_obs3(ofn:Path, Nepoch:int, interval:float=30.) -> Path:
+    """write a RINEX 3 OBS file of Nepoch copies of the first epoch of demo3.10o"""
+    lines = (rdir/'demo3.10o').read_text().splitlines()
+    i = [j for j,l in enumerate(lines) if 'END OF HEADER' in l][0] + 1
+    hdr = lines[:i]
+    epoch = lines[i:i+15]
+    t0 = datetime(2010,3,5)
+
+    with Path(ofn).open('w') as f:
+        f.write('\n'.join(hdr) + '\n')
+        for k in range(Nepoch):
+            t = t0 + timedelta(seconds=k*interval)
+            f.write('> {:04d} {:02d} {:02d} {:02d} {:02d} {:10.7f}'.format(t.year, t.month, t.day,
+                                                                       t.hour, t.minute, t.second + t.microsecond/1e6))
+            f.write(epoch[0][29:] + '\n')
+            f.write('\n'.join(epoch[1:]) + '\n')
+
+    return Path(ofn)
+
+
+def synth_nav(fn:Path, ofn:Path, Nrec:int) -> Path:
+    """write a NAV file of the records of NAV file fn repeated to Nrec records"""
+    lines = fn.read_text().splitlines()
+    i = [j for j,l in enumerate(lines) if 'END OF HEADER' in l][0] + 1
+    recs = lines[i:]
+    Nl = [j for j,l in enumerate(recs[1:],1) if l[:3].strip()][0]
+
+    with Path(ofn).open('w') as f:
+        f.write('\n'.join(lines[:i]) + '\n')
+        for k in range(Nrec // (len(recs)//Nl)):
+            f.write('\n'.join(recs) + '\n')
+
+    return Path(ofn)
+
+
+def bench_decode(Nrec:int=10000, Nobs:int=7):
+    """fixed-width decoder vs. one np.genfromtxt() per record"""
+    lines = (rdir/'demo.10o').read_bytes().splitlines()
+    i = [j for j,l in enumerate(lines) if b'END OF HEADER' in l][0] + 3
+    Nl = int(np.ceil(Nobs/5))
+    recs = [lines[i+j:i+j+Nl] for j in range(0, 28, Nl)]
+    recs = (recs * (Nrec//len(recs) + 1))[:Nrec]
+
+    tic = time()
+    for r in recs:
+        raw = b''.join(l[:80].ljust(80) for l in r)
+        np.genfromtxt(BytesIO(raw), delimiter=[14,1,1]*Nobs)
+    tgen = time() - tic
+
+    tic = time()
+    c = chararray([l for r in recs for l in r], 80).reshape(Nrec, Nl*80)
+    obsfields(c, range(Nobs))
+    tfw = time() - tic
+
+    print('{} records: genfromtxt {:.3f} sec   fixedwidth {:.4f} sec   {:.0f}x'.format(Nrec, tgen, tfw, tgen/tfw))
+
+
+def bench_obs(ver:int, Nepoch:int, workers:int=None):
+    """whole-file rinexobs() time"""
+    with tempfile.TemporaryDirectory() as d:
+        if ver == 2:
+            fn = synth_obs2(Path(d)/'bench.10o', Nepoch)
+        else:
+            fn = synth_obs3(Path(d)/'bench.10o', Nepoch)
+
+        tic = time()
+        pr.rinexobs(fn, workers=workers)
+        print('RINEX {} OBS {} epochs, {} workers: {:.3f} sec'.format(ver, Nepoch, workers or 1, time()-tic))
+
+
+def bench_nav(fn:Path, Nrec:int):
+    """whole-file rinexnav() time"""
+    with tempfile.TemporaryDirectory() as d:
+        fn = synth_nav(fn, Path(d)/('bench'+fn.suffix), Nrec)
+
+        tic = time()
+        nav = pr.rinexnav(fn)
+        print('RINEX {} NAV {} records: {:.3f} sec'.format(int(nav.attrs['RINEX version']), nav.time.size, time()-tic))
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    p = ArgumentParser(description='PyRinex benchmarks')
+    p.add_argument('bench',help='which benchmark',choices=['decode','obs2','obs3','nav2','nav3'])
+    p.add_argument('-n',help='number of records / epochs',type=int,default=10000)
+    p.add_argument('-w','--workers',help='OBS parsing processes',type=int)
+    p = p.parse_args()
+
+    if p.bench == 'decode':
+        bench_decode(p.n)
+    elif p.bench == 'obs2':
+        bench_obs(2, p.n, p.workers)
+    elif p.bench == 'obs3':
+        bench_obs(3, p.n, p.workers)
+    elif p.bench == 'nav2':
+        bench_nav(rdir/'demo.10n', p.n)
+    elif p.bench == 'nav3':
+        bench_nav(rdir/'demo.17n', p.n)
@@ -5,13 +5,33 @@ for OBS RINEX reader
 """
 import xarray
 import tempfile
-from numpy.testing import  run_module_suite
+import shutil
+import numpy as np
+import pytest
 #
 from pathlib import Path
-from pyrinex import readrinex, rinexobs, rinexnav
+from pyrinex import readrinex, rinexobs, rinexnav, obsindex, load_index, iter_obs, convert_many, compactobs, follow_obs, rinexheader, open_mfrinex
+from pyrinex.fixedwidth import chararray, obsfields, tofloat
+from pyrinex.ephemeris import sv_positions, navindex, navselect
 #
 rdir=Path(__file__).parent
 
+def test_fixedwidth():
+    """blank fields, Fortran D exponents and short lines"""
+    c = chararray([b' 121367582.20508  94572134.4920\r\n',
+                   b'                  -.123456D+02 9',
+                   b''], 32)
+    darr = obsfields(c, [0,1])
+
+    assert darr.shape == (3,6)
+    assert darr[0,:3].tolist() == [121367582.205, 0, 8]
+    assert darr[0,3] == 94572134.492 and np.isnan(darr[0,5])
+    assert np.isnan(darr[1,:3]).all()
+    assert darr[1,3:].tolist()[::2] == [-12.3456, 9]
+    assert np.isnan(darr[2]).all()
+
+    assert np.isnan(tofloat(chararray([b'1.2.3'], 5))).all()
+
 # %% RINEX 2
 def test_convenience():
     truth = xarray.open_dataset(rdir/'test2all.nc', group='OBS')
@@ -97,6 +117,537 @@ def test_obs3_multisat():
         assert obs[u].equals(truth)
 
 
+def test_obs3_allsat():
+    """all systems come from one pass over the file"""
+    obs = rinexobs(rdir/'demo3.10o')
+    assert sorted(obs) == ['G','R','S']
+
+    for u in ('G','R'):
+        truth = xarray.open_dataset(rdir/(u+'-test3GR.nc'), group='OBS')
+        assert obs[u].equals(truth)
+
+
+def test_obsindex():
+    import warnings
+
+    for fn,nsv in (('demo.10o',[14,8]), ('demo3.10o',[14,8])):
+        idx = obsindex(rdir/fn)
+        assert idx['nsv'].tolist() == nsv
+        assert (idx['flag'] == 0).all()
+        assert (idx['time'] == np.array(['2010-03-05T00:00:00','2010-03-05T00:00:30'], dtype='datetime64[ns]')).all()
+
+        with (rdir/fn).open('rb') as f:
+            f.seek(idx['offset'][1])
+            assert f.read(1) in (b' ',b'>')
+
+    with tempfile.TemporaryDirectory() as d:
+        fn = Path(d)/'demo.10o'
+        shutil.copy(rdir/'demo.10o', fn)
+        assert load_index(fn) is None
+
+        idx = obsindex(fn, sidecar=True)
+        assert (load_index(fn) == idx).all()
+
+        # an event with a blank time is indexed at the time of the epoch before it
+        for name,cols in (('crx2.10o',slice(1,26)), ('crx3.10o',slice(2,29))):
+            fn = Path(d)/name
+            raw = bytearray((rdir/name).read_bytes())
+            idx = obsindex(rdir/name)
+            i = int(np.nonzero(idx['flag'] == 4)[0][0])
+            o = int(idx['offset'][i])
+            raw[o+cols.start:o+cols.stop] = b' '*(cols.stop - cols.start)
+            fn.write_bytes(raw)
+
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')
+                blank = obsindex(fn)
+            assert blank['time'][i] == idx['time'][i-1]
+            assert (np.delete(blank, i) == np.delete(idx, i)).all()
+
+
+def test_obs_tlim():
+    """read one epoch, seeking via the index"""
+    t = '2010-03-05T00:00:30'
+
+    truth = xarray.open_dataset(rdir/'test2all.nc', group='OBS')
+    obs = rinexobs(rdir/'demo.10o', tlim=(t,t))
+    assert obs.time.size == 1 and obs.sv.size == 8
+    assert obs.equals(truth.sel(time=obs.time, sv=obs.sv))
+
+    truth = xarray.open_dataset(rdir/'G-test3GR.nc', group='OBS')
+    obs = rinexobs(rdir/'demo3.10o', use='G', tlim=('2010-03-05','2010-03-05T00:00:10'))
+    assert obs.time.size == 1
+    assert obs.equals(truth.sel(time=obs.time, sv=obs.sv))
+
+    obs = rinexobs(rdir/'demo3.10o', use='G', tlim=('2011-01-01','2011-01-02'))
+    assert obs.time.size == 0
+
+
+def test_obs_interval():
+    """decimation skips epochs off the grid"""
+    truth = xarray.open_dataset(rdir/'test2all.nc', group='OBS')
+
+    obs = rinexobs(rdir/'demo.10o', interval=60)
+    assert obs.time.size == 1
+    assert obs.equals(truth.sel(time=obs.time, sv=obs.sv))
+
+    obs,nav = readrinex(rdir/'demo3.10o', use='R', interval=60, tlim=('2010-03-05T00:00:30','2010-03-06'))
+    assert obs.time.size == 0
+
+
+def test_obs_meas():
+    """only the requested observation types and their LLI/SSI"""
+    truth = xarray.open_dataset(rdir/'test2all.nc', group='OBS')
+    meas = ['C1','P2','L1','L2']
+
+    obs = rinexobs(rdir/'demo.10o', meas=meas)
+    assert sorted(obs.data_vars) == sorted(['C1','C1ssi','P2','P2ssi','L1','L1lli','L1ssi','L2','L2lli','L2ssi'])
+    assert obs.equals(truth[list(obs.data_vars)])
+
+    truth = xarray.open_dataset(rdir/'G-test3GR.nc', group='OBS')
+    obs = rinexobs(rdir/'demo3.10o', use=['G','R'], meas=['L1','C1C'])
+    assert list(obs['G'].data_vars) == ['L1C','L1Clli','L1Cssi','C1C','C1Cssi']
+    assert obs['G'].equals(truth[list(obs['G'].data_vars)])
+    assert list(obs['R'].data_vars) == ['L1C','L1Clli','L1Cssi','C1C','C1Cssi']
+
+    obs = rinexobs(rdir/'demo3.10o', use='S', meas='P2')
+    assert not obs.data_vars and obs.time.size == 2
+
+
+def test_iter_obs():
+    truth = xarray.open_dataset(rdir/'test2all.nc', group='OBS')
+
+    chunks = list(iter_obs(rdir/'demo.10o', chunk_epochs=1))
+    assert len(chunks) == 2
+    for c in chunks:
+        assert c.time.size == 1 and c.attrs['RINEX version'] == 2.11
+        assert c.equals(truth.sel(time=c.time, sv=c.sv))
+
+    chunks = list(iter_obs(rdir/'demo3.10o', chunk_epochs=1, use=['G','R'], meas='L1C'))
+    assert len(chunks) == 2
+    assert (chunks[1]['R'].L1C.values == xarray.open_dataset(rdir/'R-test3GR.nc', group='OBS').L1C[1].values).all()
+
+
+def test_obs_workers():
+    for fn in ('demo.10o', 'demo3.10o'):
+        serial = rinexobs(rdir/fn, use='m')
+        par = rinexobs(rdir/fn, use='m', workers=2)
+        if isinstance(serial, dict):
+            assert serial.keys() == par.keys()
+            for k in serial:
+                assert par[k].identical(serial[k])
+        else:
+            assert par.identical(serial)
+
+    tlim = ('2010-03-05T00:00:30', '2010-03-05T00:00:30')
+    assert rinexobs(rdir/'demo.10o', tlim=tlim, workers=2).identical(rinexobs(rdir/'demo.10o', tlim=tlim))
+
+    # the GLONASS satellites drop out after epoch 10: parts without them keep the file's SV order
+    lines = (rdir/'demo3.10o').read_text().splitlines()
+    i = [j for j,l in enumerate(lines) if 'END OF HEADER' in l][0] + 1
+    epoch = lines[i:i+15]
+    with tempfile.TemporaryDirectory() as d:
+        fn = Path(d)/'drop3.10o'
+        with fn.open('w') as f:
+            f.write('\n'.join(lines[:i]) + '\n')
+            for k in range(60):
+                sats = [l for l in epoch[1:] if k < 10 or l[0] != 'R']
+                f.write('> 2010 03 05 {:02d} {:02d} 00.0000000  0{:3d}'.format(k//60, k%60, len(sats)) + epoch[0][35:] + '\n')
+                f.write('\n'.join(sats) + '\n')
+
+        serial = rinexobs(fn)
+        par = rinexobs(fn, workers=2)
+        assert serial['R'].sv.values.tolist() == ['R19','R23','R11']
+        for k in serial:
+            assert par[k].identical(serial[k])
+
+        # a bad epoch fails the last worker: the shared memory of the others is released all the same
+        fn = Path(d)/'bad3.10o'
+        with fn.open('w') as f:
+            f.write('\n'.join(lines[:i]) + '\n')
+            for k in range(60):
+                f.write('> 2010 {:02d} 05 {:02d} {:02d} 00.0000000  0 14'.format(13 if k == 50 else 3, k//60, k%60)
+                        + epoch[0][35:] + '\n')
+                f.write('\n'.join(epoch[1:]) + '\n')
+
+        shm = set(Path('/dev/shm').glob('*'))
+        with pytest.raises(ValueError):
+            rinexobs(fn, workers=2)
+        assert set(Path('/dev/shm').glob('*')) == shm
+
+
+def test_obs_workers_pickled(monkeypatch):
+    """without multiprocessing.shared_memory (Python < 3.8) the workers return the data pickled"""
+    import sys, multiprocessing
+    monkeypatch.setitem(sys.modules, 'multiprocessing.shared_memory', None)
+    monkeypatch.delattr(multiprocessing, 'shared_memory', raising=False)
+
+    for fn in ('demo.10o', 'demo3.10o'):
+        serial = rinexobs(rdir/fn)
+        par = rinexobs(rdir/fn, workers=2)
+        for k in (serial if isinstance(serial, dict) else [None]):
+            assert (par[k] if k else par).identical(serial[k] if k else serial)
+
+
+def test_compressed():
+    """compressed files are read directly, classified through the compression suffix"""
+    import gzip, bz2, lzma, zipfile
+
+    truth = xarray.open_dataset(rdir/'test2all.nc', group='OBS')
+    assert rinexobs(rdir/'demo.10o.Z').equals(truth)
+
+    with tempfile.TemporaryDirectory() as d:
+        d = Path(d)
+        raw = (rdir/'demo.10o').read_bytes()
+        (d/'demo.10o.gz').write_bytes(gzip.compress(raw))
+        (d/'demo.10o.bz2').write_bytes(bz2.compress(raw))
+        (d/'demo.10o.xz').write_bytes(lzma.compress(raw))
+        (d/'demo.10o.misnamed').write_bytes(gzip.compress(raw))  # detected by its magic bytes
+        with zipfile.ZipFile(d/'demo.10o.zip', 'w') as z:  # the first file, after its directory
+            z.writestr('data/', b'')
+            z.write(rdir/'demo.10o', 'data/demo.10o')
+
+        for suffix in ('.gz', '.bz2', '.xz', '.zip'):
+            obs,nav = readrinex(d/('demo.10o'+suffix))
+            assert obs.equals(truth)
+        assert rinexobs(d/'demo.10o.misnamed').equals(truth)
+
+        t = '2010-03-05T00:00:30'
+        obs = rinexobs(d/'demo.10o.gz', tlim=(t,t), workers=2)
+        assert obs.equals(rinexobs(rdir/'demo.10o', tlim=(t,t)))
+
+        (d/'demo.17n.gz').write_bytes(gzip.compress((rdir/'demo.17n').read_bytes()))
+        obs,nav = readrinex(d/'demo.17n.gz')
+        assert nav.equals(xarray.open_dataset(rdir/'test3gps.nc', group='NAV'))
+
+
+def test_hatanaka():
+    """
+    Compact RINEX made by rnx2crx 4.1 from crx2.10o, crx3.10o:
+    arcs over 12 epochs with satellites dropping out, a blank observation, LLI changes and an event
+    """
+    plain = rinexobs(rdir/'crx2.10o')
+    assert plain.time.size == 12
+    assert rinexobs(rdir/'crx2.10d').equals(plain)
+
+    plain = rinexobs(rdir/'crx3.10o')
+    obs = rinexobs(rdir/'crx3.10d')
+    for k in plain:
+        assert obs[k].equals(plain[k])
+
+    opts = {'use':'G', 'meas':['L1','C1'], 'tlim':('2010-03-05T00:01','2010-03-05T00:04'), 'interval':60}
+    assert rinexobs(rdir/'crx3.10d', **opts).equals(rinexobs(rdir/'crx3.10o', **opts))
+
+    chunks = list(iter_obs(rdir/'crx2.10d', chunk_epochs=5))
+    assert [c.time.size for c in chunks] == [5,5,2]
+    assert xarray.concat(chunks, dim='time').equals(rinexobs(rdir/'crx2.10o').sel(sv=chunks[0].sv))
+
+    with tempfile.TemporaryDirectory() as d:
+        fn = Path(d)/'crx2.10d.gz'
+        fn.write_bytes(__import__('gzip').compress((rdir/'crx2.10d').read_bytes()))
+        obs,nav = readrinex(fn)
+        assert obs.equals(rinexobs(rdir/'crx2.10o'))
+
+
+def test_cache():
+    from pyrinex.cache import evict
+
+    with tempfile.TemporaryDirectory() as d:
+        cache = Path(d)/'cache'
+        fn = Path(d)/'demo3.10o'
+        shutil.copy2(rdir/'demo3.10o', fn)
+
+        obs = rinexobs(fn, use='m', cache_dir=cache)
+        assert len(list(cache.glob('*.nc'))) == 1
+        cached = rinexobs(fn, use='m', cache_dir=cache)
+        assert cached.keys() == obs.keys()
+        for k in obs:
+            assert cached[k].equals(obs[k])
+
+        assert rinexobs(fn, use='G', meas='L1', cache_dir=cache).equals(rinexobs(fn, use='G', meas='L1'))
+        assert len(list(cache.glob('*.nc'))) == 2
+
+        assert rinexnav(rdir/'demo.10n', cache_dir=cache).equals(rinexnav(rdir/'demo.10n', cache_dir=cache))
+        assert len(list(cache.glob('*.nc'))) == 3
+# %% changed file is a new entry
+        with fn.open('a') as f:
+            f.write('\n')
+        rinexobs(fn, use='G', meas='L1', cache_dir=cache)
+        assert len(list(cache.glob('*.nc'))) == 4
+# %% least recently used are evicted
+        rinexnav(rdir/'demo.10n', cache_dir=cache)
+        nav = max(cache.glob('*.nc'), key=lambda f: f.stat().st_mtime)
+        evict(cache, size=nav.stat().st_size)
+        assert list(cache.glob('*')) == [nav]
+
+
+def test_compact():
+    truth = xarray.open_dataset(rdir/'test2all.nc', group='OBS')
+
+    obs = rinexobs(rdir/'demo.10o', compact=True)
+    assert obs.L1lli.dtype == np.uint8 and obs.P2ssi.dtype == np.uint8 and obs.L1.dtype == np.float64
+    assert ((obs.L1lli == 255) == truth.L1lli.isnull()).all()
+    assert (obs.L1lli.values[truth.L1lli.notnull().values] == truth.L1lli.values[truth.L1lli.notnull().values]).all()
+
+    obs = rinexobs(rdir/'demo3.10o', use='G', compact='float32')
+    assert obs.S1C.dtype == np.float32 and obs.C1C.dtype == np.float64 and obs.L1Clli.dtype == np.uint8
+
+    with tempfile.TemporaryDirectory() as d:
+        ofn = Path(d)/'compact.nc'
+        rinexobs(rdir/'demo.10o', ofn=ofn, compact=True)
+        with xarray.open_dataset(ofn, group='OBS', mask_and_scale=False) as raw:
+            assert raw.L1lli.dtype == np.uint8 and raw.L1lli.attrs['_FillValue'] == 255
+        with xarray.open_dataset(ofn, group='OBS') as obs:  # fill decodes to NaN
+            assert obs.equals(truth)
+
+
+def test_netcdf_select():
+    """systems are groups of one file, and .nc reads select systems, observation types and times"""
+    from netCDF4 import Dataset
+    from pyrinex.netcdf import chunks
+
+    obs = rinexobs(rdir/'demo3.10o')
+    t = '2010-03-05T00:00:30'
+    with tempfile.TemporaryDirectory() as d:
+        ofn = Path(d)/'test3.nc'
+        rinexobs(rdir/'demo3.10o', ofn=ofn)
+        assert [f.name for f in Path(d).iterdir()] == ['test3.nc']
+        with Dataset(ofn) as nc:
+            assert sorted(nc['OBS'].groups) == ['G','R','S'] and nc['OBS'].systems == 'G,R,S'
+            v = nc['OBS/G']['L1C']
+            assert v.chunking() == [2, 10] and v.filters()['shuffle']  # tiny file: one chunk
+
+        nc = rinexobs(ofn)
+        for k in obs:
+            assert nc[k].equals(obs[k])
+
+        sel = rinexobs(ofn, use='G', meas='L1', tlim=(t,t))
+        assert list(sel.data_vars) == ['L1C','L1Clli','L1Cssi'] and sel.time.size == 1
+        assert sel.equals(obs['G'][['L1C','L1Clli','L1Cssi']].sel(time=[np.datetime64(t)]))
+
+        assert sorted(rinexobs(ofn, use=['G','R'])) == ['G','R']
+
+        ofn = Path(d)/'test2.nc'
+        rinexobs(rdir/'demo.10o', ofn=ofn)
+        sel = rinexobs(ofn, use='R', meas=['C1','P2'])
+        assert sel.sv.size == 3 and all(s.startswith('R') for s in sel.sv.values)
+        assert sel.equals(rinexobs(rdir/'demo.10o', meas=['C1','P2']).sel(sv=sel.sv))
+
+    day = xarray.Dataset(coords={'time': np.arange(2880)*np.timedelta64(30,'s') + np.datetime64('2018-01-01'),
+                                 'sv': ['G{:02d}'.format(i) for i in range(32)]})
+    assert chunks(day, 8) == (120, 17)  # an hour, and at least 16 kB
+    day['time'] = np.arange(2880)*np.timedelta64(1,'s') + np.datetime64('2018-01-01')
+    assert chunks(day, 8) == (2880, 1)
+
+    nav = rinexnav(rdir/'test3gps.nc', use='G', tlim=('2017-11-17T03:00', '2017-11-17T05:00'))
+    assert nav.sv.values.tolist() == ['G02','G05']
+
+
+def test_zarr():
+    pytest.importorskip('zarr')
+    from pyrinex.zarrstore import writezarr
+
+    with tempfile.TemporaryDirectory() as d:
+        ofn = Path(d)/'test3.zarr'
+        obs = rinexobs(rdir/'demo3.10o')
+        z = rinexobs(rdir/'demo3.10o', ofn=ofn)
+        assert sorted(z) == ['G','R','S']
+        for k in obs:
+            assert z[k].equals(obs[k])
+        assert rinexobs(ofn, use='R', meas='C1').equals(obs['R'][['C1C','C1Cssi']])
+# %% satellites appearing in later chunks grow sv
+        c1,c2 = iter_obs(rdir/'demo.10o', chunk_epochs=1, compact=True)
+        c1 = c1.isel(sv=[0,9,13])
+        ofn = Path(d)/'demo.zarr'
+        writezarr([c1, c2], ofn, compact=True)
+        z = rinexobs(ofn)
+        assert z.sv.values.tolist() == c1.sv.values.tolist() + [s for s in c2.sv.values if s not in c1.sv]
+        compactobs(z)  # compact flags are NaN where missing when read
+        fill = {k:255 for k in c1.data_vars if k.endswith('lli') or k.endswith('ssi')}
+        truth = xarray.concat((c1,c2), dim='time', join='outer', fill_value=fill).sel(sv=z.sv)
+        assert (z.time == truth.time).all()
+        assert z.equals(truth.assign_coords(time=z.time))
+
+
+def test_follow_obs():
+    """epochs appended to a file being written are read as they're completed"""
+    import threading
+
+    for fn in ('demo.10o', 'demo3.10o'):
+        truth = rinexobs(rdir/fn, use='G')
+        raw = (rdir/fn).read_bytes()
+        idx = obsindex(rdir/fn)
+
+        with tempfile.TemporaryDirectory() as d:
+            live = Path(d)/fn
+            live.write_bytes(raw[:idx['offset'][1] + 100])  # second epoch partly written
+
+            new = follow_obs(live, poll=0.01, timeout=0.1, use='G')
+            obs = next(new)
+            assert obs.time.size == 1 and obs.equals(truth.isel(time=[0]).sel(sv=obs.sv))
+
+            def append(a, b):
+                with live.open('ab') as f:
+                    f.write(raw[a:b])
+
+            # the rest of the epoch in two pieces: the incomplete tail carries over polls
+            append(idx['offset'][1] + 100, idx['offset'][1] + 200)
+            threading.Timer(0.03, append, (idx['offset'][1] + 200, None)).start()
+            obs = next(new)
+            assert obs.time.size == 1 and obs.equals(truth.isel(time=[1]).sel(sv=obs.sv))
+
+            assert not list(new)  # timeout without more epochs
+
+
+def test_aio():
+    """concurrent streams from loopback servers, sent in pieces that split lines"""
+    import asyncio
+    from pyrinex.aio import connect_obs
+
+    files = ('demo.10o', 'demo3.10o')
+
+    def sender(fn):
+        async def send(reader, writer):
+            raw = (rdir/fn).read_bytes()
+            for i in range(0, len(raw), 100):
+                writer.write(raw[i:i+100])
+                await writer.drain()
+                await asyncio.sleep(0.001)
+            writer.close()
+        return send
+
+    async def receive(port):
+        out = []
+        async for obs in connect_obs('127.0.0.1', port, use='G', chunk_epochs=1, flush=None):
+            out.append(obs)
+        return out
+
+    async def main():
+        servers = [await asyncio.start_server(sender(fn), '127.0.0.1', 0) for fn in files]
+        res = await asyncio.gather(*(receive(s.sockets[0].getsockname()[1]) for s in servers))
+        for s in servers:
+            s.close()
+        return res
+
+    loop = asyncio.new_event_loop()
+    try:
+        res = loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+    for fn, obs in zip(files, res):
+        truth = rinexobs(rdir/fn, use='G')
+        assert len(obs) == 2
+        for i,o in enumerate(obs):
+            assert o.attrs['filename'].startswith('127.0.0.1:')
+            assert o.equals(truth.isel(time=[i]).sel(sv=o.sv))
+
+
+def test_rinexheader():
+    """metadata from the header alone, and the last epoch from the end of the file"""
+    from datetime import datetime
+
+    h = rinexheader(rdir/'demo3.10o')
+    assert (h.version, h.filetype, h.system, h.marker, h.interval) == (3.01, 'obs', 'M', 'MRKR', 30.)
+    assert h.position == (4789028.4701, 176610.0133, 4195017.031)
+    assert sorted(h.fields) == ['G','R','S'] and len(h.fields['G']) == 12 and h.fields['R'] == ['L1C','S1C','C1C']
+    assert h.first == datetime(2010,3,5) and h.last == datetime(2010,3,5,23,59,30)  # as the header says
+
+    for fn in ('demo.10o', 'demo3.10o', 'demo.10o.Z'):
+        assert rinexheader(rdir/fn, tail=True).last == datetime(2010,3,5,0,0,30)
+
+    h = rinexheader(rdir/'crx2.10d')
+    assert h.hatanaka and h.fields == {'M': ['L1','L2','P1','P2','C1','S1','S2']}
+
+    h = rinexheader(rdir/'demo.10n')
+    assert (h.filetype, h.system, h.fields, h.first) == ('nav', 'G', {}, None)
+    assert rinexheader(rdir/'demo3.10n').system == 'S'
+
+    with tempfile.TemporaryDirectory() as d:
+        fn = Path(d)/'demo.10o'
+        fn.write_bytes(b''.join(l for l in (rdir/'demo.10o').open('rb') if b'TIME OF' not in l))
+        h = rinexheader(fn)
+        assert h.first == datetime(2010,3,5) and h.last is None
+
+
+def test_backend():
+    """xarray.open_dataset(engine='rinex') reads just the epochs and variables indexed"""
+    from pyrinex.backend import RinexBackendEntrypoint as rinex
+
+    for fn,use in (('demo.10o',None), ('demo.10o','G'), ('demo3.10o','R'), ('crx2.10o',None), ('crx2.10d',None)):
+        obs = xarray.open_dataset(rdir/fn, engine=rinex, use=use)
+        assert obs.equals(rinexobs(rdir/fn, use=use))
+    assert list(xarray.open_dataset(rdir/'demo3.10o', engine=rinex, meas='L1').data_vars) == ['L1C','L1Clli','L1Cssi']
+
+    for fn in ('crx2.10d', 'crx3.10d.gz', 'demo_MO.crx', 'demo.10o.Z'):
+        assert rinex().guess_can_open(fn)
+    for fn in ('README.md', 'rinex.pxd', 'demo.10n', 'demo.nc'):
+        assert not rinex().guess_can_open(fn)
+
+    with tempfile.TemporaryDirectory() as d:
+        fn = Path(d)/'demo.10o'
+        shutil.copy(rdir/'demo.10o', fn)
+        truth = rinexobs(fn)
+        obs = xarray.open_dataset(fn, engine=rinex)
+
+        idx = obsindex(fn)
+        raw = bytearray(fn.read_bytes())
+        i = raw.index(b'\n', idx['offset'][0]) + 1
+        raw[i:idx['offset'][1]] = bytes(c if c in b'\r\n' else ord('X') for c in raw[i:idx['offset'][1]])
+        fn.write_bytes(raw)  # first epoch's observations garbled after opening
+
+        assert obs.C1.isel(time=1).equals(truth.C1.isel(time=1))
+        assert obs.L1.isel(time=0).isnull().all()
+
+
+def test_backend_mf():
+    pytest.importorskip('dask')
+    from pyrinex.backend import RinexBackendEntrypoint as rinex
+
+    obs = xarray.open_mfdataset([rdir/'demo.10o', rdir/'crx2.10o'], engine=rinex, combine='nested', concat_dim='time', join='outer')
+    assert obs.time.size == 14 and obs.C1.isel(time=1).compute().equals(rinexobs(rdir/'demo.10o').C1.isel(time=1))
+
+
+def test_open_mfrinex():
+    """stations x days as one dask Dataset, each file its own chunks"""
+    pytest.importorskip('dask')
+
+    with tempfile.TemporaryDirectory() as d:
+        d = Path(d)
+        shutil.copy(rdir/'demo.10o', d/'mrkr0640.10o')
+        raw = (rdir/'crx2.10o').read_bytes().replace(b'MRKR  ', b'ABCD  ', 1)
+        (d/'abcd0640.10o').write_bytes(raw)
+
+        obs = open_mfrinex(d, use='G', meas=['C1','L1'], chunks={'time': 4})
+        assert obs.station.values.tolist() == ['ABCD','MRKR'] and obs.time.size == 12
+        assert sorted(obs.data_vars) == ['C1','C1ssi','L1','L1lli','L1ssi']
+        assert obs.C1.chunks[0] == (1,1) and max(obs.C1.chunks[1]) <= 4
+
+        for s,fn in (('ABCD','abcd0640.10o'), ('MRKR','mrkr0640.10o')):
+            truth = rinexobs(d/fn, use='G', meas=['C1','L1'])
+            assert obs.sel(station=s, time=truth.time, sv=truth.sv).drop_vars('station').equals(truth)
+
+
+def test_convert_many():
+    with tempfile.TemporaryDirectory() as d:
+        d = Path(d)
+        for fn in ('demo.10o', 'demo.10n'):
+            shutil.copy(rdir/fn, d)
+        (d/'bad.10o').write_text('garbage\n')
+        (d/'README.md').write_text('not RINEX\n')  # names that aren't RINEX are left alone
+        (d/'meta.json').write_text('{}\n')
+
+        res = convert_many(d, d/'out', workers=2, summary=d/'summary.csv')
+        assert [(r['file'].name, r['status']) for r in res] == [('bad.10o','error'), ('demo.10n','ok'), ('demo.10o','ok')]
+        assert not (d/'out'/'bad.10o.nc').exists()
+        assert rinexobs(d/'out'/'demo.10o.nc').equals(rinexobs(rdir/'demo.10o'))
+        assert len((d/'summary.csv').read_text().splitlines()) == 4
+
+        res = convert_many(str(d/'*.10?'), d/'out', workers=1)
+        assert [r['status'] for r in res] == ['error', 'skipped', 'skipped']
+        assert [r['file'].name for r in convert_many(str(d/'*'), d/'out', workers=1)] == ['bad.10o', 'demo.10n', 'demo.10o']
+
+
 def test_nav3sbas():
     """./ReadRinex.py tests/demo3.10n -o tests/test3sbas.nc"""
     truth = xarray.open_dataset(rdir/'test3sbas.nc', group='NAV')
@@ -112,5 +663,113 @@ def test_nav3gps():
     assert nav.equals(truth)
 
 
+def test_navmixed():
+    """one pass over a mixed RINEX 3 NAV file of GPS, GLONASS, Galileo, BeiDou, QZSS and SBAS"""
+    nav = rinexnav(rdir/'demo_MN.rnx')
+
+    assert nav.sv.values.tolist() == ['G01','R01','R02','E01','E01','C11','J01','S22']
+    assert nav.FreqNum.values[1:3].tolist() == [1, -4]
+    assert nav.Z.values[2] == pytest.approx(2.092069287109e4)
+    assert nav.GALWeek.values[3:5].tolist() == [1975, 1975]
+    assert nav.BDTWeek.values[5] == 619 and nav.TGD2.values[5] == -1.55e-8
+    assert nav.sqrtA.values[6] == pytest.approx(6493.232780457)
+    assert nav.IODN.values[7] == 23
+    assert np.isnan(nav.sqrtA.values[[1,2,7]]).all()
+
+    glo = rinexnav(rdir/'demo_MN.rnx', use='R')
+    assert glo.sv.values.tolist() == ['R01','R02']
+    assert 'sqrtA' not in glo and glo.X.values[0] == -1.213476904297e4
+
+    for u in ('m','all',' ','',['m']):  # all systems, as for OBS
+        assert rinexnav(rdir/'demo_MN.rnx', use=u).equals(nav)
+
+    assert sv_positions(nav, '2017-11-17T00:02').sv.values.tolist() == ['G01','J01','S22']
+
+
+def test_ephemeris():
+    """IS-GPS-200 positions, one epoch or many at once, and SBAS"""
+    nav = rinexnav(rdir/'demo.10n')
+    pos = sv_positions(nav, '1999-09-02T19:00')
+
+    assert pos.sv.values.tolist() == ['G06','G13']
+    assert pos.x.values[0] == pytest.approx([-5025270.642, -14968991.706], abs=1e-3)
+    assert pos.y.values[0] == pytest.approx([-25156727.682, -18044570.299], abs=1e-3)
+    assert pos.z.values[0] == pytest.approx([6400599.213, 12582789.774], abs=1e-3)
+    assert pos.clock.values[0] == pytest.approx([-8.397113143e-4, 4.900246545e-4], rel=1e-9)
+
+    nav = rinexnav(rdir/'demo.17n')
+    t = np.datetime64('2017-11-17T00:00') + np.arange(0, 6*3600, 30).astype('timedelta64[s]')
+    pos = sv_positions(nav, t, sv=['G01','G05','G32'])
+    r = np.sqrt(pos.x**2 + pos.y**2 + pos.z**2)
+
+    assert pos.x.shape == (720, 3)
+    # fit intervals: Toe 00:00 and 04:00 +-2 hours
+    assert (r[:241,0].notnull()).all() and r[241:,0].isnull().all()
+    assert (r[240:,1].notnull()).all() and r[:240,1].isnull().all()
+    assert ((r > 25.8e6) & (r < 27.4e6)).sum() == 241 + 480
+    assert r[:,2].isnull().all()
+    one = sv_positions(nav, t[500], sv=['G05'])
+    assert one.x.item() == pytest.approx(pos.x[500,1].item(), abs=1e-6)
+
+    nav = rinexnav(rdir/'demo3.10n')
+    pos = sv_positions(nav, nav.time.values)
+
+    assert pos.x.values[:,0] == pytest.approx(nav.X.values*1e3)
+    assert pos.clock.values[:,0] == pytest.approx(nav.SVclockBias.values)
+
+
+def test_navindex():
+    """merged NAV files, health and fit intervals"""
+    nav = rinexnav(rdir/'demo.17n')
+    merged = xarray.concat((nav, nav.isel(time=[3,1])), dim='time')
+    merged['SVhealth'][0] = 1
+
+    idx = navindex(merged)
+    assert idx['sv'].tolist() == ['G02','G03','G05']
+    assert idx['record'].tolist() == [5, 2, 4]  # repeated broadcasts: the last
+
+    t = np.array(['2017-11-16T21:59', '2017-11-17T01:59', '2017-11-17T02:00', '2017-11-17T06:01'], dtype='datetime64[ns]')
+    rec = navselect(idx, np.array(['G01','G03','G05'])[None,:], t[:,None])
+    assert rec.tolist() == [[-1,-1,-1], [-1,2,-1], [-1,2,4], [-1,-1,-1]]
+    assert navselect(idx, 'G05', t).tolist() == rec[:,2].tolist()
+
+
+def test_derived():
+    """slant TEC of a known ionosphere, leveled over arcs broken by a gap, loss of lock and a cycle slip"""
+    from pyrinex.derived import slant_tec, geometry_free, iono_free, melbourne_wubbena, K, C
+
+    T = 3600
+    t = np.datetime64('2017-11-17') + np.arange(T).astype('timedelta64[s]')
+    f1, f2 = 1575.42e6, 1227.60e6
+    tec = 20 + 10*np.sin(np.arange(T)[:,None]/600 + np.arange(3))
+    rho = 2.2e7 + 700*np.arange(T)[:,None]
+    noise = np.random.default_rng(0).normal(0, 0.05, (2, T, 3))
+    P1 = rho + K*tec*1e16/f1**2 + noise[0]
+    P2 = rho + K*tec*1e16/f2**2 + noise[1]
+    amb = np.where(np.arange(T)[:,None] < T//2, 1e3, 3e3)  # unflagged slip at T/2
+    L1 = (rho - K*tec*1e16/f1**2) * f1/C + amb
+    L2 = (rho - K*tec*1e16/f2**2) * f2/C - 2*amb
+    L1[600:900,0] = np.nan  # gap
+    L1[1200:,1] += 7
+    lli = np.zeros((T,3))
+    lli[1200,1] = 1  # loss of lock
+
+    obs = xarray.Dataset({k: (('time','sv'), v) for k,v in zip(('P1','P2','L1','L2','L1lli'), (P1,P2,L1,L2,lli))},
+                         coords={'time': t, 'sv': ['G 7','G12','G31']})
+    stec = slant_tec(obs)
+
+    assert stec.dims == ('time','sv')
+    assert np.isnan(stec.values[600:900,0]).all()
+    assert np.nanmax(abs(stec.values - tec)) < 0.1
+    assert abs(slant_tec(obs, level=False).values - tec).max() > 1
+    assert np.nanmax(abs(iono_free(obs).values - rho)) < 3
+    mw = melbourne_wubbena(obs)
+    assert np.nanmax(abs(mw[1:T//2,2].values - mw[0,2].item())) < 5
+    # RINEX 3 names
+    obs3 = obs.rename({'P1':'C1C','P2':'C2W','L1':'L1C','L2':'L2W','L1lli':'L1Clli'})
+    assert np.nanmax(abs(slant_tec(obs3).values - tec)) < 0.1
+    assert geometry_free(obs3).equals(geometry_free(obs))
+
+
 if __name__ == '__main__':
-    run_module_suite()
+    pytest.main(['-x', __file__])